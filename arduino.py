@@ -1,22 +1,30 @@
 #!/usr/bin/env python3
 
+import os
 import time
 import serial, serial.tools.list_ports
 import traceback
 
 class Arduino:
-    def __init__(self, desc='arduino', bps=115200):
+    def __init__(self, desc='arduino', bps=115200, device=None):
         self.desc = desc.lower()
         self.bps = bps
+        self.device = device
         self.port = None
         self.serial = None
     
     def get_port(self):
+        # Un dispositivo explícito (por ejemplo, un pty de pruebas) no necesita aparecer en la lista de puertos.
+        if self.device:
+            if not os.path.exists(self.device): return None
+            return serial.tools.list_ports_common.ListPortInfo(self.device)
+        
+        ports = self.get_ports()
+        return ports[0] if ports else None
+    
+    def get_ports(self):
         ports = serial.tools.list_ports.comports()
-        for p in ports:
-            if self.desc in p.description.lower():
-                return p
-        return None
+        return [p for p in ports if self.desc in p.description.lower()]
     
     def is_available(self):
         return (self.get_port() is not None)
@@ -64,6 +72,16 @@ class Arduino:
         
         return wr
     
+    # Descarta lo recibido que todavía no se leyó.
+    def reset_input(self):
+        if not self.serial: return
+        
+        try:
+            self.serial.reset_input_buffer()
+        except:
+            traceback.print_exc()
+            self.disconnect()
+    
     def recv(self, size=1):
         if not self.serial: return None
         
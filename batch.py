@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from settings import *
+
+# Expande directorios y patrones glob a una lista ordenada de archivos PNG (sin repetidos).
+def collectPngPaths(inputs, recursive=False):
+    paths = []
+
+    for item in inputs:
+        item = os.path.expanduser(os.path.expandvars(item))
+
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*.png") if recursive else os.path.join(item, "*.png")
+            found = glob.glob(pattern, recursive=recursive)
+        else:
+            found = glob.glob(item, recursive=recursive)
+
+        for path in sorted(found):
+            path = os.path.abspath(path)
+            if path.lower().endswith(".png") and os.path.isfile(path) and path not in paths:
+                paths.append(path)
+
+    return paths
+
+
+# Convierte un archivo PNG en un proceso del pool. Las rutas de salida siguen la misma convención que la interfaz gráfica.
+def convertPngFile(png_path, write_svg=True):
+    from PIL import Image, UnidentifiedImageError
+    from conversion import convertPngToGcode
+
+    png_filename = os.path.splitext(png_path)[0]
+    svg_path = (png_filename + ".svg") if write_svg else None
+    gcode_path = png_filename + ".gcode"
+
+    start = time.monotonic()
+    stats = {}
+
+    try:
+        with Image.open(fp=png_path, formats=["PNG"]) as image:
+            success = convertPngToGcode(
+                image,
+                gcode_path,
+                MAX_WIDTH_MM,
+                MAX_HEIGHT_MM,
+                OFFSET_X_MM,
+                OFFSEY_Y_MM,
+                svg_path=svg_path,
+                stats=stats,
+            )
+        error = None if success else "la conversión falló"
+    except UnidentifiedImageError:
+        success = False
+        error = "no es una imagen PNG"
+    except Exception as e:
+        traceback.print_exc()
+        success = False
+        error = str(e) or e.__class__.__name__
+
+    return {
+        "png_path": png_path,
+        "svg_path": svg_path,
+        "gcode_path": gcode_path,
+        "success": success,
+        "error": error,
+        "elapsed": time.monotonic() - start,
+        "stats": stats,
+    }
+
+
+# Guarda todas las conversiones exitosas en una sola escritura.
+def saveConversions(results, name, last_name):
+    from storage import openConversionStore
+
+    store = openConversionStore(batch_size=len(results) + 1)
+    try:
+        for r in results:
+            if r["success"]:
+                store.add(name, last_name, r["png_path"], r["svg_path"] or "")
+        return store.flush()
+    finally:
+        store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Conversión por lotes de imágenes PNG a G-code, sin interfaz gráfica."
+    )
+    parser.add_argument("inputs", nargs="+", help="directorios o patrones glob con imágenes PNG")
+    parser.add_argument("-r", "--recursive", action="store_true", help="buscar también en subdirectorios")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="número de procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--no-svg", action="store_true", help="no generar el SVG para el registro histórico")
+    parser.add_argument("--db", action="store_true", help="registrar las conversiones en la tabla `conversions`")
+    parser.add_argument("--name", help="nombre a registrar en la base de datos")
+    parser.add_argument("--last-name", help="apellido a registrar en la base de datos")
+    args = parser.parse_args(argv)
+
+    if args.db and (not args.name or not args.last_name):
+        parser.error("--db requiere --name y --last-name")
+
+    if args.db and args.no_svg:
+        parser.error("--db requiere generar el SVG")
+
+    png_paths = collectPngPaths(args.inputs, args.recursive)
+    if not png_paths:
+        print("No se encontraron imágenes PNG.", file=sys.stderr)
+        return 1
+
+    print("Convirtiendo %u imágenes con %u procesos." % (len(png_paths), max(args.jobs, 1)))
+
+    start = time.monotonic()
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+        futures = {
+            executor.submit(convertPngFile, path, not args.no_svg): path
+            for path in png_paths
+        }
+
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {
+                    "png_path": path,
+                    "svg_path": None,
+                    "gcode_path": None,
+                    "success": False,
+                    "error": str(e) or e.__class__.__name__,
+                    "elapsed": 0.0,
+                    "stats": {},
+                }
+
+            results[path] = result
+
+            if result["success"]:
+                stats = result["stats"]
+                print(
+                    'OK     "%s" (%.2f s, %u -> %u puntos, %u -> %u bytes).'
+                    % (
+                        path,
+                        result["elapsed"],
+                        stats.get("points_before", 0),
+                        stats.get("points_after", 0),
+                        stats.get("bytes_before", 0),
+                        stats.get("bytes_after", 0),
+                    )
+                )
+            else:
+                print('ERROR  "%s": %s.' % (path, result["error"]))
+
+    results = [results[path] for path in png_paths]
+    failed = sum(1 for r in results if not r["success"])
+
+    print(
+        "%u conversiones exitosas, %u fallidas en %.2f s."
+        % (len(results) - failed, failed, time.monotonic() - start)
+    )
+
+    if args.db:
+        try:
+            saved = saveConversions(results, args.name, args.last_name)
+            print("%u registros guardados en la base de datos." % (saved))
+        except:
+            traceback.print_exc()
+            print("¡No se pudo guardar el registro de conversiones en la base de datos!", file=sys.stderr)
+            return 1
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        pass
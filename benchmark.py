@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+import gc
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+
+from PIL import Image, ImageDraw, ImageFilter, ImageOps
+
+import conversion
+from settings import *
+from route import optimize_route
+
+BENCHMARK_VERSION = 2
+
+BENCHMARK_IMAGES = ('gradient', 'lineart', 'photo', 'noise')
+BENCHMARK_SIZES = (256, 512)
+
+# Área de dibujo (ancho, alto, desplazamiento x, desplazamiento y) en mm, la misma de las conversiones reales.
+BENCHMARK_MM = (MAX_WIDTH_MM, MAX_HEIGHT_MM, OFFSET_X_MM, OFFSEY_Y_MM)
+
+# Una etapa es una regresión si su tiempo (o memoria) supera el de referencia en más de esta fracción
+# y además la diferencia absoluta supera el umbral correspondiente (para ignorar el ruido de las etapas muy rápidas).
+REGRESSION_THRESHOLD = 0.2
+REGRESSION_MIN_TIME = 0.005
+REGRESSION_MIN_BYTES = 1024 * 1024
+
+# Tamaño de mosaico de la etapa getcontours[tiled], menor que TILE_SIZE para que las imágenes de prueba tengan varios mosaicos.
+BENCHMARK_TILE = 128
+
+# Separación entre las dos copias de las líneas en la etapa sortlines[clustered], en píxeles.
+BENCHMARK_CLUSTER_GAP = 100000
+
+# Imágenes sintéticas reproducibles: misma semilla, mismos píxeles. El ancho es "size" y el alto 3/4 de él.
+def makeimage(kind, size, seed=0):
+    rng = random.Random('%s-%u-%u' % (kind, size, seed))
+    w, h = size, size * 3 // 4
+    
+    if kind == 'gradient':
+        linear = Image.linear_gradient('L').rotate(-90).resize((w, h))
+        radial = Image.radial_gradient('L').resize((w, h))
+        return Image.blend(linear, radial, 0.5).convert('RGB')
+    
+    if kind == 'lineart':
+        image = Image.new('RGB', (w, h), (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        for i in range(size // 8):
+            x0, x1 = sorted(rng.randrange(w) for j in range(2))
+            y0, y1 = sorted(rng.randrange(h) for j in range(2))
+            box = (x0, y0, x1, y1)
+            width = rng.randint(1, 4)
+            shape = rng.randrange(3)
+            if shape == 0:
+                draw.line([(rng.randrange(w), rng.randrange(h)) for j in range(rng.randint(2, 6))], fill=(0, 0, 0), width=width)
+            elif shape == 1:
+                draw.ellipse(box, outline=(0, 0, 0), width=width)
+            else:
+                draw.rectangle(box, outline=(0, 0, 0), width=width)
+        return image
+    
+    if kind == 'photo':
+        # Fondo de baja frecuencia con formas suavizadas, similar a una fotografía.
+        small = Image.frombytes('RGB', (8, 6), rng.randbytes(8 * 6 * 3))
+        image = small.resize((w, h), Image.BICUBIC)
+        draw = ImageDraw.Draw(image)
+        for i in range(12):
+            x, y, r = rng.randrange(w), rng.randrange(h), rng.randint(size // 32, size // 6)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for j in range(3)))
+        image = image.filter(ImageFilter.GaussianBlur(size / 256))
+        grain = Image.frombytes('L', (w, h), rng.randbytes(w * h)).convert('RGB')
+        return Image.blend(image, grain, 0.08)
+    
+    if kind == 'noise':
+        return Image.frombytes('RGB', (w, h), rng.randbytes(w * h * 3))
+    
+    raise ValueError('Tipo de imagen desconocido: %s' % (kind))
+
+# Mismo preprocesamiento que vectorisegroups(), sin cambiar la resolución.
+def prepare(image):
+    return ImageOps.autocontrast(image.convert('L'), 10)
+
+# Elige el camino de find_edges(): OpenCV, appmask_np() (NumPy) o, con numpy=False, appmask() en Python puro.
+class edgebackend:
+    def __init__(self, opencv, numpy=True):
+        self.opencv = opencv
+        self.numpy = numpy
+    
+    def __enter__(self):
+        self.saved = (conversion.no_cv, conversion.no_np)
+        conversion.no_cv = not self.opencv
+        conversion.no_np = conversion.no_np or not self.numpy
+    
+    def __exit__(self, *args):
+        conversion.no_cv, conversion.no_np = self.saved
+
+# Ejecuta fn() "repeat" veces y una vez más bajo tracemalloc para obtener el pico de memoria.
+# La memoria reservada fuera del intérprete (por ejemplo, dentro de OpenCV) no se contabiliza.
+def measure(fn, repeat):
+    times = []
+    for r in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    return result, {
+        'time_s': min(times),
+        'median_s': statistics.median(times),
+        'peak_bytes': peak,
+    }
+
+# Las mismas líneas dos veces, con la segunda copia a BENCHMARK_CLUSTER_GAP píxeles en diagonal: dos zonas densas
+# en un área casi vacía, el caso en el que una rejilla dimensionada por el área total queda con celdas llenas.
+def clustered(lines, gap=BENCHMARK_CLUSTER_GAP):
+    return lines + lines.translated(gap, gap)
+
+def points(lines):
+    return sum(len(l) for l in lines)
+
+# Mide cada etapa de la conversión sobre una imagen. Devuelve {etapa: resultado}.
+# Cada etapa recibe la salida de la anterior, como en la conversión real.
+def benchmarkimage(image, repeat, stages=None, tmpdir=None):
+    results = {}
+    
+    def wanted(stage):
+        return not stages or stage in stages
+    
+    # Las etapas no seleccionadas se ejecutan igual (una vez) para alimentar a las siguientes.
+    def run(stage, fn, count=None):
+        if not wanted(stage):
+            return fn()
+        result, r = measure(fn, repeat)
+        if count is not None:
+            r['items'] = count(result)
+        results[stage] = r
+        return result
+    
+    image = prepare(image)
+    
+    # El camino en Python puro se mide aunque NumPy esté instalado, para comparar con appmask_np().
+    if conversion.no_np or wanted('find_edges[appmask]'):
+        with edgebackend(False, numpy=False):
+            edges = run('find_edges[appmask]', lambda: conversion.find_edges(image.copy()), lambda e: e.histogram()[255])
+    if not conversion.no_np:
+        with edgebackend(False):
+            edges = run('find_edges[appmask_np]', lambda: conversion.find_edges(image.copy()), lambda e: e.histogram()[255])
+    if not conversion.no_cv:
+        with edgebackend(True):
+            edges = run('find_edges[opencv]', lambda: conversion.find_edges(image.copy()), lambda e: e.histogram()[255])
+    
+    dots1, dots2 = run('getdots', lambda: conversion.edgedots(edges), lambda d: sum(len(row) for rows in d for row in rows))
+    run('connectdots', lambda: (conversion.connectdots(dots1), conversion.connectdots(dots2)), lambda c: len(c[0]) + len(c[1]))
+    
+    options = conversion.VECTORISE_OPTIONS
+    contours = run('getcontours', lambda: conversion.getcontours(image, options['draw_contours'], options['stride'], tile=0), len)
+    if wanted('getcontours[tiled]'):
+        run('getcontours[tiled]', lambda: conversion.getcontours(image, options['draw_contours'], options['stride'], tile=BENCHMARK_TILE), len)
+    
+    w, h = image.size
+    hatches = run('hatch', lambda: conversion.hatch(image.resize((max(w // 16, 1), max(h // 16, 1))), 16), len)
+    
+    lines = run('sortlines', lambda: conversion.sortlines(contours + hatches), len)
+    if wanted('sortlines[clustered]'):
+        run('sortlines[clustered]', lambda: conversion.sortlines(clustered(contours + hatches)), len)
+    if not lines:
+        return results
+    
+    bounds = conversion.getbounds(lines)
+    scale = (BENCHMARK_MM[0] / bounds[0], BENCHMARK_MM[1] / bounds[1])
+    lines = run('simplify', lambda: conversion.simplify(lines, conversion.SIMPLIFY_TOLERANCE_MM, scale)[0], points)
+    lines = run('optimize_route', lambda: optimize_route(lines, conversion.ROUTE_TIME_BUDGET, scale), len)
+    
+    svg = run('makesvg', lambda: conversion.makesvg(lines, *BENCHMARK_MM, bounds), len)
+    
+    if wanted('makegcode'):
+        run('makegcode', lambda: '\n'.join(conversion.makegcode(lines, *BENCHMARK_MM, bounds=bounds)), len)
+    
+    if wanted('convertSvgToGcode'):
+        svg_path = os.path.join(tmpdir, 'benchmark.svg')
+        gcode_path = os.path.join(tmpdir, 'benchmark.gcode')
+        with open(svg_path, 'w') as svg_file:
+            svg_file.write(svg)
+        
+        def svgtogcode():
+            if not conversion.convertSvgToGcode(svg_path, gcode_path):
+                raise RuntimeError('convertSvgToGcode falló')
+            return os.path.getsize(gcode_path)
+        
+        run('convertSvgToGcode', svgtogcode, lambda size: size)
+    
+    return results
+
+def environment():
+    env = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pillow': Image.__version__,
+        'numpy': None,
+        'opencv': None,
+    }
+    if not conversion.no_np:
+        env['numpy'] = conversion.np.__version__
+    if not conversion.no_cv:
+        env['opencv'] = conversion.cv2.__version__
+    return env
+
+def runbenchmark(images=BENCHMARK_IMAGES, sizes=BENCHMARK_SIZES, repeat=3, stages=None, seed=0, verbose=True):
+    report = {
+        'version': BENCHMARK_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': [],
+    }
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            for kind in images:
+                image = makeimage(kind, size, seed)
+                for stage, r in benchmarkimage(image, repeat, stages, tmpdir).items():
+                    r = dict({'image': kind, 'size': size, 'stage': stage}, **r)
+                    report['results'].append(r)
+                    if verbose:
+                        printresult(r)
+    
+    return report
+
+def resultkey(r):
+    return (r['image'], r['size'], r['stage'])
+
+def printresult(r, base=None):
+    line = '%-9s %5u  %-20s %9.2f ms %9.1f MB' % (r['image'], r['size'], r['stage'], r['time_s'] * 1000.0, r['peak_bytes'] / 1048576.0)
+    if base:
+        line += '   x%.2f tiempo, x%.2f memoria' % (r['time_s'] / max(base['time_s'], 1e-9), r['peak_bytes'] / max(base['peak_bytes'], 1))
+    print(line)
+
+# Compara un informe con otro de referencia. Devuelve la lista de regresiones: (resultado, referencia, motivos).
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD, min_time=REGRESSION_MIN_TIME, min_bytes=REGRESSION_MIN_BYTES):
+    base = {resultkey(r): r for r in baseline['results']}
+    regressions = []
+    
+    for r in report['results']:
+        b = base.get(resultkey(r))
+        if b is None:
+            continue
+        
+        reasons = []
+        if r['time_s'] > b['time_s'] * (1.0 + threshold) and r['time_s'] - b['time_s'] > min_time:
+            reasons.append('tiempo')
+        if r['peak_bytes'] > b['peak_bytes'] * (1.0 + threshold) and r['peak_bytes'] - b['peak_bytes'] > min_bytes:
+            reasons.append('memoria')
+        if 'items' in r and 'items' in b and r['items'] != b['items']:
+            reasons.append('resultado')
+        
+        if reasons:
+            regressions.append((r, b, reasons))
+    
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mide el tiempo y la memoria de cada etapa de la conversión sobre imágenes sintéticas.')
+    parser.add_argument('-o', '--output', help='guardar los resultados en este archivo JSON')
+    parser.add_argument('-b', '--baseline', help='comparar con los resultados de referencia de este archivo JSON')
+    parser.add_argument('-t', '--threshold', type=float, default=REGRESSION_THRESHOLD, help='aumento relativo tolerado antes de considerar una regresión (por defecto, %(default)s)')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='repeticiones de cada etapa; se informa el mejor tiempo (por defecto, %(default)s)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(BENCHMARK_SIZES), help='anchos de imagen en píxeles')
+    parser.add_argument('--images', nargs='+', choices=BENCHMARK_IMAGES, default=list(BENCHMARK_IMAGES), help='tipos de imagen sintética')
+    parser.add_argument('--stages', nargs='+', help='medir sólo estas etapas')
+    parser.add_argument('--seed', type=int, default=0, help='semilla de las imágenes sintéticas')
+    args = parser.parse_args(argv)
+    
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != BENCHMARK_VERSION:
+            print('Aviso: la referencia es de otra versión del benchmark; las etapas con el mismo nombre pueden medir otra cosa.', file=sys.stderr)
+        if baseline.get('seed') != args.seed:
+            print('Aviso: la referencia usa otra semilla; las imágenes no son las mismas.', file=sys.stderr)
+        if baseline.get('environment', {}).get('opencv') != environment()['opencv'] or baseline.get('environment', {}).get('numpy') != environment()['numpy']:
+            print('Aviso: la referencia se midió con otras versiones de NumPy/OpenCV.', file=sys.stderr)
+    
+    report = runbenchmark(args.images, args.sizes, max(args.repeat, 1), args.stages, args.seed, verbose=baseline is None)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Resultados guardados en "%s".' % (args.output))
+    
+    if baseline is None:
+        return 0
+    
+    base = {resultkey(r): r for r in baseline['results']}
+    for r in report['results']:
+        printresult(r, base.get(resultkey(r)))
+    
+    regressions = compare(report, baseline, args.threshold)
+    for r, b, reasons in regressions:
+        print('REGRESIÓN %s %u %s (%s): %.2f -> %.2f ms, %.1f -> %.1f MB.' % (
+            r['image'], r['size'], r['stage'], ', '.join(reasons),
+            b['time_s'] * 1000.0, r['time_s'] * 1000.0, b['peak_bytes'] / 1048576.0, r['peak_bytes'] / 1048576.0,
+        ))
+    
+    if regressions:
+        print('%u regresiones respecto de "%s".' % (len(regressions), args.baseline))
+        return 1
+    
+    print('Sin regresiones respecto de "%s".' % (args.baseline))
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import traceback
+
+# Incrementar cuando cambie el formato de salida para invalidar entradas antiguas.
+CACHE_VERSION = 1
+
+CACHE_EXTENSIONS = ('.gcode', '.svg')
+
+# Caché en disco de conversiones, direccionada por el contenido de la imagen y los parámetros de conversión.
+# Cada entrada guarda el G-code y el SVG generados. Al superar "max_bytes" se eliminan las entradas usadas hace más tiempo.
+class ConversionCache:
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        
+        os.makedirs(self.path, exist_ok=True)
+    
+    def key(self, image, params):
+        # Importado al usarse: conversion.py carga NumPy, OpenCV y PIL, y la caché se crea al iniciar la interfaz.
+        from conversion import flatten
+        
+        # Se usan los píxeles que efectivamente recibe la vectorización (fondo transparente aplanado, en RGB).
+        rgb = flatten(image).convert('RGB')
+        
+        h = hashlib.sha256()
+        h.update(json.dumps({'version': CACHE_VERSION, 'size': rgb.size, 'params': params}, sort_keys=True).encode('utf-8'))
+        h.update(rgb.tobytes())
+        
+        return h.hexdigest()
+    
+    def entry(self, key, ext):
+        return os.path.join(self.path, key + ext)
+    
+    # Copia la entrada a las rutas de salida. Devuelve False si no existe.
+    def get(self, key, gcode_path, svg_path):
+        with self.lock:
+            try:
+                if not all(os.path.isfile(self.entry(key, ext)) for ext in CACHE_EXTENSIONS):
+                    self.misses += 1
+                    return False
+                
+                for ext, dst in zip(CACHE_EXTENSIONS, (gcode_path, svg_path)):
+                    src = self.entry(key, ext)
+                    shutil.copyfile(src, dst)
+                    # La fecha de modificación marca el último uso (LRU).
+                    os.utime(src)
+            except:
+                traceback.print_exc()
+                self.misses += 1
+                return False
+            
+            self.hits += 1
+            return True
+    
+    def put(self, key, gcode_path, svg_path):
+        with self.lock:
+            try:
+                for ext, src in zip(CACHE_EXTENSIONS, (gcode_path, svg_path)):
+                    dst = self.entry(key, ext)
+                    tmp = dst + '.tmp'
+                    shutil.copyfile(src, tmp)
+                    os.replace(tmp, dst)
+                
+                self.evict()
+            except:
+                traceback.print_exc()
+    
+    def entries(self):
+        entries = {}
+        
+        for name in os.listdir(self.path):
+            key, ext = os.path.splitext(name)
+            if ext not in CACHE_EXTENSIONS:
+                continue
+            
+            st = os.stat(os.path.join(self.path, name))
+            size, mtime = entries.get(key, (0, 0.0))
+            entries[key] = (size + st.st_size, max(mtime, st.st_mtime))
+        
+        return entries
+    
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for size, mtime in entries.values())
+        
+        for key in sorted(entries, key=lambda k: entries[k][1]):
+            if total <= self.max_bytes:
+                break
+            
+            for ext in CACHE_EXTENSIONS:
+                try:
+                    os.remove(self.entry(key, ext))
+                except FileNotFoundError:
+                    pass
+            
+            total -= entries[key][0]
+            self.evictions += 1
+    
+    def stats(self):
+        with self.lock:
+            entries = self.entries()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for size, mtime in entries.values()),
+            }
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+import traceback
+import contextlib
+
+from events import emit
+
+# Estados de la conexión con el Arduino.
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+
+# Intervalo entre revisiones del puerto, en segundos.
+WATCH_INTERVAL = 1.0
+
+# Tiempo máximo que un trabajo espera a que el Arduino esté conectado, en segundos.
+# Cubre el reinicio automático del Arduino al abrir el puerto (la espera de 2 s de Arduino.connect()).
+CONNECT_TIMEOUT = 5.0
+
+# Conexión persistente con el Arduino: el puerto queda abierto entre trabajos, así que cada trabajo se ahorra
+# la enumeración de puertos y el reinicio del Arduino al abrirlo. Un hilo vigila el puerto en segundo plano:
+# si el Arduino se desconecta cierra el puerto y, cuando vuelve a aparecer, lo reabre sin intervención de la interfaz.
+# "state" es uno de DISCONNECTED, CONNECTING o CONNECTED; "events" (un events.EventBus) recibe un evento
+# "connection" con "state" y "device" en cada cambio.
+class ArduinoConnection:
+    def __init__(self, arduino, interval=WATCH_INTERVAL, events=None):
+        self.arduino = arduino
+        self.interval = interval
+        self.events = events
+        self.state = DISCONNECTED
+        self.device = None
+        self.description = None
+        # Se toma durante cada trabajo y durante cada conexión; el vigilante no toca el puerto mientras tanto.
+        self.lock = threading.RLock()
+        self.changed = threading.Condition()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.identity = None
+    
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='arduino-watcher', daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        
+        with self.lock:
+            self.arduino.disconnect()
+            self.setstate(DISCONNECTED)
+    
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except:
+                traceback.print_exc()
+            
+            if self.stopping.wait(self.interval):
+                break
+    
+    def setstate(self, state):
+        with self.changed:
+            if state == self.state:
+                return
+            self.state = state
+            self.device = self.arduino.port.device if state != DISCONNECTED and self.arduino.port else None
+            self.description = self.arduino.port.description if state != DISCONNECTED and self.arduino.port else None
+            self.changed.notify_all()
+        
+        emit(self.events, 'connection', state=state, device=self.device)
+    
+    def is_connected(self):
+        return self.state == CONNECTED
+    
+    # Identidad del nodo del dispositivo: al desconectar y reconectar el Arduino, el sistema crea un nodo nuevo
+    # aunque la ruta sea la misma, y el puerto abierto sobre el nodo anterior ya no sirve.
+    def portidentity(self, device):
+        try:
+            st = os.stat(device)
+        except OSError:
+            return None
+        return st.st_ino, st.st_rdev
+    
+    # Verifica que el puerto abierto siga siendo el del Arduino conectado.
+    def present(self):
+        port = self.arduino.port
+        if not self.arduino.serial or not port:
+            return False
+        
+        if os.name == 'posix':
+            return self.identity is not None and self.portidentity(port.device) == self.identity
+        
+        # En Windows los puertos COM no tienen un nodo en el sistema de archivos: hay que enumerarlos.
+        import serial.tools.list_ports
+        return any(p.device == port.device for p in serial.tools.list_ports.comports())
+    
+    # Una revisión del vigilante. Si hay un trabajo en curso no hace nada: el envío detecta sus propios errores.
+    def check(self):
+        if not self.lock.acquire(blocking=False):
+            return
+        
+        try:
+            if self.arduino.serial and self.present():
+                self.setstate(CONNECTED)
+                return
+            
+            if self.arduino.serial:
+                print('Arduino desconectado: %s.' % (self.device))
+                self.arduino.disconnect()
+                self.setstate(DISCONNECTED)
+            
+            self.connect()
+        finally:
+            self.lock.release()
+    
+    def connect(self):
+        with self.lock:
+            if self.arduino.serial:
+                return True
+            
+            if not self.arduino.is_available():
+                self.setstate(DISCONNECTED)
+                return False
+            
+            self.setstate(CONNECTING)
+            if not self.arduino.connect():
+                self.setstate(DISCONNECTED)
+                return False
+            
+            self.identity = self.portidentity(self.arduino.port.device) if os.name == 'posix' else None
+            self.setstate(CONNECTED)
+            return True
+    
+    # Espera a que el Arduino esté conectado, hasta "timeout" segundos. Devuelve True si lo está.
+    def wait(self, timeout=CONNECT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while self.state != CONNECTED:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (self.state == DISCONNECTED and not self.thread):
+                    break
+                self.changed.wait(remaining)
+            return self.state == CONNECTED
+    
+    # Entrega el Arduino conectado (o None) para un trabajo, con el puerto reservado hasta el final del bloque.
+    # Si el envío falla, Arduino cierra el puerto; al terminar el bloque el vigilante lo vuelve a abrir.
+    # Con el puerto abierto pueden quedar respuestas de un trabajo anterior: GcodeSender las descarta antes de enviar.
+    @contextlib.contextmanager
+    def acquire(self, timeout=CONNECT_TIMEOUT):
+        self.wait(timeout)
+        
+        with self.lock:
+            # Sin vigilante, o si el puerto se cerró justo antes, conectar directamente.
+            if not self.arduino.serial:
+                self.connect()
+            
+            try:
+                yield self.arduino if self.arduino.serial else None
+            finally:
+                if not self.arduino.serial:
+                    self.setstate(DISCONNECTED)
@@ -1,20 +1,58 @@
+import bisect
+import io
+import itertools
 import math
+import os
+import time
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 
 from PIL import Image, ImageOps
 
 from svg_to_gcode.svg_parser import parse_file
 from svg_to_gcode.compiler import Compiler, interfaces
 
+from route import optimize_route, route_metrics
+from events import stage
+from geometry import Polylines, PolylineGroups, PolylineStream, endpoints, reorder
+
+no_np = False
 no_cv = False
 
 try:
     import numpy as np
+except:
+    print('NumPy no disponible.')
+    no_np = True
+
+try:
     import cv2
 except:
     print('OpenCV no disponible.')
     no_cv = True
 
+GCODE_MOVEMENT_SPEED = 1000
+GCODE_CUTTING_SPEED = 300
+
+# Parámetros de vectorise() usados por las conversiones del quiosco.
+# Sin submuestreo fijo de contornos (stride=1): simplify() elimina los puntos redundantes.
+VECTORISE_OPTIONS = {'resolution': 1024, 'draw_contours': 1, 'repeat_contours': 5, 'draw_hatch': 0, 'repeat_hatch': 0, 'stride': 1}
+
+# Máxima desviación permitida al simplificar los trazos, en mm (0 para no simplificar).
+SIMPLIFY_TOLERANCE_MM = 0.1
+
+# Tiempo máximo dedicado a optimizar el orden de los trazos, en segundos (0 para no optimizar).
+ROUTE_TIME_BUDGET = 1.0
+
+# Filas de la imagen de trabajo por franja en la conversión en flujo (streamPngToGcode()).
+STREAM_BAND_ROWS = 128
+
+# Detección de bordes y contornos por mosaicos en procesos paralelos (tiledcontours()), para imágenes de trabajo grandes.
+# Se usa automáticamente desde TILED_MIN_PIXELS píxeles; TILE_HALO es el margen que cada mosaico toma de sus vecinos.
+TILE_SIZE = 512
+TILE_HALO = 16
+TILED_MIN_PIXELS = 2048 * 2048
+
 F_Blur = {
     (-2,-2):2,(-1,-2):4,(0,-2):5,(1,-2):4,(2,-2):2,
     (-2,-1):4,(-1,-1):9,(0,-1):12,(1,-1):9,(2,-1):4,
@@ -48,8 +86,36 @@ def appmask(IM, masks):
         for y in range(0, h):
             PX[x, y] = NPX[x, y]
 
+# Aplica un kernel F_* sobre la matriz completa sumando una ventana desplazada por cada coeficiente.
+# Los vecinos fuera de la imagen (incluyendo la fila y columna 0, igual que en appmask) no aportan.
+def convolve(A, mask):
+    h, w = A.shape
+    r = max(max(abs(p[0]), abs(p[1])) for p in mask.keys())
+    P = np.zeros((h + 2 * r, w + 2 * r), dtype=np.int64)
+    P[r + 1:r + h, r + 1:r + w] = A[1:, 1:]
+    acc = np.zeros((h, w), dtype=np.int64)
+    for p, k in mask.items():
+        if k != 0:
+            acc += k * P[r + p[1]:r + p[1] + h, r + p[0]:r + p[0] + w]
+    div = sum(mask.values())
+    if div != 0:
+        return acc / div
+    return acc
+
+def appmask_np(IM, masks):
+    A = np.asarray(IM, dtype=np.int64)
+    mag = None
+    for mask in masks:
+        a = convolve(A, mask)
+        mag = a ** 2 if mag is None else mag + a ** 2
+    NPX = np.sqrt(mag).astype(np.int64)
+    return Image.fromarray(np.clip(NPX, 0, 255).astype(np.uint8))
+
 def find_edges(image):
-    if no_cv:
+    if no_cv and not no_np:
+        #image = appmask_np(image, [F_Blur])
+        image = appmask_np(image, [F_SobelX, F_SobelY])
+    elif no_cv:
         #appmask(IM, [F_Blur])
         appmask(image, [F_SobelX, F_SobelY])
     else:
@@ -77,69 +143,296 @@ def getdots(IM):
         dots.append(row)
     return dots
 
+# Corridas de cada fila de una matriz booleana, en el mismo formato que getdots(): (x inicial, longitud - 1).
+def rowdots(B, x_offset=0):
+    D = np.diff(np.pad(B, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    ys, xs = np.nonzero(D == 1)
+    _, xe = np.nonzero(D == -1)
+    runs = list(zip((xs + x_offset).tolist(), (xe - xs - 1).tolist()))
+    ends = np.cumsum(np.bincount(ys, minlength=B.shape[0])).tolist()
+    return [runs[a:b] for a, b in zip([0] + ends[:-1], ends)]
+
+# Equivale a getdots() sobre la imagen y sobre su transpuesta (la versión rotada y reflejada de getcontours()),
+# trabajando directamente sobre la matriz de bordes.
+def getdots_np(E):
+    E = (E == 255)
+    h, w = E.shape
+    return rowdots(E[:h - 1, 1:], 1), rowdots(E[1:, :w - 1].T, 1)
+
 def connectdots(dots):
     contours = []
+    prev_xs = []
+    # Colas abiertas por fila: x -> índice del contorno que termina en (x, y - 1).
+    prev_tails = {}
+    # Colas de la fila y - 2 que ya no pueden extenderse.
+    stale = {}
+    
     for y in range(len(dots)):
+        tails = {}
+        
         for x, v in dots[y]:
             if v > -1:
-                if y == 0:
+                c = -1
+                
+                if y > 0 and prev_xs:
+                    k = bisect.bisect_left(prev_xs, x)
+                    if k == len(prev_xs) or (k > 0 and x - prev_xs[k - 1] <= prev_xs[k] - x):
+                        k -= 1
+                    if abs(prev_xs[k] - x) <= 3:
+                        c = prev_tails.pop(prev_xs[k], -1)
+                
+                if c < 0:
+                    c = len(contours)
                     contours.append([(x, y)])
                 else:
-                    closest = -1
-                    cdist = 100
-                    for x0, v0 in dots[y-1]:
-                        if abs(x0 - x) < cdist:
-                            cdist = abs(x0 - x)
-                            closest = x0
-                    
-                    if cdist > 3:
-                        contours.append([(x, y)])
-                    else:
-                        found = 0
-                        for i in range(len(contours)):
-                            if contours[i][-1] == (closest, y - 1):
-                                contours[i].append((x, y,))
-                                found = 1
-                                break
-                        if found == 0:
-                            contours.append([(x, y)])
-        for c in contours:
-            if c[-1][1] < y - 1 and len(c) < 4:
-                contours.remove(c)
+                    contours[c].append((x, y))
+                
+                tails[x] = c
+        
+        # Retirar contornos cortos que quedaron sin extender.
+        for c in stale.values():
+            if len(contours[c]) < 4:
+                contours[c] = None
+        
+        stale = prev_tails
+        prev_tails = tails
+        prev_xs = [x for x, v in dots[y]]
+    
+    return [c for c in contours if c is not None]
+
+# Une el final de cada cadena con el inicio de otro contorno a menos de "gap" píxeles.
+# Los inicios se indexan en un hash espacial de celdas de tamaño "gap", así que basta con revisar las 9 celdas vecinas.
+# Las cadenas se enlazan por índice (nxt/last) y sólo se aplanan una vez al final.
+def mergecontours(contours, gap=8):
+    n = len(contours)
+    cells = {}
+    for j in range(n):
+        p = contours[j][0]
+        cells.setdefault((int(p[0] // gap), int(p[1] // gap)), []).append(j)
+    
+    alive = [True] * n
+    nxt = [-1] * n
+    last = list(range(n))
+    
+    for i in range(n):
+        if not alive[i]:
+            continue
+        
+        # Igual que el barrido original: tras absorber j, sólo se consideran contornos posteriores a j.
+        pos = -1
+        while True:
+            tail = contours[last[i]][-1]
+            cx, cy = int(tail[0] // gap), int(tail[1] // gap)
+            best = -1
+            
+            for key in ((cx + dx, cy + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+                for j in cells.get(key, ()):
+                    if j > pos and j != i and alive[j] and (best < 0 or j < best):
+                        if distsum(contours[j][0], tail) < gap:
+                            best = j
+            
+            if best < 0:
+                break
+            
+            nxt[last[i]] = best
+            last[i] = last[best]
+            alive[best] = False
+            pos = best
+    
+    merged = []
+    for i in range(n):
+        if alive[i]:
+            chain = []
+            k = i
+            while k >= 0:
+                chain.extend(contours[k])
+                k = nxt[k]
+            merged.append(chain)
+    
+    return merged
+
+# Corridas de píxeles de borde por fila y por columna (sobre la imagen rotada y reflejada).
+def edgedots(image):
+    if no_np:
+        IM1 = image.copy()
+        IM2 = image.rotate(-90, expand=True).transpose(Image.FLIP_LEFT_RIGHT)
+        return getdots(IM1), getdots(IM2)
+    return getdots_np(np.asarray(image))
+
+# Con "tile" = None se usan mosaicos sólo en imágenes de al menos TILED_MIN_PIXELS píxeles; con 0 nunca.
+def getcontours(image, draw_contours=2, stride=8, events=None, tile=None, workers=None):
+    w, h = image.size
+    if tile is None:
+        tile = TILE_SIZE if w * h >= TILED_MIN_PIXELS else 0
+    
+    if tile:
+        with stage(events, 'contours', tile=tile) as info:
+            contours, info['edge_pixels'], info['tiles'] = tiledcontours(image, draw_contours, stride, tile, TILE_HALO, workers)
+            info['contours'] = len(contours)
+        return contours
+    
+    with stage(events, 'find_edges') as info:
+        image = find_edges(image)
+        info['edge_pixels'] = image.histogram()[255]
+    
+    with stage(events, 'contours') as info:
+        contours = tracecontours(image, draw_contours, stride)
+        info['contours'] = len(contours)
+    
     return contours
 
-def getcontours(image, draw_contours=2):
-    image = find_edges(image)
-    IM1 = image.copy()
-    IM2 = image.rotate(-90, expand=True).transpose(Image.FLIP_LEFT_RIGHT)
-    dots1 = getdots(IM1)
+# Contornos de una imagen de bordes (la salida de find_edges()).
+def tracecontours(image, draw_contours=2, stride=8):
+    dots1, dots2 = edgedots(image)
     contours1 = connectdots(dots1)
-    dots2 = getdots(IM2)
     contours2 = connectdots(dots2)
     
     for i in range(len(contours2)):
         contours2[i] = [(c[1],c[0]) for c in contours2[i]]
     
-    contours = contours1+contours2
+    return joincontours(contours1 + contours2, draw_contours, stride)
+
+# Une los contornos cercanos, los submuestrea con "stride" y los lleva a la escala de la imagen original.
+def joincontours(contours, draw_contours=2, stride=8):
+    merged = mergecontours(contours)
+    
+    contours = Polylines()
+    for c in merged:
+        c = c[::stride]
+        if len(c) > 1:
+            contours.append(c)
+    
+    return contours.scaled(draw_contours)
+
+# Bordes y contornos de un mosaico (image, ox, oy, núcleo). "image" es el núcleo más su margen, recortado en (ox, oy).
+# El margen da a los filtros de bordes y al trazado el mismo contexto que tendrían en la imagen completa; de cada
+# contorno sólo se conservan los tramos dentro del núcleo, en coordenadas de la imagen completa, así que cada punto
+# pertenece a un único mosaico. Devuelve (píxeles de borde del núcleo, tramos por filas, tramos por columnas).
+def tracetile(task):
+    image, ox, oy, box = task
+    x0, y0, x1, y1 = box
+    edges = find_edges(image)
+    edge_pixels = edges.crop((x0 - ox, y0 - oy, x1 - ox, y1 - oy)).histogram()[255]
+    
+    dots1, dots2 = edgedots(edges)
+    contours1 = connectdots(dots1)
+    contours2 = [[(c[1], c[0]) for c in contour] for contour in connectdots(dots2)]
+    
+    return edge_pixels, clipcontours(contours1, ox, oy, box), clipcontours(contours2, ox, oy, box)
+
+# Tramos de los contornos (desplazados en (ox, oy)) que quedan dentro de la caja (x0, y0, x1, y1), como Polylines.
+def clipcontours(contours, ox, oy, box):
+    x0, y0, x1, y1 = box
+    
+    if no_np:
+        pieces = Polylines()
+        for contour in contours:
+            piece = []
+            for x, y in contour:
+                x += ox
+                y += oy
+                if x0 <= x < x1 and y0 <= y < y1:
+                    piece.append((x, y))
+                elif piece:
+                    pieces.append(piece)
+                    piece = []
+            if piece:
+                pieces.append(piece)
+        return pieces
     
-    for i in range(len(contours)):
-        for j in range(len(contours)):
-            if len(contours[i]) > 0 and len(contours[j]) > 0:
-                if distsum(contours[j][0], contours[i][-1]) < 8:
-                    contours[i] = contours[i] + contours[j]
-                    contours[j] = []
+    sizes = np.fromiter((len(c) for c in contours), dtype=np.int64, count=len(contours))
+    P = np.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(contours)), dtype=np.float32, count=2 * int(sizes.sum())).reshape(-1, 2)
+    P += np.array([ox, oy], dtype=np.float32)
+    inside = (P[:, 0] >= x0) & (P[:, 0] < x1) & (P[:, 1] >= y0) & (P[:, 1] < y1)
     
-    for i in range(len(contours)):
-        contours[i] = [contours[i][j] for j in range(0, len(contours[i]), 8)]
+    # Un tramo empieza en cada punto interior que inicia un contorno o que sigue a un punto exterior.
+    first = np.zeros(len(P), dtype=bool)
+    first[np.cumsum(sizes) - sizes] = True
+    first[1:] |= ~inside[:-1]
+    keep = np.flatnonzero(inside)
+    starts = np.flatnonzero(first[keep])
+    return Polylines.fromarrays(P[keep], np.append(starts, len(keep)))
+
+# Igual que find_edges() seguido de tracecontours(), pero por mosaicos de "tile" x "tile" píxeles con "halo" píxeles
+# de margen, repartidos entre "workers" procesos (por omisión, uno por núcleo). Los tramos que cruzan los bordes
+# de los mosaicos se vuelven a unir con mergecontours(), recorriendo los mosaicos siempre en el mismo orden,
+# así que el resultado no depende de la cantidad de procesos. Devuelve (contornos, píxeles de borde, mosaicos).
+def tiledcontours(image, draw_contours=2, stride=8, tile=TILE_SIZE, halo=TILE_HALO, workers=None):
+    w, h = image.size
+    tasks = []
+    for y0 in range(0, h, tile):
+        for x0 in range(0, w, tile):
+            x1, y1 = min(x0 + tile, w), min(y0 + tile, h)
+            ox, oy = max(x0 - halo, 0), max(y0 - halo, 0)
+            tasks.append((image.crop((ox, oy, min(x1 + halo, w), min(y1 + halo, h))), ox, oy, (x0, y0, x1, y1)))
     
-    contours = [c for c in contours if len(c) > 1]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(tracetile, tasks))
+    else:
+        results = [tracetile(task) for task in tasks]
     
-    for i in range(0, len(contours)):
-        contours[i] = [(v[0] * draw_contours, v[1] * draw_contours) for v in contours[i]]
+    # Primero los tramos por filas y luego los por columnas, como en tracecontours().
+    edge_pixels = 0
+    contours1 = []
+    contours2 = []
+    for n, pieces1, pieces2 in results:
+        edge_pixels += n
+        contours1.extend(pieces1)
+        contours2.extend(pieces2)
     
-    return contours
+    return joincontours(contours1 + contours2, draw_contours, stride), edge_pixels, len(tasks)
+
+# Corridas horizontales de True por fila: devuelve (y, x inicial, x final) en orden de filas.
+def hruns(M):
+    P = np.pad(M, ((0, 0), (1, 1)))
+    ys, xs = np.nonzero(M & ~P[:, :-2])
+    _, xe = np.nonzero(M & ~P[:, 2:])
+    return ys, xs, xe
+
+# Corridas de True a lo largo de las antidiagonales, de arriba a la derecha hacia abajo a la izquierda.
+# Devuelve (y inicial, x inicial, y final, x final).
+def druns(M):
+    P = np.pad(M, 1)
+    ys, xs = np.nonzero(M & ~P[:-2, 2:])
+    ye, xe = np.nonzero(M & ~P[2:, :-2])
+    o = np.lexsort((ys, xs + ys))
+    oe = np.lexsort((ye, xe + ye))
+    return ys[o], xs[o], ye[oe], xe[oe]
+
+# Igual que hatch(), pero umbraliza la imagen completa y emite directamente los segmentos ya unidos.
+def hatch_np(image, draw_hatch=16):
+    A = np.asarray(image)
+    
+    # Trazos horizontales: uno a 1/4 de la celda (<= 144) y otro a 3/4 (<= 16).
+    y1, x1, e1 = hruns(A <= 144)
+    y2, x2, e2 = hruns(A <= 16)
+    ys = np.concatenate((y1, y2))
+    xs = np.concatenate((x1, x2))
+    xe = np.concatenate((e1, e2))
+    k = np.concatenate((np.zeros(len(y1), dtype=int), np.ones(len(y2), dtype=int)))
+    o = np.lexsort((k, ys, xs))
+    ys, xs, xe, k = ys[o], xs[o], xe[o], k[o]
+    
+    y = ys * draw_hatch
+    hy = np.where(k == 0, y + draw_hatch / 4, y + draw_hatch / 2 + draw_hatch / 4)
+    lg1 = np.stack((xs * draw_hatch, hy, (xe + 1) * draw_hatch, hy), axis=1)
+    
+    # Trazos diagonales (<= 64).
+    ys, xs, ye, xe = druns(A <= 64)
+    o = np.lexsort((ys, xs))
+    ys, xs, ye, xe = ys[o], xs[o], ye[o], xe[o]
+    lg2 = np.stack((xs * draw_hatch + draw_hatch, ys * draw_hatch, xe * draw_hatch, ye * draw_hatch + draw_hatch), axis=1)
+    
+    # Todos los trazos tienen dos puntos.
+    P = np.concatenate((lg1, lg2)).reshape(-1, 2)
+    return Polylines.fromarrays(P, np.arange(0, len(P) + 1, 2))
 
 def hatch(image, draw_hatch=16):
+    if not no_np:
+        return hatch_np(image, draw_hatch)
+    
     pixels = image.load()
     w, h = image.size
     lg1 = []
@@ -178,50 +471,259 @@ def hatch(image, draw_hatch=16):
     
     lines = [item for group in line_groups for item in group]
     
-    return lines
+    return Polylines.fromlines(lines)
+
+# Extremos por celda ocupada por encima de los cuales EndpointGrid.build() achica las celdas. El tamaño inicial sale
+# del área total, y con líneas agrupadas en zonas pequeñas y separadas dejaría cada zona en unas pocas celdas llenas.
+GRID_OCCUPANCY = 4
 
-def sortlines(lines):
-    clines = lines[:]
-    slines = [clines.pop(0)]
+# Índice espacial (rejilla uniforme) sobre los extremos de las líneas vivas: remove() quita los dos extremos de la
+# línea y las celdas que quedan vacías, así que las búsquedas sólo recorren extremos vivos.
+class EndpointGrid:
+    def __init__(self, lines):
+        self.ends = endpoints(lines)
+        self.alive = [True] * len(self.ends)
+        self.count = len(self.ends)
+        self.build()
+    
+    def build(self):
+        live = [i for i in range(len(self.ends)) if self.alive[i]]
+        xs = [p[0] for i in live for p in self.ends[i]]
+        ys = [p[1] for i in live for p in self.ends[i]]
+        self.min_x, self.min_y = min(xs), min(ys)
+        area = max(max(xs) - self.min_x, 1) * max(max(ys) - self.min_y, 1)
+        self.size = max((area / max(self.count, 1)) ** 0.5, 1.0)
+        
+        while True:
+            self.cells = {}
+            for i in live:
+                self.cells.setdefault(self.cell(self.ends[i][0]), []).append((i, False))
+                self.cells.setdefault(self.cell(self.ends[i][1]), []).append((i, True))
+            if self.size <= 1.0 or 2 * len(live) <= GRID_OCCUPANCY * len(self.cells):
+                break
+            self.size = max(self.size / 2, 1.0)
+        
+        self.built_count = self.count
+    
+    def cell(self, p):
+        return (int((p[0] - self.min_x) // self.size), int((p[1] - self.min_y) // self.size))
     
-    while clines != []:
-        x, s, r = None, 1000000, False
+    def remove(self, i):
+        self.alive[i] = False
+        self.count -= 1
         
-        for l in clines:
-            d = distsum(l[0], slines[-1][-1])
-            dr = distsum(l[-1], slines[-1][-1])
-            if d < s:
-                x, s, r = l[:], d, False
-            if dr < s:
-                x, s, r = l[:], s, True
+        for r in (False, True):
+            key = self.cell(self.ends[i][r])
+            entries = self.cells[key]
+            entries.remove((i, r))
+            if not entries:
+                del self.cells[key]
         
-        clines.remove(x)
+        # Reconstruir con celdas más grandes cuando quedan pocas líneas vivas.
+        if self.count > 0 and self.count < self.built_count // 4:
+            self.build()
+    
+    def nearest(self, p):
+        cx, cy = self.cell(p)
+        live = 2 * self.count
+        best = None
+        seen = 0
+        ring = 0
         
-        if r == True:
-            x = x[::-1]
+        def closest(entries):
+            nonlocal best
+            for i, r in entries:
+                q = self.ends[i][r]
+                d = ((q[0] - p[0]) ** 2 + (q[1] - p[1]) ** 2) ** 0.5
+                if best is None or (d, i, r) < best:
+                    best = (d, i, r)
+        
+        while seen < live:
+            # Un anillo con más celdas que las ocupadas (el extremo más cercano está lejos, por ejemplo en otra zona
+            # del dibujo): es más barato revisar directamente las celdas ocupadas que quedan fuera de los anteriores.
+            if 8 * ring > len(self.cells):
+                for (kx, ky), entries in self.cells.items():
+                    if max(abs(kx - cx), abs(ky - cy)) >= ring:
+                        closest(entries)
+                break
+            
+            if ring == 0:
+                keys = [(cx, cy)]
+            else:
+                keys = [(cx + d, cy - ring) for d in range(-ring, ring + 1)]
+                keys += [(cx + d, cy + ring) for d in range(-ring, ring + 1)]
+                keys += [(cx - ring, cy + d) for d in range(-ring + 1, ring)]
+                keys += [(cx + ring, cy + d) for d in range(-ring + 1, ring)]
+            
+            for key in keys:
+                entries = self.cells.get(key)
+                if entries:
+                    seen += len(entries)
+                    closest(entries)
+            
+            # Cualquier extremo fuera de los anillos revisados está a más de ring * size.
+            if best is not None and best[0] < ring * self.size:
+                break
+            ring += 1
         
-        slines.append(x)
+        return best[1], best[2]
+
+# Recorrido greedy: cada línea sigue a la de extremo más cercano al final de la anterior (invertida si conviene).
+# Devuelve el mismo tipo de contenedor que recibe (Polylines o lista de líneas).
+# Sin "start" el recorrido empieza por la primera línea; con "start" (x, y), por la más cercana a ese punto.
+def sortlines(lines, start=None):
+    if not len(lines):
+        return reorder(lines, [])
+    
+    grid = EndpointGrid(lines)
+    order = []
+    flip = []
+    tail = start
     
-    return slines
+    if tail is None:
+        grid.remove(0)
+        order.append(0)
+        flip.append(False)
+        tail = grid.ends[0][1]
+    
+    while grid.count > 0:
+        i, r = grid.nearest(tail)
+        grid.remove(i)
+        order.append(i)
+        flip.append(r)
+        tail = grid.ends[i][0 if r else 1]
+    
+    return reorder(lines, order, flip)
 
-def vectorise(image, resolution=1024, draw_contours=False, repeat_contours=1, draw_hatch=False, repeat_hatch=1):
+# Recorridos ordenados de cada tipo de trazo, con su cantidad de repeticiones: [(líneas, repeticiones), ...].
+def vectorisegroups(image, resolution=1024, draw_contours=False, repeat_contours=1, draw_hatch=False, repeat_hatch=1, stride=8, events=None, tile=None, workers=None):
     w, h = image.size
     mod_image = image.convert('L')
     mod_image = ImageOps.autocontrast(mod_image, 10)
     
-    lines = []
+    groups = []
     
     if draw_contours and repeat_contours:
-        contours = sortlines(getcontours(mod_image.resize((int(resolution / draw_contours), int(resolution / draw_contours * h / w))), draw_contours))
-        for r in range(repeat_contours):
-            lines += contours
+        contours = getcontours(mod_image.resize((int(resolution / draw_contours), int(resolution / draw_contours * h / w))), draw_contours, stride, events, tile, workers)
+        with stage(events, 'sortlines', group='contours') as info:
+            contours = sortlines(contours)
+            info['lines'] = len(contours)
+        groups.append((contours, repeat_contours))
     
     if draw_hatch and repeat_hatch:
-        hatches = sortlines(hatch(mod_image.resize((int(resolution / draw_hatch), int(resolution / draw_hatch * h / w))), draw_hatch))
-        for r in range(repeat_hatch):
-            lines += hatches
+        with stage(events, 'hatch') as info:
+            hatches = hatch(mod_image.resize((int(resolution / draw_hatch), int(resolution / draw_hatch * h / w))), draw_hatch)
+            info['lines'] = len(hatches)
+        with stage(events, 'sortlines', group='hatch') as info:
+            hatches = sortlines(hatches)
+            info['lines'] = len(hatches)
+        groups.append((hatches, repeat_hatch))
+    
+    return groups
+
+# Las repeticiones son referencias al mismo grupo de líneas, sin copias.
+def expandgroups(groups):
+    return PolylineGroups(groups)
+
+def vectorise(image, resolution=1024, draw_contours=False, repeat_contours=1, draw_hatch=False, repeat_hatch=1, stride=8, events=None, tile=None, workers=None):
+    return expandgroups(vectorisegroups(image, resolution, draw_contours, repeat_contours, draw_hatch, repeat_hatch, stride, events, tile, workers))
+
+# Distancia de cada punto P al segmento A-B (todas matrices de N x 2).
+def segdist(P, A, B):
+    AB = B - A
+    L = (AB ** 2).sum(axis=1)
+    t = np.clip(((P - A) * AB).sum(axis=1) / np.where(L > 0, L, 1.0), 0.0, 1.0)
+    return np.hypot(*(A + AB * t[:, None] - P).T)
+
+# Ramer-Douglas-Peucker de una sola línea, sin NumPy.
+def rdp(l, tolerance, scale=(1.0, 1.0)):
+    P = [(p[0] * scale[0], p[1] * scale[1]) for p in l]
+    keep = [False] * len(P)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(P) - 1)] if len(P) > 2 else []
+    
+    while stack:
+        a, b = stack.pop()
+        (ax, ay), (bx, by) = P[a], P[b]
+        dx, dy = bx - ax, by - ay
+        L = dx * dx + dy * dy
+        dmax, far = -1.0, -1
+        
+        for k in range(a + 1, b):
+            t = min(max(((P[k][0] - ax) * dx + (P[k][1] - ay) * dy) / L, 0.0), 1.0) if L > 0 else 0.0
+            d = math.hypot(ax + dx * t - P[k][0], ay + dy * t - P[k][1])
+            if d > dmax:
+                dmax, far = d, k
+        
+        if dmax > tolerance:
+            keep[far] = True
+            if far - a > 1:
+                stack.append((a, far))
+            if b - far > 1:
+                stack.append((far, b))
     
-    return lines
+    return [p for p, k in zip(l, keep) if k]
+
+# Ramer-Douglas-Peucker sobre todas las líneas a la vez: en cada iteración se divide cada tramo abierto
+# (de todas las líneas) por su punto más alejado, hasta que ningún punto supera la tolerancia.
+# "scale" convierte píxeles a las unidades de la tolerancia (por ejemplo mm) en cada eje.
+# Devuelve un Polylines con los puntos conservados de cada línea (sin cambiar sus coordenadas).
+def simplify(lines, tolerance, scale=(1.0, 1.0)):
+    if not isinstance(lines, Polylines):
+        lines = Polylines.fromlines(lines)
+    
+    stats = {'lines': len(lines), 'points_before': lines.npoints(), 'points_after': 0}
+    
+    if len(lines) == 0 or tolerance <= 0:
+        stats['points_after'] = stats['points_before']
+        return lines, stats
+    
+    if no_np:
+        lines = Polylines.fromlines(rdp(l, tolerance, scale) for l in lines)
+        stats['points_after'] = lines.npoints()
+        return lines, stats
+    
+    src = lines.points()
+    offsets = lines.npoffsets()
+    P = src.astype(np.float64) * np.array(scale, dtype=np.float64)
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    keep = np.zeros(len(P), dtype=bool)
+    keep[starts] = True
+    keep[ends - 1] = True
+    
+    # Tramos abiertos (índice inicial y final, inclusivos) con puntos interiores.
+    a, b = starts, ends - 1
+    while True:
+        m = (b - a) > 1
+        a, b = a[m], b[m]
+        if len(a) == 0:
+            break
+        
+        # Puntos interiores de cada tramo, con su tramo correspondiente.
+        n = b - a - 1
+        seg = np.repeat(np.arange(len(a)), n)
+        idx = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + np.repeat(a + 1, n)
+        d = segdist(P[idx], P[a[seg]], P[b[seg]])
+        
+        first = np.cumsum(n) - n
+        dmax = np.maximum.reduceat(d, first)
+        
+        # Primer punto de cada tramo con la distancia máxima.
+        hit = np.flatnonzero(d == dmax[seg])
+        _, pos = np.unique(seg[hit], return_index=True)
+        far = idx[hit[pos]]
+        
+        split = dmax > tolerance
+        keep[far[split]] = True
+        a, b = np.concatenate((a[split], far[split])), np.concatenate((far[split], b[split]))
+    
+    # Puntos conservados por línea: todas las líneas tienen al menos un punto, así que reduceat es válido.
+    sizes = np.add.reduceat(keep.astype(np.int64), starts)
+    lines = Polylines.fromarrays(src[keep], np.concatenate(([0], np.cumsum(sizes))))
+    stats['points_after'] = lines.npoints()
+    
+    return lines, stats
 
 def valmap(x, in_min, in_max, out_min, out_max):
     x = float(x)
@@ -231,60 +733,364 @@ def valmap(x, in_min, in_max, out_min, out_max):
     out_max = float(out_max)
     return ((x - in_min) * (out_max - out_min)) / ((in_max - in_min) + out_min)
 
-def makesvg(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm):
-    width = math.ceil(max([max([p[0] for p in l]) for l in lines]))
-    height = math.ceil(max([max([p[1] for p in l]) for l in lines]))
+# Ancho y alto (redondeados hacia arriba) del área ocupada por las líneas, en una sola pasada.
+def getbounds(lines):
+    width = height = -math.inf
+    
+    if isinstance(lines, (Polylines, PolylineGroups)):
+        for group in (lines.groups if isinstance(lines, PolylineGroups) else [(lines, 1)]):
+            m = group[0].maxima()
+            if m is not None:
+                width, height = max(width, m[0]), max(height, m[1])
+        return math.ceil(width), math.ceil(height)
+    
+    for l in lines:
+        for p in l:
+            if p[0] > width:
+                width = p[0]
+            if p[1] > height:
+                height = p[1]
+    return math.ceil(width), math.ceil(height)
+
+# Transforma las líneas (en píxeles) a milímetros, con la misma escala y desplazamiento del área de dibujo.
+# Devuelve por cada línea una lista plana [x0, y0, x1, y1, ...].
+# Con Polylines, PolylineGroups o PolylineStream cada grupo se transforma de una vez sobre su búfer y sus repeticiones
+# entregan las mismas listas. Un PolylineStream requiere "bounds", porque sus líneas no se conocen de antemano.
+# Con listas de líneas la transformación se aplica por bloques, y las líneas repetidas (el mismo objeto) sólo se transforman una vez.
+def mmcoords(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds=None, chunk=4096):
+    if isinstance(lines, Polylines):
+        lines = PolylineGroups([(lines, 1)])
+    
+    if bounds is None:
+        if isinstance(lines, PolylineStream):
+            raise ValueError('mmcoords() requiere los límites del dibujo para un PolylineStream')
+        if not isinstance(lines, (list, PolylineGroups)):
+            lines = list(lines)
+        bounds = getbounds(lines)
+    width, height = bounds
+    
+    if isinstance(lines, (PolylineGroups, PolylineStream)):
+        for group, repeat in lines.groups:
+            if no_np:
+                flat = list(mmcoords(list(group), max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds))
+            else:
+                # Con in_min = out_min = 0, valmap() se reduce a (x * out_max) / in_max (mismo resultado en coma flotante).
+                P = group.points().astype(np.float64)
+                c = (np.array([offset_x_mm, offset_y_mm], dtype=np.float64) + (P * np.array([float(max_width_mm), float(max_height_mm)])) / np.array([float(width), float(height)])).ravel().tolist()
+                o = group.offsets
+                flat = [c[2 * o[i]:2 * o[i + 1]] for i in range(len(group))]
+            
+            for r in range(repeat):
+                yield from flat
+        return
     
+    if no_np:
+        for l in lines:
+            yield [v for p in l for v in (offset_x_mm + valmap(p[0], 0, width, 0, max_width_mm), offset_y_mm + valmap(p[1], 0, height, 0, max_height_mm))]
+        return
+    
+    # Con in_min = out_min = 0, valmap() se reduce a (x * out_max) / in_max (mismo resultado en coma flotante).
+    scale = np.array([float(max_width_mm), float(max_height_mm)])
+    div = np.array([float(width), float(height)])
+    offset = np.array([offset_x_mm, offset_y_mm], dtype=np.float64)
+    
+    cache = {}
+    it = iter(lines)
+    while True:
+        block = list(itertools.islice(it, chunk))
+        if not block:
+            break
+        
+        # Una línea repetida dentro del mismo bloque se transforma una sola vez.
+        new = list({id(l): l for l in block if id(l) not in cache}.values())
+        if new:
+            P = np.array([p for l in new for p in l], dtype=np.float64).reshape(-1, 2)
+            flat = (offset + (P * scale) / div).ravel().tolist()
+            pos = 0
+            for l in new:
+                cache[id(l)] = (l, flat[pos:pos + 2 * len(l)])
+                pos += 2 * len(l)
+        
+        for l in block:
+            yield cache[id(l)][1]
+
+# Escribe el SVG en un archivo (o cualquier objeto con write()) a medida que se generan los trazos.
+def writesvg(fp, lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds=None):
     max_width = float(offset_x_mm + max_width_mm)
     max_height = float(offset_y_mm + max_height_mm)
     
-    out = '<svg xmlns="http://www.w3.org/2000/svg" height="%.1fmm" width="%.1fmm" version="1.1">\n' % (max_height, max_width)
+    fp.write('<svg xmlns="http://www.w3.org/2000/svg" height="%.1fmm" width="%.1fmm" version="1.1">\n' % (max_height, max_width))
     
-    for l in lines:
-        cur_line = []
+    paths = {}
+    for c in mmcoords(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds):
+        path = paths.get(id(c))
+        if path is None:
+            # "%.1f" redondea igual que round(x, 1).
+            d = ('M%.1f %.1f' + ' L%.1f %.1f' * (len(c) // 2 - 1)) % tuple(c)
+            path = paths[id(c)] = (c, '<path d="' + d + '" stroke="black" stroke-width="1" fill="none" />\n')
+        fp.write(path[1])
+    
+    fp.write('</svg>')
+
+def makesvg(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds=None):
+    out = io.StringIO()
+    writesvg(out, lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds)
+    return out.getvalue()
+
+# Genera el G-code directamente desde las líneas, sin pasar por SVG.
+# Reproduce la salida de svg_to_gcode (Compiler + interfaces.Gcode) para el SVG que generaría makesvg().
+def makegcode(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, movement_speed=GCODE_MOVEMENT_SPEED, cutting_speed=GCODE_CUTTING_SPEED, bounds=None):
+    yield 'G90;'
+    yield 'M5;'
+    yield 'G21;'
+    
+    pos = None
+    cur_speed = None
+    
+    for c in mmcoords(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds):
+        if len(c) < 4:
+            continue
+        
+        # Mismo redondeo que el trazo SVG: "%.6f" de round(x, 1) equivale a "%.1f" seguido de ceros.
+        l = ['X%.1f00000 Y%.1f00000;' % (c[i], c[i + 1]) for i in range(0, len(c), 2)]
         
         for i in range(len(l)):
-            p = l[i]
-            x = offset_x_mm + valmap(p[0], 0, width, 0, max_width_mm)
-            y = offset_y_mm + valmap(p[1], 0, height, 0, max_height_mm)
-            cur_line.append(('M' if (i == 0) else 'L') + ("%.1f %.1f" % (round(x, 1), round(y, 1))))
+            if i == 0:
+                # Levantar el lápiz sólo si la línea no empieza donde terminó la anterior.
+                if l[0] == pos:
+                    continue
+                yield 'M5;'
+                speed = movement_speed
+            else:
+                speed = cutting_speed
+            
+            cmd = 'G1 '
+            if speed != cur_speed:
+                cur_speed = speed
+                cmd += 'F%s ' % (speed)
+            yield cmd + l[i]
+            
+            if i == 0:
+                yield 'M3 S255;'
         
-        l = " ".join(cur_line)
-        out += '<path d="' + l + '" stroke="black" stroke-width="1" fill="none" />\n'
+        pos = l[-1]
+    
+    yield 'M5;'
+
+def flatten(image):
+    if (image.mode in ('RGBA', 'LA')) or ((image.mode == 'P') and ('transparency' in image.info)):
+        alpha = image.convert('RGBA').getchannel('A')
+        bg = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        bg.paste(image, mask=alpha)
+        return bg
+    return image
+
+# Vectoriza la imagen, simplifica las líneas en mm y optimiza el recorrido de cada grupo antes de repetirlo.
+# Devuelve las líneas (en píxeles), sus límites y las estadísticas (puntos y métricas de recorrido antes/después de optimizar).
+# Los límites se calculan antes de simplificar para que la escala del dibujo no cambie.
+# Si "offsets" (offset_x_mm, offset_y_mm) se indica, también se calculan los bytes de G-code sin simplificar.
+def tracelines(image, max_width_mm, max_height_mm, options=VECTORISE_OPTIONS, tolerance_mm=SIMPLIFY_TOLERANCE_MM, route_budget=ROUTE_TIME_BUDGET, offsets=None, events=None):
+    with stage(events, 'vectorise') as info:
+        groups = vectorisegroups(flatten(image).convert('RGB'), events=events, **options)
+        info['lines'] = len(expandgroups(groups))
+    
+    bounds = getbounds(expandgroups(groups))
+    scale = (max_width_mm / bounds[0], max_height_mm / bounds[1])
+    
+    stats = {'lines': 0, 'points_before': 0, 'points_after': 0}
+    if offsets:
+        stats['bytes_before'] = gcodesize(expandgroups(groups), max_width_mm, max_height_mm, offsets[0], offsets[1], bounds)
     
-    out += '</svg>'
+    with stage(events, 'simplify') as info:
+        simplified = []
+        for group, repeat in groups:
+            group, group_stats = simplify(group, tolerance_mm, scale)
+            simplified.append((group, repeat))
+            for key in ('lines', 'points_before', 'points_after'):
+                stats[key] += group_stats[key] * repeat
+        info.update((key, stats[key]) for key in ('lines', 'points_before', 'points_after'))
     
-    return out
+    with stage(events, 'optimize_route') as info:
+        stats['route_before'] = route_metrics(expandgroups(simplified), scale, GCODE_MOVEMENT_SPEED, GCODE_CUTTING_SPEED)
+        
+        optimized = [(optimize_route(group, route_budget / len(simplified), scale), repeat) for group, repeat in simplified]
+        lines = expandgroups(optimized)
+        
+        stats['route_after'] = route_metrics(lines, scale, GCODE_MOVEMENT_SPEED, GCODE_CUTTING_SPEED)
+        info.update(pen_up_before_mm=stats['route_before']['pen_up_mm'], pen_up_mm=stats['route_after']['pen_up_mm'], time_s=stats['route_after']['time_s'])
+    
+    return lines, bounds, stats
 
-def convertPngToSvg(image, svg_path, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm):
+def gcodesize(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds=None):
+    return max(sum(len(l) + 1 for l in makegcode(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds=bounds)) - 1, 0)
+
+def convertPngToSvg(image, svg_path, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, events=None):
     try:
-        if (image.mode in ('RGBA', 'LA')) or ((image.mode == 'P') and ('transparency' in image.info)):
-            alpha = image.convert('RGBA').getchannel('A')
-            bg = Image.new('RGBA', image.size, (255, 255, 255, 255))
-            bg.paste(image, mask=alpha)
-            new_image = bg
-        else:
-            new_image = image
-        
-        lines = vectorise(new_image.convert('RGB'), draw_contours=1, repeat_contours=5, draw_hatch=0, repeat_hatch=0)
-        svg_data = makesvg(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm)
+        lines, bounds, stats = tracelines(image, max_width_mm, max_height_mm, events=events)
         
-        with open(svg_path, "w") as svg_file:
-            svg_file.write(svg_data)
+        with stage(events, 'svg') as info, open(svg_path, "w") as svg_file:
+            writesvg(svg_file, lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds)
+            info['bytes'] = svg_file.tell()
+    except:
+        traceback.print_exc()
+        return False
+    
+    return True
+
+def convertSvgToGcode(svg_path, gcode_path, events=None):
+    try:
+        with stage(events, 'svg_to_gcode') as info:
+            gcode_compiler = Compiler(interfaces.Gcode, movement_speed=GCODE_MOVEMENT_SPEED, cutting_speed=GCODE_CUTTING_SPEED, pass_depth=0, unit='mm')
+            curves = parse_file(svg_path, transform_origin=False)
+            gcode_compiler.append_curves(curves)
+            gcode_compiler.compile_to_file(gcode_path)
+            info['curves'] = len(curves)
     except:
         traceback.print_exc()
         return False
     
     return True
 
-def convertSvgToGcode(svg_path, gcode_path):
+# Conversión PNG -> G-code en memoria. El SVG (para el archivo histórico) es opcional.
+# Si se pasa un diccionario en "stats", se completa con los puntos y bytes de G-code antes y después de simplificar.
+# "events" (un events.EventBus) recibe el inicio, el fin y los conteos de cada etapa.
+def convertPngToGcode(image, gcode_path, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, svg_path=None, stats=None, events=None):
     try:
-        gcode_compiler = Compiler(interfaces.Gcode, movement_speed=1000, cutting_speed=300, pass_depth=0, unit='mm')
-        curves = parse_file(svg_path, transform_origin=False)
-        gcode_compiler.append_curves(curves)
-        gcode_compiler.compile_to_file(gcode_path)
+        lines, bounds, trace_stats = tracelines(image, max_width_mm, max_height_mm, offsets=(offset_x_mm, offset_y_mm) if stats is not None else None, events=events)
+        if stats is not None:
+            stats.update(trace_stats)
+        
+        with stage(events, 'gcode') as info, open(gcode_path, "w") as gcode_file:
+            size = 0
+            for i, l in enumerate(makegcode(lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds=bounds)):
+                if i > 0:
+                    l = '\n' + l
+                gcode_file.write(l)
+                size += len(l)
+            info.update(lines=i + 1, bytes=size)
+        
+        if stats is not None:
+            stats['bytes_after'] = size
+        
+        print('Simplificación: %u -> %u puntos.' % (trace_stats['points_before'], trace_stats['points_after']))
+        print('Recorrido con lápiz arriba: %.1f -> %.1f mm. Tiempo estimado: %.1f -> %.1f s.' % (trace_stats['route_before']['pen_up_mm'], trace_stats['route_after']['pen_up_mm'], trace_stats['route_before']['time_s'], trace_stats['route_after']['time_s']))
+        
+        if svg_path:
+            with stage(events, 'svg') as info, open(svg_path, "w") as svg_file:
+                writesvg(svg_file, lines, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds)
+                info['bytes'] = svg_file.tell()
     except:
         traceback.print_exc()
         return False
     
     return True
+
+# Conversión en flujo: la imagen se vectoriza por franjas horizontales y cada franja se entrega apenas está lista
+# (ordenada desde la posición del lápiz, simplificada y con su recorrido optimizado), sin esperar al resto de la imagen.
+# Los bordes se detectan una sola vez sobre la imagen completa; los contornos se trazan por franja.
+# Devuelve los límites del dibujo (el lienzo de trabajo completo, conocido de antemano) y un PolylineStream.
+# A diferencia de tracelines(), los contornos se cortan en los bordes de las franjas, cada franja se repite por separado
+# y la escala se toma del lienzo en lugar de la extensión de las líneas. "stats" se completa a medida que avanza.
+def tracestream(image, max_width_mm, max_height_mm, options=VECTORISE_OPTIONS, tolerance_mm=SIMPLIFY_TOLERANCE_MM, route_budget=ROUTE_TIME_BUDGET, band_rows=STREAM_BAND_ROWS, stats=None, events=None):
+    image = flatten(image).convert('RGB')
+    w, h = image.size
+    resolution = options['resolution']
+    draw_contours, repeat_contours = options['draw_contours'], options['repeat_contours']
+    draw_hatch, repeat_hatch = options['draw_hatch'], options['repeat_hatch']
+    stride = options['stride']
+    
+    mod_image = ImageOps.autocontrast(image.convert('L'), 10)
+    
+    edges = hatch_image = None
+    width = height = 0
+    
+    if draw_contours and repeat_contours:
+        with stage(events, 'find_edges') as info:
+            edges = find_edges(mod_image.resize((int(resolution / draw_contours), int(resolution / draw_contours * h / w))))
+            info['edge_pixels'] = edges.histogram()[255]
+        width, height = edges.size[0] * draw_contours, edges.size[1] * draw_contours
+    
+    if draw_hatch and repeat_hatch:
+        hatch_image = mod_image.resize((int(resolution / draw_hatch), int(resolution / draw_hatch * h / w)))
+        width, height = max(width, hatch_image.size[0] * draw_hatch), max(height, hatch_image.size[1] * draw_hatch)
+    
+    bounds = (math.ceil(width), math.ceil(height))
+    scale = (max_width_mm / max(bounds[0], 1), max_height_mm / max(bounds[1], 1))
+    
+    # Alto de cada franja en coordenadas del lienzo.
+    band_height = band_rows * (draw_contours if edges is not None else (draw_hatch or 1))
+    bands = math.ceil(height / band_height) if height else 0
+    
+    if stats is None:
+        stats = {}
+    for key in ('lines', 'points_before', 'points_after'):
+        stats[key] = 0
+    
+    def groups():
+        pen = None
+        
+        for k in range(bands):
+            start = time.perf_counter()
+            y0, y1 = k * band_height, (k + 1) * band_height
+            band = []
+            
+            if edges is not None:
+                # Una fila extra por debajo: getdots() no usa la última fila de la imagen que recibe.
+                r0, r1 = math.ceil(y0 / draw_contours), math.ceil(y1 / draw_contours)
+                if r0 < edges.size[1]:
+                    lines = tracecontours(edges.crop((0, r0, edges.size[0], min(r1 + 1, edges.size[1]))), draw_contours, stride)
+                    band.append((lines.translated(0, r0 * draw_contours), repeat_contours))
+            
+            if hatch_image is not None:
+                r0, r1 = math.ceil(y0 / draw_hatch), math.ceil(y1 / draw_hatch)
+                if r0 < hatch_image.size[1]:
+                    lines = hatch(hatch_image.crop((0, r0, hatch_image.size[0], min(r1, hatch_image.size[1]))), draw_hatch)
+                    band.append((lines.translated(0, r0 * draw_hatch), repeat_hatch))
+            
+            for lines, repeat in band:
+                if not len(lines):
+                    continue
+                
+                lines = sortlines(lines, pen)
+                lines, group_stats = simplify(lines, tolerance_mm, scale)
+                lines = optimize_route(lines, route_budget / bands, scale)
+                pen = lines.endpoints()[-1][1]
+                
+                for key in ('lines', 'points_before', 'points_after'):
+                    stats[key] += group_stats[key] * repeat
+                
+                yield lines, repeat
+            
+            if events is not None:
+                events.emit('stream_band', band=k + 1, bands=bands, elapsed=time.perf_counter() - start, lines=sum(len(lines) for lines, repeat in band))
+    
+    return bounds, PolylineStream(groups())
+
+# Versión en flujo de convertPngToGcode(): un generador de líneas de G-code que se producen a medida que se vectoriza
+# cada franja, para enviarlas al Arduino mientras se convierte el resto. También se guardan en "gcode_path";
+# al terminar se escribe el SVG (opcional) con todas las franjas. Los errores se propagan a quien consume el generador.
+def streamPngToGcode(image, gcode_path, max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, svg_path=None, stats=None, events=None):
+    bounds, stream = tracestream(image, max_width_mm, max_height_mm, stats=stats, events=events)
+    groups = []
+    
+    def recorded():
+        for group in stream.groups:
+            groups.append(group)
+            yield group
+    
+    # Sin etapa "gcode": el G-code se genera durante todo el envío, que es la etapa en curso.
+    with open(gcode_path, "w") as gcode_file:
+        size = 0
+        for i, l in enumerate(makegcode(PolylineStream(recorded()), max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds=bounds)):
+            data = '\n' + l if i > 0 else l
+            gcode_file.write(data)
+            size += len(data)
+            yield l
+    
+    if stats is not None:
+        stats['bytes_after'] = size
+    
+    if svg_path:
+        with stage(events, 'svg') as info, open(svg_path, "w") as svg_file:
+            writesvg(svg_file, PolylineGroups(groups), max_width_mm, max_height_mm, offset_x_mm, offset_y_mm, bounds)
+            info['bytes'] = svg_file.tell()
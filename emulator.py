@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import math
+import time
+import threading
+import argparse
+import contextlib
+import traceback
+
+from protocol import ProtocolEmulator, OP_MOVE, OP_ABSOLUTE, OP_RELATIVE, OP_SERVO
+from kinematics import jointangle, SERVO_MIN_PULSE, SERVO_MAX_PULSE, SERVO_MAX_ANGLE
+from sender import GcodeSender, ARDUINO_RX_BUFFER, FIRMWARE_IDLE, FIRMWARE_SETTLE
+
+# Tiempo que tarda un servo en recorrer un grado, igual que g_servoMsPerDeg en el firmware.
+SERVO_MS_PER_DEG = 1.7
+
+# Posición de los servos al terminar setup().
+SERVO_HOME = 180.0
+
+# Intervalo de sondeo de GcodeSender en simulate(), en segundos simulados. Sólo se usa cuando no hay respuestas
+# pendientes (por ejemplo, esperando un tiempo de espera), así que no afecta a la estimación.
+SIMULATE_POLL = 0.05
+
+# Estado y tiempos de gcode_interpreter.ino sobre ProtocolEmulator, que ya modela el enlace, el búfer de recepción
+# y la decodificación. Reproduce G0/G1/G90/G91, el posicionamiento relativo (el modo inicial del firmware), el
+# rechazo de los puntos fuera de alcance y la espera de los servos: ceil(desplazamiento angular * SERVO_MS_PER_DEG)
+# ms por movimiento. Como el Arduino al abrir el puerto, connect() vuelve todo al estado de setup().
+class Firmware(ProtocolEmulator):
+    def __init__(self, bps=115200, rx_buffer=ARDUINO_RX_BUFFER, ms_per_deg=SERVO_MS_PER_DEG, clock=time.monotonic, **options):
+        self.ms_per_deg = ms_per_deg
+        super().__init__(bps, rx_buffer=rx_buffer, clock=clock, **options)
+        self.stats.update(moves=0, dropped=0, servo_time=0.0)
+    
+    def reset(self):
+        super().reset()
+        self.absolute = False
+        self.x = self.y = 0.0
+        self.shoulder = self.elbow = SERVO_HOME
+    
+    def execute(self, command):
+        cost = super().execute(command)
+        
+        op, x, y = command
+        if op == OP_ABSOLUTE:
+            self.absolute = True
+        elif op == OP_RELATIVE:
+            self.absolute = False
+        elif op == OP_MOVE:
+            cost += self.move(x, y)
+        elif op == OP_SERVO:
+            cost += self.servo(x, y)
+        
+        return cost
+    
+    # gcodeMoveTo(): segundos de espera de los servos (0 si el punto está fuera de alcance).
+    def move(self, x, y):
+        self.stats['moves'] += 1
+        
+        if not self.absolute:
+            x += self.x
+            y += self.y
+        
+        angles = jointangle(x, y)
+        if angles is None:
+            self.stats['dropped'] += 1
+            return 0.0
+        
+        self.x, self.y = x, y
+        return self.rotate(*angles)
+    
+    # servoMoveMicroseconds(): los anchos de pulso llegan calculados desde el host.
+    def servo(self, shoulder_usec, elbow_usec):
+        self.stats['moves'] += 1
+        
+        if not (SERVO_MIN_PULSE <= shoulder_usec <= SERVO_MAX_PULSE and SERVO_MIN_PULSE <= elbow_usec <= SERVO_MAX_PULSE):
+            self.stats['dropped'] += 1
+            return 0.0
+        
+        multiplier = (SERVO_MAX_PULSE - SERVO_MIN_PULSE) / SERVO_MAX_ANGLE
+        self.x = self.y = math.nan
+        return self.rotate((shoulder_usec - SERVO_MIN_PULSE) / multiplier, (elbow_usec - SERVO_MIN_PULSE) / multiplier)
+    
+    def rotate(self, shoulder, elbow):
+        delta = max(abs(shoulder - self.shoulder), abs(elbow - self.elbow))
+        if not math.isfinite(delta):
+            delta = 180.0
+        
+        self.shoulder, self.elbow = shoulder, elbow
+        wait = math.ceil(delta * self.ms_per_deg) / 1000.0
+        self.stats['servo_time'] += wait
+        return wait
+
+# Reloj simulado para GcodeSender: sleep() no espera, salta hasta la próxima respuesta del firmware (o avanza "dt"
+# si no hay ninguna pendiente, para que los tiempos de espera de GcodeSender sigan funcionando).
+class VirtualClock:
+    def __init__(self, firmware=None):
+        self.now = 0.0
+        self.firmware = firmware
+    
+    def __call__(self):
+        return self.now
+    
+    def sleep(self, dt):
+        t = self.firmware.nextreply() if self.firmware is not None else None
+        self.now = t if t is not None and self.now < t <= self.now + dt else self.now + dt
+
+# Tiempo estimado de dibujo de un trabajo, sin hardware y sin esperar: envía las líneas con GcodeSender a un Firmware
+# en tiempo virtual, con el mismo control de flujo, la misma codificación y el mismo manejo de errores que un envío
+# real. Devuelve las estadísticas del firmware más el tiempo total estimado, el tiempo de enlace y el resultado.
+def simulate(lines, bps=115200, rx_buffer=ARDUINO_RX_BUFFER, binary=False, servo=False, firmware=None):
+    clock = VirtualClock()
+    firmware = firmware or Firmware(bps, rx_buffer)
+    firmware.clock = clock
+    clock.firmware = firmware
+    firmware.connect()
+    
+    sender = GcodeSender(firmware, rx_buffer=rx_buffer, binary=binary, servo=servo, poll=SIMULATE_POLL, clock=clock, sleep=clock.sleep)
+    with contextlib.redirect_stdout(io.StringIO()):
+        success = sender.send(lines)
+    
+    return dict(firmware.stats,
+        lines=sender.stats['lines'],
+        bytes=sender.stats['bytes'],
+        clipped=sender.stats.get('clipped', 0),
+        link_time=firmware.byte_delay(sender.stats['bytes']),
+        plot_time=sender.stats['elapsed'],
+        success=success,
+        error=sender.error)
+
+# Firmware emulado detrás de un pseudo-terminal: el dispositivo se usa con Arduino(device=...) como si fuera el puerto
+# serial real. Lo que el host escribe pasa a Firmware (con su búfer de recepción de "rx_buffer" bytes; lo que no cabe
+# se pierde y se cuenta en stats['overflow']) y sus respuestas vuelven por el pty cuando están listas.
+# "speed" acelera todos los tiempos (enlace, decodificación y servos) para las pruebas.
+class PtyFirmware:
+    def __init__(self, bps=115200, rx_buffer=ARDUINO_RX_BUFFER, speed=1.0, firmware=None):
+        self.speed = speed
+        self.firmware = firmware or Firmware(bps, rx_buffer)
+        self.firmware.clock = self.clock
+        self.master = None
+        self.device = None
+        self.thread = None
+        self.running = False
+    
+    @property
+    def stats(self):
+        return self.firmware.stats
+    
+    def clock(self):
+        return time.monotonic() * self.speed
+    
+    def start(self):
+        import pty
+        import tty
+        
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.slave = slave
+        self.device = os.ttyname(slave)
+        os.set_blocking(self.master, False)
+        
+        self.firmware.connect()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='emulador-%s' % (self.device), daemon=True)
+        self.thread.start()
+        return self.device
+    
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.master = None
+    
+    def run(self):
+        try:
+            while self.running:
+                try:
+                    data = os.read(self.master, 4096)
+                except BlockingIOError:
+                    data = b''
+                except OSError:
+                    break
+                
+                if data:
+                    self.firmware.send(data)
+                
+                waiting = self.firmware.available()
+                if waiting:
+                    os.write(self.master, self.firmware.recv(waiting))
+                    continue
+                
+                if not data:
+                    time.sleep(0.0005)
+        except:
+            traceback.print_exc()
+
+# Envía las líneas con GcodeSender a un firmware emulado en un pty y devuelve (éxito, estadísticas del envío,
+# estadísticas del firmware).
+def emulatedsend(lines, speed=1.0, bps=115200, binary=False, servo=False, sender_options=None):
+    from arduino import Arduino
+    
+    emulator = PtyFirmware(bps, speed=speed)
+    device = emulator.start()
+    
+    try:
+        arduino = Arduino(device=device, bps=bps)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if not arduino.connect():
+                return False, None, emulator.stats
+            # El firmware emulado termina sus movimientos "speed" veces más rápido.
+            options = dict(idle=FIRMWARE_IDLE / speed, settle=FIRMWARE_SETTLE / speed)
+            options.update(sender_options or {})
+            sender = GcodeSender(arduino, binary=binary, servo=servo, **options)
+            success = sender.send(lines)
+            arduino.disconnect()
+        return success, sender.stats, emulator.stats
+    finally:
+        emulator.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulador de gcode_interpreter.ino: estima el tiempo de dibujo de un G-code o atiende un pty.')
+    parser.add_argument('gcode', nargs='?', help='archivo G-code')
+    parser.add_argument('--bps', type=int, default=115200, help='velocidad del enlace serial')
+    parser.add_argument('--binary', action='store_true', help='usar tramas binarias para los movimientos')
+    parser.add_argument('--servo', action='store_true', help='enviar anchos de pulso calculados en el host')
+    parser.add_argument('--send', action='store_true', help='enviar el G-code con GcodeSender al firmware emulado en un pty')
+    parser.add_argument('--pty', action='store_true', help='atender un pty hasta Ctrl+C, para usarlo como puerto serial')
+    parser.add_argument('--speed', type=float, default=1.0, help='factor de aceleración del emulador en el pty (el sondeo del host no se acelera, así que con valores altos el envío parece más lento)')
+    args = parser.parse_args()
+    
+    if args.pty:
+        emulator = PtyFirmware(args.bps, speed=args.speed)
+        print('Firmware emulado en %s.' % (emulator.start()))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        emulator.stop()
+        print(emulator.stats)
+        return 0
+    
+    if not args.gcode:
+        parser.error('falta el archivo G-code')
+    
+    with open(args.gcode, 'r') as fd:
+        lines = fd.read().splitlines()
+    
+    estimate = simulate(lines, args.bps, binary=args.binary, servo=args.servo)
+    print('Tiempo estimado de dibujo: %.1f s (servos %.1f s, enlace %.1f s), %u líneas, %u bytes.' % (estimate['plot_time'], estimate['servo_time'], estimate['link_time'], estimate['lines'], estimate['bytes']))
+    print('Movimientos: %u, descartados por el firmware: %u, omitidos en el host: %u.' % (estimate['moves'], estimate['dropped'], estimate['clipped']))
+    if not estimate['success']:
+        print('El envío simulado falló (%s) tras %u líneas; la estimación es parcial.' % (estimate['error'], estimate['lines']))
+    
+    if args.send:
+        success, stats, firmware = emulatedsend(lines, args.speed, args.bps, args.binary, args.servo)
+        if stats is None:
+            print('No se pudo abrir el firmware emulado.')
+            return 1
+        print('Envío %s: %u líneas en %.2f s (%.1f líneas/s, %.1f s a velocidad real), %u reintentos.' % ('correcto' if success else 'fallido', stats['acked'], stats['elapsed'], stats['lines_per_sec'], stats['elapsed'] * args.speed, stats['retries']))
+        print('Firmware: %u movimientos, %u descartados, %u bytes perdidos por desborde del búfer.' % (firmware['moves'], firmware['dropped'], firmware['overflow']))
+        if not success or firmware['overflow']:
+            return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import threading
+import traceback
+import contextlib
+
+# Eventos de instrumentación de la conversión y del envío al Arduino.
+# Cada evento es un diccionario con al menos "event" (tipo) y "time" (segundos desde epoch), más los campos
+# de contexto del bus (por ejemplo, la imagen que se procesa). Tipos emitidos:
+#   stage_start:   "stage" comienza.
+#   stage_end:     "stage" terminó; "elapsed" en segundos y los conteos de la etapa (bordes, contornos, líneas, bytes...).
+#   stage_error:   "stage" falló; "error" y "traceback".
+#   send_progress: avance del envío; "acked", "total", "bytes", "lines_per_sec", "bytes_per_sec".
+#   stream_band:   en la conversión en flujo, terminó la franja "band" de "bands".
+#   cache:         resultado de la búsqueda en la caché de conversiones ("hit").
+#   finish:        fin del proceso completo ("success").
+#   connection:    cambió el estado de la conexión con el Arduino ("state", "device"); ver connection.py.
+class EventBus:
+    def __init__(self, **context):
+        self.context = context
+        self.subscribers = []
+        self.lock = threading.Lock()
+    
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+        return callback
+    
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers.remove(callback)
+    
+    # Un suscriptor que falla no interrumpe la conversión ni al resto de suscriptores.
+    def emit(self, event, **fields):
+        record = {'event': event, 'time': time.time()}
+        record.update(self.context)
+        record.update(fields)
+        
+        with self.lock:
+            subscribers = list(self.subscribers)
+        
+        for callback in subscribers:
+            try:
+                callback(record)
+            except:
+                traceback.print_exc()
+        
+        return record
+    
+    # Emite stage_start y stage_end (o stage_error) alrededor del bloque.
+    # El bloque recibe un diccionario en el que puede dejar los conteos que acompañan a stage_end.
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        info = dict(fields)
+        self.emit('stage_start', **dict(fields, stage=name))
+        start = time.perf_counter()
+        
+        try:
+            yield info
+        except Exception as e:
+            self.emit('stage_error', **dict(info, stage=name, elapsed=time.perf_counter() - start, error=str(e) or e.__class__.__name__, traceback=traceback.format_exc()))
+            raise
+        
+        self.emit('stage_end', **dict(info, stage=name, elapsed=time.perf_counter() - start))
+
+# Versiones que aceptan events=None, para que las funciones instrumentadas no dependan de tener un bus.
+def emit(events, event, **fields):
+    if events is not None:
+        return events.emit(event, **fields)
+
+@contextlib.contextmanager
+def stage(events, name, **fields):
+    if events is None:
+        yield dict(fields)
+    else:
+        with events.stage(name, **fields) as info:
+            yield info
+
+# Suscriptor que agrega cada evento como una línea JSON al archivo indicado.
+class JsonLinesLog:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+    
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            if self.file:
+                self.file.write(line + '\n')
+                self.file.flush()
+    
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+# Suscriptor que resume los eventos en el estado que muestra la interfaz: etapa actual, avance del envío y tiempo restante.
+# Se actualiza desde el hilo de conversión y se consulta desde el hilo de la interfaz.
+class ProgressModel:
+    # Tasas medidas durante menos tiempo que esto son poco fiables (el primer envío sólo llena el búfer del Arduino).
+    MIN_RATE_TIME = 2.0
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.start = time.monotonic()
+            self.stage = None
+            self.stage_start = self.start
+            self.acked = 0
+            self.total = None
+            self.lines_per_sec = 0.0
+            self.send_start = None
+            self.plot_estimate = None
+            self.band = 0
+            self.bands = None
+            self.finished = False
+            self.success = None
+    
+    def __call__(self, record):
+        event = record['event']
+        now = time.monotonic()
+        
+        with self.lock:
+            if event == 'stage_start':
+                # En la conversión en flujo las etapas de conversión ocurren durante el envío, que sigue siendo la etapa en curso.
+                if self.stage == 'send':
+                    return
+                self.stage = record['stage']
+                self.stage_start = now
+                if self.stage == 'send':
+                    self.send_start = now
+                    self.total = record.get('total')
+            elif event == 'stage_end':
+                # Tiempo de dibujo estimado a partir del recorrido optimizado, útil antes de medir la tasa real.
+                if record['stage'] == 'optimize_route' and 'time_s' in record:
+                    self.plot_estimate = record['time_s']
+            elif event == 'send_progress':
+                self.acked = record['acked']
+                self.lines_per_sec = record['lines_per_sec']
+                if record.get('total') is not None:
+                    self.total = record['total']
+            elif event == 'stream_band':
+                self.band = record['band']
+                self.bands = record['bands']
+            elif event == 'finish':
+                self.finished = True
+                self.success = record.get('success')
+    
+    # Segundos restantes estimados del envío, o None si no hay datos suficientes.
+    def eta(self):
+        with self.lock:
+            if self.send_start is None:
+                return self.plot_estimate
+            
+            elapsed = time.monotonic() - self.send_start
+            if self.total and self.lines_per_sec > 0 and elapsed >= self.MIN_RATE_TIME:
+                return max(self.total - self.acked, 0) / self.lines_per_sec
+            if self.plot_estimate is not None:
+                return max(self.plot_estimate - elapsed, 0.0)
+            return None
+    
+    def snapshot(self):
+        eta = self.eta()
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'stage': self.stage,
+                'stage_elapsed': now - self.stage_start,
+                'elapsed': now - self.start,
+                'acked': self.acked,
+                'total': self.total,
+                'lines_per_sec': self.lines_per_sec,
+                'band': self.band,
+                'bands': self.bands,
+                'eta': eta,
+                'finished': self.finished,
+                'success': self.success,
+            }
@@ -13,15 +13,42 @@ typedef struct {
   int max_pulse_width;
   double max_angle;
   double multiplier;
+  double angle;
 } ServoInfo;
 
 ServoInfo g_shoulderServoInfo, g_elbowServoInfo;
 
 const double g_innerArmLength = 80.0, g_outerArmLength = 80.0;  /* Expresado en mm. */
 
+/* Tiempo que tarda un servo en recorrer un grado (~0.1 s / 60º). Se usa para esperar a que termine cada movimiento. */
+const double g_servoMsPerDeg = 1.7;
+
 double g_posX = 0.0, g_posY = 0.0;
 bool g_absPos = false;
 
+/* Protocolo binario opcional (ver protocol.py en el host): tramas de 7 bytes que empiezan con FRAME_SYNC, */
+/* seguidas de la operación, X e Y (int16 little endian, en centésimas de mm) y un CRC-8 (polinomio 0x07) de op..Y. */
+/* FRAME_SYNC no es ASCII imprimible, así que las tramas y las líneas G-code pueden llegar mezcladas. */
+#define FRAME_SYNC      0xA5
+#define FRAME_SIZE      7
+#define FRAME_OP_MOVE   0x01
+#define FRAME_OP_ABS    0x02
+#define FRAME_OP_REL    0x03
+#define FRAME_OP_SERVO  0x04  /* X e Y son los anchos de pulso del hombro y del codo, calculados en el host. */
+#define FRAME_UNITS     100.0
+
+/* Comando en recepción: una trama (si empezó con FRAME_SYNC) o una línea G-code, leídas byte a byte. */
+/* Tras un error se descartan los bytes hasta la próxima FRAME_SYNC o el próximo salto de línea. */
+#define LINE_MAX        96
+#define COMMAND_TIMEOUT 1000  /* ms que se espera el resto de un comando incompleto. */
+
+uint8_t g_frame[FRAME_SIZE];
+uint8_t g_frameLen = 0;
+char g_line[LINE_MAX + 1];
+uint8_t g_lineLen = 0;
+bool g_discard = false;
+unsigned long g_lastByteMillis = 0;
+
 void setup() {
   /* Validar ángulos. No hacer nada si representan valores inválidos. */
   if (g_innerArmLength <= 0.0 || g_outerArmLength <= 0.0) while(true);
@@ -40,18 +67,95 @@ void setup() {
 }
 
 void loop() {
-  /* Verificar si hay datos disponibles para leer. */
-  if (Serial.available() <= 0)
+  /* Descartar el comando incompleto si el resto no llegó a tiempo. */
+  if ((g_frameLen > 0 || g_lineLen > 0) && millis() - g_lastByteMillis > COMMAND_TIMEOUT)
+  {
+    g_frameLen = g_lineLen = 0;
+    Serial.println("error: timeout");
+  }
+  
+  /* Procesar los bytes disponibles. */
+  while (Serial.available() > 0)
+  {
+    g_lastByteMillis = millis();
+    commandReceive((uint8_t)Serial.read());
+  }
+}
+
+/* Agrega un byte al comando en recepción y lo ejecuta al completarse. */
+/* Cada comando ejecutado se confirma con "ok"; el host usa esta respuesta para controlar el flujo de envío. */
+/* Los errores se informan con una línea "error: ..." sin "ok" (el comando no se ejecutó). */
+void commandReceive(uint8_t c)
+{
+  /* Trama binaria en curso. */
+  if (g_frameLen > 0)
+  {
+    g_frame[g_frameLen++] = c;
+    if (g_frameLen == FRAME_SIZE) frameReceive();
+    return;
+  }
+  
+  if (c == FRAME_SYNC)
+  {
+    /* Una trama que empieza en medio de una línea: la línea quedó incompleta. */
+    if (g_lineLen > 0) Serial.println("error: line");
+    
+    g_lineLen = 0;
+    g_discard = false;
+    g_frame[g_frameLen++] = c;
+    return;
+  }
+  
+  if (c == '\n')
+  {
+    if (!g_discard && g_lineLen > 0)
+    {
+      /* Procesar comando G-code. */
+      g_line[g_lineLen] = '\0';
+      gcodeProcessCommand(g_line);
+      Serial.println("ok");
+    }
+    
+    g_lineLen = 0;
+    g_discard = false;
+    return;
+  }
+  
+  if (g_discard || c == '\r') return;
+  
+  if (c < 0x20 || c > 0x7E || g_lineLen >= LINE_MAX)
+  {
+    /* Byte fuera de lugar (por ejemplo, el resto de una trama cuyo FRAME_SYNC se dañó) o línea demasiado larga. */
+    Serial.println(g_lineLen > 0 ? "error: line" : "error: sync");
+    
+    g_lineLen = 0;
+    g_discard = true;
+    return;
+  }
+  
+  g_line[g_lineLen++] = (char)c;
+}
+
+/* Ejecuta la trama recibida. Si está dañada puede estar desalineada (por ejemplo, si se perdió un byte), así que */
+/* se vuelve a buscar FRAME_SYNC en sus propios bytes en lugar de descartarlos todos. */
+void frameReceive()
+{
+  g_frameLen = 0;
+  
+  if (frameProcess(g_frame))
   {
-    delay(100);
+    Serial.println("ok");
     return;
   }
   
-  /* Leer datos hasta conseguir un salto de línea. */
-  String line = Serial.readStringUntil('\n');
+  Serial.println("error: checksum");
+  
+  uint8_t rest[FRAME_SIZE - 1];
+  uint8_t count = (FRAME_SIZE - 1);
+  memcpy(rest, g_frame + 1, count);
   
-  /* Procesar comando G-code. */
-  gcodeProcessCommand(line.c_str());
+  g_discard = true;
+  for(uint8_t i = 0; i < count; i++) commandReceive(rest[i]);
 }
 
 void servoInitialize(ServoInfo *servo_info, int pin, int min_pulse_width, int max_pulse_width, double max_angle)
@@ -68,6 +172,7 @@ void servoInitialize(ServoInfo *servo_info, int pin, int min_pulse_width, int ma
   servo_info->max_angle = max_angle;
   
   servo_info->multiplier = ((double)(max_pulse_width - min_pulse_width) / max_angle);
+  servo_info->angle = NAN;
 }
 
 void servoMove(ServoInfo *servo_info, double deg)
@@ -76,6 +181,7 @@ void servoMove(ServoInfo *servo_info, double deg)
   
   int usec = (int)((deg * servo_info->multiplier) + (double)servo_info->min_pulse_width);
   servo_info->servo.writeMicroseconds(usec);
+  servo_info->angle = deg;
   
 #ifdef DEBUG_SERVO
   Serial.print("Servo @ pin #");
@@ -88,6 +194,30 @@ void servoMove(ServoInfo *servo_info, double deg)
 #endif
 }
 
+/* Mueve ambos servos a los anchos de pulso indicados, sin cálculos de cinemática (ver kinematics.py en el host). */
+void servoMoveMicroseconds(int shoulder_usec, int elbow_usec)
+{
+  if (shoulder_usec < g_shoulderServoInfo.min_pulse_width || shoulder_usec > g_shoulderServoInfo.max_pulse_width) return;
+  if (elbow_usec < g_elbowServoInfo.min_pulse_width || elbow_usec > g_elbowServoInfo.max_pulse_width) return;
+  
+  double shoulder = ((double)(shoulder_usec - g_shoulderServoInfo.min_pulse_width) / g_shoulderServoInfo.multiplier);
+  double elbow = ((double)(elbow_usec - g_elbowServoInfo.min_pulse_width) / g_elbowServoInfo.multiplier);
+  
+  /* Calcular el mayor desplazamiento angular para esperar lo justo. */
+  double delta = fmax(fabs(shoulder - g_shoulderServoInfo.angle), fabs(elbow - g_elbowServoInfo.angle));
+  if (!isfinite(delta)) delta = 180.0;
+  
+  g_shoulderServoInfo.servo.writeMicroseconds(shoulder_usec);
+  g_shoulderServoInfo.angle = shoulder;
+  g_elbowServoInfo.servo.writeMicroseconds(elbow_usec);
+  g_elbowServoInfo.angle = elbow;
+  
+  delay((unsigned long)ceil(delta * g_servoMsPerDeg));
+  
+  /* La posición X,Y ya no se conoce: los movimientos relativos posteriores quedan fuera de rango. */
+  g_posX = g_posY = NAN;
+}
+
 void gcodeConvertCoordsToAngles(double x, double y, double *shoulder, double *elbow)
 {
   if (!shoulder || !elbow) return;
@@ -226,6 +356,49 @@ double map_double(double x, double in_min, double in_max, double out_min, double
   return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min;
 }
 
+/* CRC-8 con polinomio 0x07, el mismo que calcula el host. */
+uint8_t frameCrc8(const uint8_t *data, size_t size)
+{
+  uint8_t crc = 0;
+  
+  for(size_t i = 0; i < size; i++)
+  {
+    crc ^= data[i];
+    for(uint8_t j = 0; j < 8; j++) crc = ((crc & 0x80) ? ((crc << 1) ^ 0x07) : (crc << 1));
+  }
+  
+  return crc;
+}
+
+/* Ejecuta una trama binaria. Devuelve false si la trama está dañada. */
+bool frameProcess(const uint8_t *frame)
+{
+  if (!frame || frame[0] != FRAME_SYNC || frameCrc8(frame + 1, 5) != frame[6]) return false;
+  
+  int16_t x = (int16_t)((uint16_t)frame[2] | ((uint16_t)frame[3] << 8));
+  int16_t y = (int16_t)((uint16_t)frame[4] | ((uint16_t)frame[5] << 8));
+  
+  switch(frame[1])
+  {
+    case FRAME_OP_MOVE:
+      gcodeMoveTo((double)x / FRAME_UNITS, (double)y / FRAME_UNITS);
+      break;
+    case FRAME_OP_ABS:
+      g_absPos = true;
+      break;
+    case FRAME_OP_REL:
+      g_absPos = false;
+      break;
+    case FRAME_OP_SERVO:
+      servoMoveMicroseconds(x, y);
+      break;
+    default:
+      break;
+  }
+  
+  return true;
+}
+
 void gcodeProcessCommand(const char *cmd)
 {
   if (!cmd || !*cmd) return;
@@ -278,7 +451,6 @@ void gcodeMove(u32 cmd_argc, const char **cmd_argv)
   if (cmd_argc <= 1 || !cmd_argv) return;
   
   double x = 0.0, y = 0.0;
-  double shoulder = 0.0, elbow = 0.0;
   
   for(u32 i = 1; i < cmd_argc; i++)
   {
@@ -289,6 +461,14 @@ void gcodeMove(u32 cmd_argc, const char **cmd_argv)
     *value = strtod(cmd_argv[i] + 1, NULL);
   }
   
+  gcodeMoveTo(x, y);
+}
+
+/* Mueve el brazo a X,Y (relativo a la posición actual si el posicionamiento es relativo). */
+void gcodeMoveTo(double x, double y)
+{
+  double shoulder = 0.0, elbow = 0.0;
+  
   /* Sumar coordenadas actuales a las proporcionadas si estamos en modo relativo. */
   if (!g_absPos)
   {
@@ -312,10 +492,17 @@ void gcodeMove(u32 cmd_argc, const char **cmd_argv)
     return;
   }
   
+  /* Calcular el mayor desplazamiento angular para esperar lo justo. */
+  double delta = fmax(fabs(shoulder - g_shoulderServoInfo.angle), fabs(elbow - g_elbowServoInfo.angle));
+  if (!isfinite(delta)) delta = 180.0;
+  
   /* Mover brazo robótico. */
   servoMove(&g_shoulderServoInfo, shoulder);
   servoMove(&g_elbowServoInfo, elbow);
   
+  /* Esperar a que los servos lleguen a su destino antes de confirmar el comando. */
+  delay((unsigned long)ceil(delta * g_servoMsPerDeg));
+  
   /* Actualizar coordenadas actuales. */
   g_posX = x;
   g_posY = y;
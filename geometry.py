@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import itertools
+from array import array
+
+no_np = False
+
+try:
+    import numpy as np
+except:
+    no_np = True
+
+# Conjunto de polilíneas en memoria compacta: todas las coordenadas en un único búfer plano float32
+# [x0, y0, x1, y1, ...] y un arreglo de desplazamientos (en puntos) donde empieza cada línea, más el total al final.
+# Los búferes son array.array, así que funciona sin NumPy; con NumPy se acceden como matrices sin copiarlos.
+# Las coordenadas de la vectorización son enteras o múltiplos de 1/4, por lo que float32 las representa exactamente.
+class Polylines:
+    def __init__(self, coords=None, offsets=None):
+        self.coords = array('f') if coords is None else coords
+        self.offsets = array('q', [0]) if offsets is None else offsets
+    
+    @classmethod
+    def fromlines(cls, lines):
+        polylines = cls()
+        polylines.extend(lines)
+        return polylines
+    
+    # "points" es una matriz N x 2 y "offsets" tiene len(líneas) + 1 elementos, comenzando en 0.
+    @classmethod
+    def fromarrays(cls, points, offsets):
+        return cls(array('f', np.ascontiguousarray(points, dtype=np.float32).tobytes()), array('q', np.ascontiguousarray(offsets, dtype=np.int64).tobytes()))
+    
+    def append(self, line):
+        self.coords.extend(itertools.chain.from_iterable(line))
+        self.offsets.append(len(self.coords) // 2)
+    
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    # Cada línea se entrega como una lista nueva de tuplas (x, y), igual que en el resto de la conversión.
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('índice de línea fuera de rango')
+        c = self.coords[2 * self.offsets[i]:2 * self.offsets[i + 1]]
+        return list(zip(c[0::2], c[1::2]))
+    
+    def __iter__(self):
+        c = self.coords.tolist()
+        for a, b in zip(self.offsets, self.offsets[1:]):
+            yield list(zip(c[2 * a:2 * b:2], c[2 * a + 1:2 * b:2]))
+    
+    def __add__(self, other):
+        if not isinstance(other, Polylines):
+            other = Polylines.fromlines(other)
+        base = self.offsets[-1]
+        return Polylines(self.coords + other.coords, self.offsets + array('q', (o + base for o in other.offsets[1:])))
+    
+    def npoints(self):
+        return self.offsets[-1]
+    
+    # Vistas NumPy (sin copia) de los puntos (N x 2) y de los desplazamientos.
+    def points(self):
+        return np.frombuffer(self.coords, dtype=np.float32).reshape(-1, 2)
+    
+    def npoffsets(self):
+        return np.frombuffer(self.offsets, dtype=np.int64)
+    
+    # Extremos de cada línea: [((x inicial, y inicial), (x final, y final)), ...].
+    def endpoints(self):
+        if no_np:
+            c = self.coords
+            return [((c[2 * a], c[2 * a + 1]), (c[2 * b - 2], c[2 * b - 1])) for a, b in zip(self.offsets, self.offsets[1:])]
+        
+        P = self.points()
+        o = self.npoffsets()
+        E = np.hstack((P[o[:-1]], P[o[1:] - 1])).tolist()
+        return [((a, b), (c, d)) for a, b, c, d in E]
+    
+    # Nuevo conjunto con las líneas en el orden indicado, invertidas donde flip[k] (k es la posición en "order").
+    def take(self, order, flip=None):
+        if no_np:
+            out = Polylines()
+            for k, i in enumerate(order):
+                line = self[i]
+                out.append(line[::-1] if flip and flip[k] else line)
+            return out
+        
+        order = np.asarray(order, dtype=np.int64)
+        o = self.npoffsets()
+        starts = o[:-1][order]
+        sizes = o[1:][order] - starts
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        
+        # Posición de cada punto dentro de su línea, contada desde el final en las líneas invertidas.
+        k = np.arange(offsets[-1]) - np.repeat(offsets[:-1], sizes)
+        if flip is not None:
+            rev = np.repeat(np.asarray(flip, dtype=bool), sizes)
+            k = np.where(rev, np.repeat(sizes - 1, sizes) - k, k)
+        
+        return Polylines.fromarrays(self.points()[np.repeat(starts, sizes) + k], offsets)
+    
+    # Mismas líneas con las coordenadas multiplicadas por "factor".
+    def scaled(self, factor):
+        if no_np:
+            return Polylines(array('f', [v * factor for v in self.coords]), array('q', self.offsets))
+        return Polylines.fromarrays(self.points() * factor, self.npoffsets())
+    
+    # Mismas líneas desplazadas (dx, dy).
+    def translated(self, dx, dy):
+        if no_np:
+            return Polylines(array('f', [v + (dy if k % 2 else dx) for k, v in enumerate(self.coords)]), array('q', self.offsets))
+        return Polylines.fromarrays(self.points() + np.array([dx, dy], dtype=np.float32), self.npoffsets())
+    
+    # Máximos x e y de todas las coordenadas.
+    def maxima(self):
+        if self.npoints() == 0:
+            return None
+        if no_np:
+            return max(self.coords[0::2]), max(self.coords[1::2])
+        m = self.points().max(axis=0).tolist()
+        return m[0], m[1]
+
+# Secuencia de grupos [(Polylines, repeticiones), ...]: cada repetición es una referencia al mismo grupo,
+# sin copiar coordenadas. Al recorrerla entrega las líneas en orden, repitiendo cada grupo las veces indicadas.
+class PolylineGroups:
+    def __init__(self, groups):
+        self.groups = [(group, repeat) for group, repeat in groups if repeat > 0]
+    
+    def __len__(self):
+        return sum(len(group) * repeat for group, repeat in self.groups)
+    
+    def __iter__(self):
+        for group, repeat in self.groups:
+            for r in range(repeat):
+                yield from group
+    
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        for group, repeat in self.groups:
+            if i < len(group) * repeat:
+                return group[i % len(group)]
+            i -= len(group) * repeat
+        raise IndexError('índice de línea fuera de rango')
+
+# Secuencia de grupos (Polylines, repeticiones) que se van produciendo sobre la marcha, por ejemplo franja por franja.
+# "groups" puede ser un generador, así que sólo se recorre una vez.
+class PolylineStream:
+    def __init__(self, groups):
+        self.groups = groups
+    
+    def __iter__(self):
+        for group, repeat in self.groups:
+            for r in range(repeat):
+                yield from group
+
+# Extremos de cada línea, para Polylines o para listas de líneas.
+def endpoints(lines):
+    if isinstance(lines, Polylines):
+        return lines.endpoints()
+    return [(l[0], l[-1]) for l in lines]
+
+# Reordena las líneas (invirtiendo donde flip[k]) conservando el tipo de contenedor.
+def reorder(lines, order, flip=None):
+    if isinstance(lines, Polylines):
+        return lines.take(order, flip)
+    return [lines[i][::-1] if flip and flip[k] else lines[i] for k, i in enumerate(order)]
@@ -6,44 +6,70 @@ import threading
 import re
 import traceback
 import ctypes
+import importlib
 
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
 from tkinter import font
 
-import PIL
-from PIL import Image
-
-from conversion import convertPngToSvg, convertSvgToGcode
-
-from arduino import *
-
-import mysql.connector
+from settings import *
+from cache import ConversionCache
+from storage import openConversionStore
+from events import EventBus, JsonLinesLog, ProgressModel
+from connection import ArduinoConnection, DISCONNECTED, CONNECTING, CONNECTED
 
 import time
 
-MAX_WIDTH_MM = 30.0
-MAX_HEIGHT_MM = 30.0
-
-OFFSET_X_MM = 80.0
-OFFSEY_Y_MM = 80.0
-
 WINDOWS_SCALING_FACTOR = 96.0
 SCALE = 1.0
 
 WINDOW_WIDTH = 400
-WINDOW_HEIGHT = 160
-
-DB_HOST = "localhost"
-DB_USER = "root"
-DB_PASS = ""
-DB_NAME = "png2gcode"
-
-
-def arduinoSendGcode(gcode_path):
+WINDOW_HEIGHT = 180
+
+# Intervalo de actualización del texto de progreso, en milisegundos.
+PROGRESS_UPDATE_MS = 200
+
+# Intervalo de actualización del estado de la conexión con el Arduino, en milisegundos.
+CONNECTION_UPDATE_MS = 500
+
+CONNECTION_LABELS = {
+    None: "Iniciando...",
+    DISCONNECTED: "Arduino desconectado",
+    CONNECTING: "Conectando al Arduino...",
+    CONNECTED: "Arduino conectado",
+}
+
+STAGE_LABELS = {
+    "vectorise": "Vectorizando",
+    "find_edges": "Detectando bordes",
+    "contours": "Trazando contornos",
+    "hatch": "Generando sombreado",
+    "sortlines": "Ordenando trazos",
+    "simplify": "Simplificando trazos",
+    "optimize_route": "Optimizando recorrido",
+    "gcode": "Generando G-code",
+    "svg": "Generando SVG",
+    "send": "Enviando al Arduino",
+}
+
+# Módulos pesados que se cargan en segundo plano después de mostrar la ventana (ver startupWarmup()).
+# Cada función que los usa los importa igualmente al llamarse, así que el orden de carga no afecta el resultado.
+STARTUP_WARMUP_MODULES = ("PIL.Image", "conversion", "sender", "kinematics")
+
+# Intervalo de revisión del fin de la carga en segundo plano, en milisegundos.
+STARTUP_UPDATE_MS = 50
+
+# Con KIOSK_STARTUP_BENCHMARK definido, el programa informa en la salida estándar cuándo se dibuja la primera
+# ventana y cuándo termina la carga en segundo plano, y luego se cierra (ver startup.py).
+STARTUP_BENCHMARK = bool(os.environ.get("KIOSK_STARTUP_BENCHMARK"))
+
+
+def arduinoSendGcode(gcode_path, events=None):
     global g_tkRoot
-    global g_arduinoObj
+    global g_connection
+
+    from kinematics import checkgcode, clipgcode
 
     try:
         file = open(gcode_path, "r")
@@ -58,34 +84,91 @@ def arduinoSendGcode(gcode_path):
         )
         return False
 
-    if not g_arduinoObj.connect():
-        messagebox.showerror("Error", "¡Error de conexión al Arduino!", parent=g_tkRoot)
-        return False
-
-    for line in lines:
-        print('Enviando: "%s"' % (line.strip()))
-
-        if not g_arduinoObj.send(line.encode("utf-8")):
-            messagebox.showerror(
-                "Error", "¡Error de envío al Arduino!", parent=g_tkRoot
+    # Revisar el alcance del brazo antes de enviar: el Arduino descarta los puntos inalcanzables sin avisar.
+    report = checkgcode(lines)
+    if report["unreachable"]:
+        print(
+            "%u de %u puntos fuera de alcance (%u tramos), por ejemplo: %s."
+            % (
+                report["unreachable"],
+                report["moves"],
+                report["segments"],
+                ", ".join(
+                    "línea %u (%.1f, %.1f)" % example for example in report["examples"]
+                ),
             )
+        )
+        if not messagebox.askyesno(
+            "Aviso",
+            "%u de %u puntos están fuera del alcance del brazo. Se omitirán y el brazo trazará una línea recta entre los puntos alcanzables que los rodean. ¿Continuar?"
+            % (report["unreachable"], report["moves"]),
+            parent=g_tkRoot,
+        ):
             return False
+        if not SERIAL_SERVO_ANGLES:
+            lines = list(clipgcode(lines))
+
+    return arduinoSendLines(lines, events)
+
+
+# Convierte la imagen en flujo y envía cada línea de G-code apenas se genera, para que el brazo empiece a dibujar
+# sin esperar a que termine la conversión. El G-code y el SVG quedan igualmente guardados en sus rutas.
+def arduinoStreamGcode(image, gcode_path, svg_path, events=None):
+    from conversion import streamPngToGcode
+    from kinematics import clipgcode
+
+    lines = streamPngToGcode(
+        image,
+        gcode_path,
+        MAX_WIDTH_MM,
+        MAX_HEIGHT_MM,
+        OFFSET_X_MM,
+        OFFSEY_Y_MM,
+        svg_path=svg_path,
+        events=events,
+    )
 
-        time.sleep(0.015)  # 15 ms
+    # Sin revisión previa: los puntos fuera de alcance se omiten a medida que llegan.
+    if not SERIAL_SERVO_ANGLES:
+        lines = clipgcode(lines)
 
-        """
-        while g_arduinoObj.available():
-            response = g_arduinoObj.recv_until()
-            if not response:
-                messagebox.showerror('Error', '¡Error de recepción desde el Arduino!', parent=g_tkRoot)
-                return False
+    return arduinoSendLines(
+        lines, events, "¡Error durante la conversión o el envío al Arduino!"
+    )
 
-            print('Recibiendo: %s' % (response.decode('utf-8').strip()))
 
-            time.sleep(0.05) # 50 ms
-        """
+def arduinoSendLines(lines, events=None, error_message="¡Error de envío al Arduino!"):
+    global g_tkRoot
+    global g_connection
 
-    g_arduinoObj.disconnect()
+    from sender import GcodeSender
+
+    # El puerto queda abierto entre trabajos; si el Arduino se desconecta, el vigilante lo reabre al volver.
+    with g_connection.acquire() as arduino:
+        if arduino is None:
+            messagebox.showerror(
+                "Error", "¡Error de conexión al Arduino!", parent=g_tkRoot
+            )
+            return False
+
+        # Enviar con control de flujo: cada línea (o trama) se confirma con "ok" desde el Arduino.
+        sender = GcodeSender(
+            arduino, binary=SERIAL_BINARY_PROTOCOL, servo=SERIAL_SERVO_ANGLES
+        )
+        if not sender.send(lines, events=events):
+            messagebox.showerror("Error", error_message, parent=g_tkRoot)
+            return False
+
+    print(
+        "Enviadas %u líneas (%u bytes) en %.2f s (%.1f líneas/s, %u reintentos)."
+        % (
+            sender.stats["acked"],
+            sender.stats["bytes"],
+            sender.stats["elapsed"],
+            sender.stats["lines_per_sec"],
+            sender.stats["retries"],
+        )
+    )
 
     return True
 
@@ -94,31 +177,102 @@ def imageTracingThreadFunc(name, last_name, png_path, image):
     global g_tkRoot
     global g_tkCanvas
     global g_tkProgressText
-    global g_dbConnection
-    global g_dbCursor
-    global g_arduinoObj
+    global g_dbStore
+    global g_connection
+    global g_conversionCache
+    global g_progress
+    global g_eventLog
+
+    from conversion import (
+        convertPngToGcode,
+        STREAM_BAND_ROWS,
+        VECTORISE_OPTIONS,
+        SIMPLIFY_TOLERANCE_MM,
+        ROUTE_TIME_BUDGET,
+        GCODE_MOVEMENT_SPEED,
+        GCODE_CUTTING_SPEED,
+    )
 
     success = False
 
+    # Eventos de esta conversión: progreso en la ventana y, opcionalmente, registro JSON.
+    events = EventBus(png_path=png_path)
+    events.subscribe(g_progress)
+    if g_eventLog:
+        events.subscribe(g_eventLog)
+
     # Generar rutas de salida.
     png_filename = os.path.splitext(png_path)[0]
     svg_path = png_filename + ".svg"
     gcode_path = png_filename + ".gcode"
 
-    # Realizar conversión PNG -> SVG -> G-code.
-    success = (
-        convertPngToSvg(
-            image, svg_path, MAX_WIDTH_MM, MAX_HEIGHT_MM, OFFSET_X_MM, OFFSEY_Y_MM
+    # Buscar una conversión previa de la misma imagen con los mismos parámetros.
+    cache_key = g_conversionCache.key(
+        image,
+        {
+            "vectorise": VECTORISE_OPTIONS,
+            "simplify_tolerance_mm": SIMPLIFY_TOLERANCE_MM,
+            "route_time_budget": ROUTE_TIME_BUDGET,
+            "max_width_mm": MAX_WIDTH_MM,
+            "max_height_mm": MAX_HEIGHT_MM,
+            "offset_x_mm": OFFSET_X_MM,
+            "offset_y_mm": OFFSEY_Y_MM,
+            "movement_speed": GCODE_MOVEMENT_SPEED,
+            "cutting_speed": GCODE_CUTTING_SPEED,
+            "stream_band_rows": STREAM_BAND_ROWS if STREAM_PLOTTING else None,
+        },
+    )
+
+    # El envío ya ocurrió si la imagen se convirtió en flujo.
+    sent = False
+
+    if g_conversionCache.get(cache_key, gcode_path, svg_path):
+        events.emit("cache", hit=True)
+        success = True
+    elif STREAM_PLOTTING:
+        events.emit("cache", hit=False)
+
+        # Convertir y enviar al mismo tiempo (el SVG se guarda para el registro histórico).
+        success = arduinoStreamGcode(image, gcode_path, svg_path, events)
+        sent = True
+
+        if success:
+            g_conversionCache.put(cache_key, gcode_path, svg_path)
+    else:
+        events.emit("cache", hit=False)
+
+        # Realizar conversión PNG -> G-code (el SVG se guarda para el registro histórico).
+        success = (
+            convertPngToGcode(
+                image,
+                gcode_path,
+                MAX_WIDTH_MM,
+                MAX_HEIGHT_MM,
+                OFFSET_X_MM,
+                OFFSEY_Y_MM,
+                svg_path=svg_path,
+                events=events,
+            )
+            == True
         )
-        == True
-    ) and (convertSvgToGcode(svg_path, gcode_path) == True)
+
+        if success:
+            g_conversionCache.put(cache_key, gcode_path, svg_path)
+
+    print(
+        "Caché de conversiones: %(hits)u aciertos, %(misses)u fallos, %(entries)u entradas (%(bytes)u bytes)."
+        % g_conversionCache.stats()
+    )
 
     # Cerrar imagen PNG.
     image.close()
 
-    if success:
+    if sent:
+        # La conversión en flujo ya informó sus errores.
+        pass
+    elif success:
         # Enviar G-code al Arduino línea por línea.
-        success = arduinoSendGcode(gcode_path)
+        success = arduinoSendGcode(gcode_path, events)
     else:
         messagebox.showerror(
             "Error",
@@ -126,6 +280,8 @@ def imageTracingThreadFunc(name, last_name, png_path, image):
             parent=g_tkRoot,
         )
 
+    events.emit("finish", success=success)
+
     # Remover texto de conversión.
     g_tkCanvas.itemconfigure(g_tkProgressText, state="hidden")
 
@@ -136,13 +292,14 @@ def imageTracingThreadFunc(name, last_name, png_path, image):
     if not success:
         return
 
-    # Guardar registro en base de datos.
-    sql = "INSERT INTO `conversions` (`name`, `last_name`, `png_path`, `svg_path`) VALUES (%s, %s, %s, %s)"
-    val = (name, last_name, png_path, svg_path)
+    # Guardar registro en base de datos. Si falla, el registro queda pendiente para la próxima escritura.
+    # Se escribe en cada conversión y no por lotes: el kiosco hace una conversión por persona, así que esperar a
+    # juntar registros sólo los dejaría sin guardar (y se perderían si el equipo se apaga) y ocultaría los errores
+    # de la base de datos a quien está frente a la pantalla. Los lotes de storage.py son para batch.py.
+    g_dbStore.add(name, last_name, png_path, svg_path)
 
     try:
-        g_dbCursor.execute(sql, val)
-        g_dbConnection.commit()
+        g_dbStore.flush()
     except:
         traceback.print_exc()
         messagebox.showerror(
@@ -161,6 +318,67 @@ def imageTracingThreadFunc(name, last_name, png_path, image):
     )
 
 
+def uiFormatDuration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%u:%02u:%02u" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return "%u:%02u" % (seconds // 60, seconds % 60)
+
+
+# Actualiza el texto de progreso con el estado de la conversión en curso. Corre en el hilo de la interfaz.
+def uiUpdateProgress():
+    global g_tkRoot
+    global g_tkCanvas
+    global g_tkProgressText
+    global g_progress
+
+    progress = g_progress.snapshot()
+    if progress["finished"]:
+        return
+
+    label = STAGE_LABELS.get(progress["stage"], "Conversión en progreso")
+
+    if progress["stage"] == "send" and progress["bands"]:
+        # Conversión en flujo: el total de líneas no se conoce hasta convertir la última franja.
+        text = "%s: franja %u/%u (%u líneas, %.1f líneas/s)" % (
+            label,
+            progress["band"],
+            progress["bands"],
+            progress["acked"],
+            progress["lines_per_sec"],
+        )
+    elif progress["stage"] == "send" and progress["total"]:
+        text = "%s: %u%% (%u/%u líneas, %.1f líneas/s)" % (
+            label,
+            progress["acked"] * 100 // progress["total"],
+            progress["acked"],
+            progress["total"],
+            progress["lines_per_sec"],
+        )
+    else:
+        text = "%s... %s" % (label, uiFormatDuration(progress["elapsed"]))
+
+    if progress["eta"] is not None:
+        text += ". Restante: %s" % (uiFormatDuration(progress["eta"]))
+
+    g_tkCanvas.itemconfigure(g_tkProgressText, text=text)
+    g_tkRoot.after(PROGRESS_UPDATE_MS, uiUpdateProgress)
+
+
+def uiUpdateConnection():
+    global g_tkRoot
+    global g_tkCanvas
+    global g_tkConnectionText
+    global g_connection
+
+    text = CONNECTION_LABELS[g_connection.state if g_connection else None]
+    if g_connection and g_connection.device:
+        text += " (%s)" % (g_connection.device)
+
+    g_tkCanvas.itemconfigure(g_tkConnectionText, text=text)
+    g_tkRoot.after(CONNECTION_UPDATE_MS, uiUpdateConnection)
+
+
 def uiHandleExitProtocol():
     global g_tkRoot
 
@@ -198,7 +416,15 @@ def uiOpenPng():
     global g_tkNameText
     global g_tkLastNameText
     global g_tkOpenPngButton
-    global g_arduinoObj
+    global g_connection
+    global g_startupReady
+
+    # El botón se habilita al terminar la carga inicial; Enter no debe adelantarse.
+    if not g_startupReady.is_set():
+        return
+
+    import PIL
+    from PIL import Image
 
     name = re.sub(
         r"\s+", " ", g_tkNameText.get("1.0", tk.END).strip(), flags=re.MULTILINE
@@ -218,8 +444,8 @@ def uiOpenPng():
         )
         return
 
-    # Verificar si hay un Arduino conectado.
-    if not g_arduinoObj.is_available():
+    # Verificar si hay un Arduino conectado (o conectándose). El estado lo mantiene el vigilante de la conexión.
+    if g_connection.state == DISCONNECTED:
         messagebox.showerror(
             "Error", "¡Conecte un Arduino al sistema!", parent=g_tkRoot
         )
@@ -256,8 +482,14 @@ def uiOpenPng():
     # Deshabilitar elementos de la ventana.
     uiToggleElements(False)
 
-    # Mostrar texto de conversión.
-    g_tkCanvas.itemconfigure(g_tkProgressText, state="normal")
+    # Mostrar texto de conversión y actualizarlo periódicamente con el progreso.
+    g_progress.reset()
+    g_tkCanvas.itemconfigure(
+        g_tkProgressText,
+        text="Conversión en progreso. Por favor, espere.",
+        state="normal",
+    )
+    g_tkRoot.after(PROGRESS_UPDATE_MS, uiUpdateProgress)
 
     # Crear hilo secundario en el que llevaremos a cabo el proceso de conversión y retornar inmediatamente.
     conv_thread = threading.Thread(
@@ -283,6 +515,118 @@ def uiHandleShiftTabInput(event):
     return "break"
 
 
+# Carga lo que la ventana no necesita para dibujarse: la conexión con el Arduino (pyserial), la base de datos
+# (conector MySQL) y los módulos de conversión (NumPy, OpenCV, PIL). Con FAST_STARTUP corre en un hilo secundario
+# una vez dibujada la ventana. g_startupReady indica que la interfaz puede usarse; si la base de datos falla,
+# el error queda en g_startupError. g_startupWarm indica que además terminaron de cargarse los módulos.
+def startupWarmup(connection_events):
+    global g_dbStore
+    global g_arduinoObj
+    global g_connection
+    global g_startupReady
+    global g_startupWarm
+    global g_startupError
+
+    from arduino import Arduino
+
+    # Conexión persistente con el Arduino, vigilada en segundo plano desde el inicio.
+    g_arduinoObj = Arduino()
+    connection = ArduinoConnection(g_arduinoObj, events=connection_events)
+    connection.start()
+    g_connection = connection
+
+    # Conectar a la base de datos (pool de conexiones).
+    try:
+        g_dbStore = openConversionStore()
+    except Exception as e:
+        traceback.print_exc()
+        g_startupError = e
+        return
+
+    g_startupReady.set()
+
+    # Cargar los módulos de conversión antes de que el usuario elija una imagen.
+    for module in STARTUP_WARMUP_MODULES:
+        try:
+            importlib.import_module(module)
+        except:
+            traceback.print_exc()
+
+    g_startupWarm.set()
+
+
+def uiStartupMark(marker):
+    if STARTUP_BENCHMARK:
+        print("startup: %s" % (marker), flush=True)
+
+
+def uiStartupFailed():
+    global g_tkRoot
+
+    uiStartupMark("error")
+    if not STARTUP_BENCHMARK:
+        messagebox.showerror(
+            "Error",
+            '¡No se pudo conectar a la base de datos MySQL "{}" en "{}"!'.format(
+                DB_NAME, DB_HOST
+            ),
+            parent=g_tkRoot,
+        )
+    g_tkRoot.destroy()
+
+
+# Primer dibujado de la ventana: recién entonces comienza la carga en segundo plano.
+def uiHandleFirstFrame(event):
+    global g_tkRoot
+    global g_tkCanvas
+    global g_startupThread
+
+    g_tkCanvas.unbind("<Expose>")
+    uiStartupMark("first_frame")
+
+    if g_startupThread is not None:
+        g_startupThread.start()
+        g_tkRoot.after(STARTUP_UPDATE_MS, uiCheckStartup)
+    else:
+        uiStartupMark("ready")
+        uiCheckWarmup()
+
+
+def uiCheckStartup():
+    global g_tkRoot
+    global g_tkOpenPngButton
+    global g_startupReady
+    global g_startupError
+
+    if g_startupError is not None:
+        uiStartupFailed()
+        return
+
+    if not g_startupReady.is_set():
+        g_tkRoot.after(STARTUP_UPDATE_MS, uiCheckStartup)
+        return
+
+    g_tkOpenPngButton["state"] = "normal"
+    uiStartupMark("ready")
+    uiCheckWarmup()
+
+
+# Sólo para la medición del inicio: espera a que terminen de cargarse los módulos y cierra el programa.
+def uiCheckWarmup():
+    global g_tkRoot
+    global g_startupWarm
+
+    if not STARTUP_BENCHMARK:
+        return
+
+    if not g_startupWarm.is_set():
+        g_tkRoot.after(STARTUP_UPDATE_MS, uiCheckWarmup)
+        return
+
+    uiStartupMark("warm")
+    g_tkRoot.destroy()
+
+
 def uiScaleMeasure(measure):
     return round(float(measure) * SCALE)
 
@@ -295,11 +639,40 @@ def main():
     global g_tkLastNameText
     global g_tkOpenPngButton
     global g_tkProgressText
-    global g_dbConnection
-    global g_dbCursor
+    global g_tkConnectionText
+    global g_dbStore
     global g_arduinoObj
+    global g_connection
+    global g_conversionCache
+    global g_progress
+    global g_eventLog
+    global g_startupThread
+    global g_startupReady
+    global g_startupWarm
+    global g_startupError
+
+    g_dbStore = None
+    g_arduinoObj = None
+    g_connection = None
+    g_conversionCache = ConversionCache(CACHE_DIR, CACHE_MAX_BYTES)
+    g_progress = ProgressModel()
+
+    # Abrir el registro de eventos. Sin él, la conversión funciona igual.
+    g_eventLog = None
+    if EVENT_LOG_PATH:
+        try:
+            g_eventLog = JsonLinesLog(EVENT_LOG_PATH)
+        except:
+            traceback.print_exc()
 
-    g_arduinoObj = Arduino()
+    connection_events = EventBus()
+    if g_eventLog:
+        connection_events.subscribe(g_eventLog)
+
+    g_startupReady = threading.Event()
+    g_startupWarm = threading.Event()
+    g_startupError = None
+    g_startupThread = None
 
     # Obtener información sobre el sistema.
     os_type = platform.system()
@@ -339,24 +712,18 @@ def main():
         % (screen_width_px, screen_height_px, screen_dpi, SCALE * 100.0)
     )
 
-    # Conectar a la base de datos MySQL.
-    try:
-        g_dbConnection = mysql.connector.connect(
-            host=DB_HOST, user=DB_USER, password=DB_PASS, database=DB_NAME
-        )
-        g_dbCursor = g_dbConnection.cursor()
-    except:
-        traceback.print_exc()
-        g_tkRoot.withdraw()
-        messagebox.showerror(
-            "Error",
-            '¡No se pudo conectar a la base de datos MySQL "{}" en "{}"!'.format(
-                DB_NAME, DB_HOST
-            ),
-            parent=g_tkRoot,
+    if FAST_STARTUP:
+        # La carga comienza después del primer dibujado de la ventana (ver uiHandleFirstFrame()).
+        g_startupThread = threading.Thread(
+            target=startupWarmup, args=[connection_events], daemon=True
         )
-        g_tkRoot.destroy()
-        return
+    else:
+        startupWarmup(connection_events)
+        if g_startupError is not None:
+            g_tkRoot.withdraw()
+            uiStartupFailed()
+            g_connection.stop()
+            return
 
     g_tkRoot.resizable(False, False)  # La ventana no será redimensionable.
     g_tkRoot.title("Sistema de vectorización de imágenes")  # Título de la ventana.
@@ -409,6 +776,8 @@ def main():
     )
 
     g_tkOpenPngButton = tk.Button(text="Abrir PNG", command=uiOpenPng, width=10)
+    if not g_startupReady.is_set():
+        g_tkOpenPngButton["state"] = "disabled"
     g_tkCanvas.create_window(
         uiScaleMeasure(200),
         uiScaleMeasure(100),
@@ -424,13 +793,35 @@ def main():
     )
     g_tkCanvas.itemconfigure(g_tkProgressText, state="hidden")
 
+    g_tkConnectionText = g_tkCanvas.create_text(
+        uiScaleMeasure(200),
+        uiScaleMeasure(165),
+        text=CONNECTION_LABELS[None],
+        anchor=tk.CENTER,
+    )
+    uiUpdateConnection()
+
     g_tkRoot.bind("<Return>", uiDefaultAction)
+    g_tkCanvas.bind("<Expose>", uiHandleFirstFrame)
 
     g_tkRoot.mainloop()
 
-    # Desconectar de la base de datos
-    g_dbCursor.close()
-    g_dbConnection.close()
+    # Si la ventana se cerró durante la carga, esperar a que termine para cerrar lo que haya abierto.
+    if g_startupThread is not None and g_startupThread.is_alive():
+        g_startupThread.join()
+
+    if g_connection:
+        g_connection.stop()
+
+    # Escribir registros pendientes y desconectar de la base de datos.
+    if g_dbStore:
+        try:
+            g_dbStore.close()
+        except:
+            traceback.print_exc()
+
+    if g_eventLog:
+        g_eventLog.close()
 
 
 if __name__ == "__main__":
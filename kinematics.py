@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import math
+
+from protocol import parsecommand, encodeframe, encodeline, OP_ABSOLUTE, OP_RELATIVE, OP_SERVO
+
+no_np = False
+
+try:
+    import numpy as np
+except:
+    no_np = True
+
+# Cinemática del brazo, la misma de gcodeConvertCoordsToAngles() en gcode_interpreter.ino.
+INNER_ARM_MM = 80.0
+OUTER_ARM_MM = 80.0
+
+# Rango al que se llevan los ángulos del hombro y del codo antes de enviarlos a los servos.
+SHOULDER_RANGE = (110.0, 180.0)
+ELBOW_RANGE = (130.0, 180.0)
+
+# Pulsos de los servos (servoInitialize() en el firmware): ancho mínimo y máximo en microsegundos y ángulo máximo.
+SERVO_MIN_PULSE = 500
+SERVO_MAX_PULSE = 2500
+SERVO_MAX_ANGLE = 180.0
+
+# Líneas que se resuelven juntas en cada lote de NumPy. Un lote chico no retrasa el envío en flujo.
+SOLVE_CHUNK = 256
+
+def valmap(x, in_min, in_max, out_min, out_max):
+    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+# Ángulos (hombro, codo) de los servos para el punto (x, y) en mm, o None si el punto está fuera de alcance.
+# Sigue paso a paso el cálculo del firmware, incluidos sus casos límite.
+def jointangle(x, y, inner=INNER_ARM_MM, outer=OUTER_ARM_MM):
+    def vertex(a, b, c):
+        try:
+            return math.acos(((a * a) + (b * b) - (c * c)) / (2 * abs(a) * abs(b)))
+        except (ValueError, ZeroDivisionError):
+            return math.nan
+    
+    d_inner = math.hypot(x, y)
+    d_inner_angle = vertex(d_inner, inner, outer)
+    if not math.isfinite(d_inner_angle):
+        return None
+    
+    # Como en C, x / 0 es infinito con el signo de x y del cero, y atan() de infinito es +-pi/2.
+    try:
+        d_y_angle = math.atan(x / y)
+    except ZeroDivisionError:
+        d_y_angle = math.nan if x == 0 else math.atan(math.copysign(math.inf, x) * math.copysign(1.0, y))
+    if not math.isfinite(d_y_angle):
+        return None
+    
+    inner_y_angle = max(d_inner_angle, abs(d_y_angle)) - min(d_inner_angle, abs(d_y_angle))
+    shoulder_angle = math.degrees(inner_y_angle) * (-1.0 if d_y_angle < 0.0 else 1.0) + 90.0
+    if shoulder_angle < 0.0 or shoulder_angle > 180.0:
+        return None
+    
+    inner_outer_angle = vertex(inner, outer, d_inner)
+    if not math.isfinite(inner_outer_angle):
+        return None
+    
+    elbow_angle = 180.0 - math.degrees(inner_outer_angle)
+    if elbow_angle < 0.0 or elbow_angle > 180.0:
+        return None
+    
+    return valmap(180.0 - shoulder_angle, 0.0, 180.0, *SHOULDER_RANGE), valmap(180.0 - elbow_angle, 0.0, 180.0, *ELBOW_RANGE)
+
+# Igual que jointangle() para matrices de puntos. Devuelve (hombro, codo) con NaN en los puntos fuera de alcance.
+def jointangles(x, y, inner=INNER_ARM_MM, outer=OUTER_ARM_MM):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_inner = np.hypot(x, y)
+        d_inner_angle = np.arccos((d_inner * d_inner + inner * inner - outer * outer) / (2 * d_inner * abs(inner)))
+        d_y_angle = np.arctan(x / y)
+        
+        inner_y_angle = np.abs(d_inner_angle - np.abs(d_y_angle))
+        shoulder_angle = np.degrees(inner_y_angle) * np.where(d_y_angle < 0.0, -1.0, 1.0) + 90.0
+        
+        inner_outer_angle = np.arccos((inner * inner + outer * outer - d_inner * d_inner) / (2 * abs(inner) * abs(outer)))
+        elbow_angle = 180.0 - np.degrees(inner_outer_angle)
+    
+    # Las comparaciones con NaN son falsas, así que los cálculos inválidos también quedan fuera de alcance.
+    ok = (shoulder_angle >= 0.0) & (shoulder_angle <= 180.0) & (elbow_angle >= 0.0) & (elbow_angle <= 180.0)
+    shoulder = np.where(ok, valmap(180.0 - shoulder_angle, 0.0, 180.0, *SHOULDER_RANGE), np.nan)
+    elbow = np.where(ok, valmap(180.0 - elbow_angle, 0.0, 180.0, *ELBOW_RANGE), np.nan)
+    return shoulder, elbow
+
+# Ancho de pulso en microsegundos para un ángulo, truncado igual que servoMove() en el firmware.
+def servopulse(angle):
+    return int(angle * ((SERVO_MAX_PULSE - SERVO_MIN_PULSE) / SERVO_MAX_ANGLE) + SERVO_MIN_PULSE)
+
+# Recorre las líneas G-code siguiendo el estado del firmware (posicionamiento absoluto o relativo y posición actual)
+# y entrega (línea, comando, destino, ángulos) por cada línea. "comando" es el de protocol.parsecommand() (None si
+# el firmware ignora la línea); en los movimientos, "destino" es el punto (x, y) en mm y "ángulos" es (hombro, codo),
+# o None si el destino está fuera de alcance. Como el firmware, un movimiento fuera de alcance no cambia la posición.
+# En modo absoluto los destinos no dependen de los movimientos anteriores, así que se resuelven en lotes con NumPy.
+def solvegcode(lines, chunk=SOLVE_CHUNK):
+    absolute = False
+    pos = (0.0, 0.0)
+    block = []
+    
+    def flush():
+        nonlocal absolute, pos
+        
+        # Destinos absolutos del lote, resueltos de una vez.
+        mode = absolute
+        targets = {}
+        for k, (line, command) in enumerate(block):
+            if command is None:
+                continue
+            if command[0] == OP_ABSOLUTE:
+                mode = True
+            elif command[0] == OP_RELATIVE:
+                mode = False
+            elif mode:
+                targets[k] = command[1:]
+        
+        solved = {}
+        if targets and not no_np:
+            keys = list(targets)
+            xy = np.array([targets[k] for k in keys], dtype=np.float64).reshape(-1, 2)
+            shoulder, elbow = jointangles(xy[:, 0], xy[:, 1])
+            for k, s, e in zip(keys, shoulder.tolist(), elbow.tolist()):
+                solved[k] = None if math.isnan(s) else (s, e)
+        
+        for k, (line, command) in enumerate(block):
+            target = angles = None
+            
+            if command is not None:
+                op, x, y = command
+                if op == OP_ABSOLUTE:
+                    absolute = True
+                elif op == OP_RELATIVE:
+                    absolute = False
+                else:
+                    target = (x, y) if absolute else (pos[0] + x, pos[1] + y)
+                    angles = solved[k] if k in solved else jointangle(*target)
+                    if angles is not None:
+                        pos = target
+            
+            yield line, command, target, angles
+        
+        block.clear()
+    
+    for line in lines:
+        block.append((line, parsecommand(line)))
+        if len(block) >= chunk:
+            yield from flush()
+    
+    yield from flush()
+
+# Revisa todos los movimientos de un trabajo antes de enviarlo. Devuelve un diccionario con la cantidad de movimientos,
+# los que están fuera de alcance, los tramos afectados (rachas de movimientos seguidos fuera de alcance)
+# y los primeros "examples" puntos fuera de alcance como (número de línea, x, y).
+def checkgcode(lines, examples=10):
+    report = {
+        'moves': 0,
+        'unreachable': 0,
+        'segments': 0,
+        'examples': [],
+    }
+    
+    gap = False
+    
+    for n, (line, command, target, angles) in enumerate(solvegcode(lines)):
+        if target is None:
+            continue
+        
+        report['moves'] += 1
+        if angles is None:
+            report['unreachable'] += 1
+            if len(report['examples']) < examples:
+                report['examples'].append((n + 1, target[0], target[1]))
+            if not gap:
+                report['segments'] += 1
+        gap = angles is None
+    
+    return report
+
+# Quita los movimientos fuera de alcance, que el firmware descartaría igual. El brazo no puede levantar el lápiz
+# (gcodeProcessCommand() ignora M3/M5), así que el siguiente movimiento alcanzable traza igualmente una recta desde
+# el último punto válido. Entrega lo mismo que solvegcode(); "report" (un diccionario) recibe la cantidad
+# de movimientos descartados en "clipped".
+def clipsolved(lines, report=None):
+    if report is not None:
+        report['clipped'] = 0
+    
+    for line, command, target, angles in solvegcode(lines):
+        if target is not None and angles is None:
+            if report is not None:
+                report['clipped'] += 1
+            continue
+        
+        yield line, command, target, angles
+
+# Líneas G-code sin los movimientos fuera de alcance (ver clipsolved()).
+def clipgcode(lines, report=None):
+    for line, command, target, angles in clipsolved(lines, report):
+        yield line
+
+# Bytes a enviar con los anchos de pulso ya calculados en el host: cada movimiento alcanzable viaja como una trama
+# protocol.OP_SERVO, así que el firmware sólo escribe los microsegundos en los servos. Los movimientos fuera
+# de alcance se descartan como en clipgcode() y el resto de las líneas sigue como texto.
+def encodeservo(lines, report=None):
+    for line, command, target, angles in clipsolved(lines, report):
+        if angles is not None:
+            yield encodeframe(OP_SERVO, servopulse(angles[0]), servopulse(angles[1]))
+        elif line.strip():
+            yield encodeline(line)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import time
+import queue
+import threading
+import traceback
+
+from arduino import Arduino
+from sender import GcodeSender
+
+class PlotJob:
+    def __init__(self, lines, name=None, callback=None):
+        self.lines = lines
+        self.name = name
+        self.callback = callback
+        self.device = None
+        self.success = None
+        self.attempts = 0
+        self.stats = None
+        self.done = threading.Event()
+    
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+# Un brazo robótico: conexión propia y un hilo que toma trabajos de la cola compartida cuando está libre.
+class Plotter:
+    def __init__(self, pool, arduino):
+        self.pool = pool
+        self.arduino = arduino
+        self.device = arduino.device
+        self.busy = False
+        self.online = True
+        self.thread = None
+        self.stats = {
+            'jobs': 0,
+            'failed': 0,
+            'lines': 0,
+            'bytes': 0,
+            'busy_time': 0.0,
+        }
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='plotter-%s' % (self.device), daemon=True)
+        self.thread.start()
+    
+    def run(self):
+        while self.online:
+            job = self.pool.jobs.get()
+            if job is None:
+                self.pool.jobs.task_done()
+                break
+            
+            self.busy = True
+            try:
+                self.process(job)
+            except:
+                traceback.print_exc()
+            finally:
+                self.busy = False
+                self.pool.jobs.task_done()
+        
+        self.arduino.disconnect()
+        
+        # Sin brazos en línea nadie más va a tomar los trabajos de la cola.
+        if not self.pool.online():
+            self.pool.abandon()
+    
+    def process(self, job):
+        job.attempts += 1
+        
+        if not self.arduino.connect():
+            print('No se pudo conectar al Arduino en %s.' % (self.device))
+            self.online = False
+            self.pool.retry(job)
+            return
+        
+        sender = GcodeSender(self.arduino, **self.pool.sender_options)
+        start = time.monotonic()
+        success = sender.send(job.lines)
+        
+        self.stats['busy_time'] += time.monotonic() - start
+        self.stats['lines'] += sender.stats['acked']
+        self.stats['bytes'] += sender.stats['bytes']
+        
+        if not success:
+            print('Error de envío al Arduino en %s (%s).' % (self.device, sender.error))
+            self.stats['failed'] += 1
+            self.arduino.disconnect()
+            
+            # Un trabajo dibujado en parte no se reintenta: empezaría de nuevo desde la primera línea
+            # y repetiría los trazos ya hechos.
+            if sender.stats['acked']:
+                print('El trabajo quedó dibujado en parte (%u líneas confirmadas); no se reintenta.' % (sender.stats['acked']))
+                self.pool.finish(job, self.device, False, sender.stats)
+                return
+            
+            self.pool.retry(job)
+            return
+        
+        self.stats['jobs'] += 1
+        self.pool.finish(job, self.device, True, sender.stats)
+    
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['device'] = self.device
+        stats['busy'] = self.busy
+        stats['online'] = self.online
+        stats['lines_per_sec'] = (stats['lines'] / stats['busy_time']) if stats['busy_time'] > 0 else 0.0
+        stats['bytes_per_sec'] = (stats['bytes'] / stats['busy_time']) if stats['busy_time'] > 0 else 0.0
+        return stats
+
+# Reparte trabajos G-code entre todos los Arduinos conectados: cada brazo libre toma el siguiente trabajo de la cola.
+# "devices" permite indicar rutas explícitas (por ejemplo, pty de pruebas) en lugar de buscar puertos.
+class PlotterPool:
+    def __init__(self, desc='arduino', bps=115200, devices=None, max_attempts=2, sender_options=None):
+        self.desc = desc
+        self.bps = bps
+        self.max_attempts = max_attempts
+        self.sender_options = sender_options or {}
+        self.jobs = queue.Queue()
+        self.plotters = {}
+        self.lock = threading.Lock()
+        
+        for device in (devices or []):
+            self.add(Arduino(desc, bps, device=device))
+    
+    def add(self, arduino):
+        with self.lock:
+            if arduino.device in self.plotters and self.plotters[arduino.device].online:
+                return None
+            
+            plotter = Plotter(self, arduino)
+            self.plotters[arduino.device] = plotter
+        
+        plotter.start()
+        return plotter
+    
+    # Agrega al pool los puertos nuevos cuya descripción coincide. Devuelve la cantidad de brazos agregados.
+    def discover(self):
+        added = 0
+        for port in Arduino(self.desc, self.bps).get_ports():
+            if self.add(Arduino(self.desc, self.bps, device=port.device)):
+                print('Arduino encontrado: %s (%s).' % (port.description, port.device))
+                added += 1
+        return added
+    
+    # "lines" puede ser una lista de líneas G-code o la ruta a un archivo .gcode.
+    def submit(self, lines, name=None, callback=None):
+        if isinstance(lines, str):
+            with open(lines, 'r') as file:
+                lines = file.readlines()
+        
+        job = PlotJob(lines, name, callback)
+        self.jobs.put(job)
+        
+        # Si todos los brazos quedaron fuera de línea, el trabajo falla en lugar de esperar en la cola.
+        if self.plotters and not self.online():
+            self.abandon()
+        
+        return job
+    
+    def online(self):
+        return any(p.online for p in self.plotters.values())
+    
+    def retry(self, job):
+        if job.attempts < self.max_attempts and self.online():
+            self.jobs.put(job)
+        else:
+            self.finish(job, None, False, None)
+    
+    # Da por fallidos los trabajos que quedan en la cola, para que wait() no espere a brazos que ya no están.
+    def abandon(self):
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            
+            if job is not None:
+                self.finish(job, None, False, None)
+            self.jobs.task_done()
+    
+    def finish(self, job, device, success, stats):
+        job.device = device
+        job.success = success
+        job.stats = stats
+        job.done.set()
+        
+        if job.callback:
+            try:
+                job.callback(job)
+            except:
+                traceback.print_exc()
+    
+    def wait(self):
+        self.jobs.join()
+    
+    # Detiene los hilos que siguen activos (los de los brazos fuera de línea ya terminaron y no tomarían su marca
+    # de fin). Lo que quede en la cola (marcas sobrantes o trabajos sin brazo) se descarta para que wait() no se bloquee.
+    def stop(self):
+        plotters = [p for p in self.plotters.values() if p.thread and p.thread.is_alive()]
+        for plotter in plotters:
+            self.jobs.put(None)
+        for plotter in plotters:
+            plotter.thread.join()
+        
+        self.abandon()
+    
+    def stats(self):
+        return {
+            'queue_depth': self.jobs.qsize(),
+            'plotters': [p.get_stats() for p in self.plotters.values()],
+        }
+
+# Uso: plotter_pool.py archivo.gcode [archivo.gcode ...]
+# Envía cada archivo al primer brazo libre entre todos los Arduinos conectados.
+def main(argv):
+    if not argv:
+        print('Uso: plotter_pool.py archivo.gcode [archivo.gcode ...]')
+        return 1
+    
+    pool = PlotterPool()
+    if not pool.discover():
+        print('¡Conecte un Arduino al sistema!')
+        return 1
+    
+    jobs = [pool.submit(path, name=path) for path in argv]
+    pool.wait()
+    pool.stop()
+    
+    for job in jobs:
+        print('%s: %s (%s).' % (job.name, 'OK' if job.success else 'ERROR', job.device))
+    
+    for stats in pool.stats()['plotters']:
+        print('%(device)s: %(jobs)u trabajos, %(failed)u fallidos, %(lines)u líneas, %(lines_per_sec).1f líneas/s.' % stats)
+    
+    return 0 if all(job.success for job in jobs) else 1
+
+if __name__ == '__main__':
+    import sys
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        pass
@@ -47,7 +47,9 @@ CREATE TABLE `conversions` (
 -- Indices de la tabla `conversions`
 --
 ALTER TABLE `conversions`
-  ADD PRIMARY KEY (`id`);
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `last_name_name` (`last_name`(191),`name`(191)),
+  ADD KEY `timestamp` (`timestamp`);
 
 --
 -- AUTO_INCREMENT de las tablas volcadas
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+
+import io
+import re
+import sys
+import time
+import random
+import argparse
+import contextlib
+from collections import deque
+
+from arduino import Arduino
+
+# Protocolo binario opcional entre el host y gcode_interpreter.ino.
+# Cada comando de movimiento viaja como una trama de tamaño fijo en lugar de una línea "G1 X.. Y..":
+#   [FRAME_SYNC] [op] [x bajo] [x alto] [y bajo] [y alto] [crc8]
+# "x" e "y" son enteros con signo de 16 bits (little endian) en centésimas de mm y el CRC-8 (polinomio 0x07)
+# cubre los bytes op..y. FRAME_SYNC no es un carácter ASCII imprimible, así que el firmware distingue cada trama
+# de una línea G-code por su primer byte; ambos formatos pueden mezclarse en el mismo envío.
+# El firmware responde "ok" a cada trama igual que a cada línea, o "error: checksum" (sin "ok") si el CRC no coincide.
+# Tras cualquier error ("error: checksum", "error: sync" por un byte fuera de lugar, "error: line" por una línea
+# interrumpida o demasiado larga, "error: timeout" por un comando incompleto) el firmware descarta los bytes hasta
+# la próxima FRAME_SYNC o el próximo salto de línea; si el CRC no coincide busca FRAME_SYNC en los bytes de la misma
+# trama, por si estaba desalineada. GcodeSender da por fallido el envío ante cualquier error.
+# Las tramas OP_SERVO llevan en lugar de x e y los anchos de pulso del hombro y del codo en microsegundos,
+# ya calculados en el host (ver kinematics.encodeservo()).
+FRAME_SYNC = 0xA5
+FRAME_SIZE = 7
+
+OP_MOVE = 0x01
+OP_ABSOLUTE = 0x02
+OP_RELATIVE = 0x03
+OP_SERVO = 0x04
+
+UNITS_PER_MM = 100
+FRAME_MIN = -32768
+FRAME_MAX = 32767
+
+def crc8(data):
+    crc = 0
+    for b in data:
+        crc ^= b
+        for i in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+def encodeframe(op, x=0, y=0):
+    body = bytes((op, x & 0xFF, (x >> 8) & 0xFF, y & 0xFF, (y >> 8) & 0xFF))
+    return bytes((FRAME_SYNC,)) + body + bytes((crc8(body),))
+
+# Devuelve (op, x, y) con x e y en mm (o en microsegundos en OP_SERVO), o None si la trama está incompleta
+# o su CRC no coincide.
+def decodeframe(frame):
+    if len(frame) != FRAME_SIZE or frame[0] != FRAME_SYNC or crc8(frame[1:6]) != frame[6]:
+        return None
+    x = int.from_bytes(frame[2:4], 'little', signed=True)
+    y = int.from_bytes(frame[4:6], 'little', signed=True)
+    if frame[1] == OP_SERVO:
+        return frame[1], x, y
+    return frame[1], x / UNITS_PER_MM, y / UNITS_PER_MM
+
+# Separa una línea G-code en argumentos igual que gcodeGetCommandArguments() en el firmware.
+def tokenize(line):
+    return [t for t in re.split(r'[ ;\r\n]+', line) if t]
+
+def toframeunits(value):
+    try:
+        v = float(value) * UNITS_PER_MM
+    except ValueError:
+        return None
+    n = round(v)
+    if abs(v - n) > 1e-6 or not FRAME_MIN <= n <= FRAME_MAX:
+        return None
+    return n
+
+# Trama equivalente a una línea G-code, o None si la línea no tiene representación binaria exacta.
+# La velocidad (F) se descarta porque el firmware no la usa.
+def encodecommand(line):
+    args = tokenize(line)
+    if not args or len(args[0]) < 2:
+        return None
+    
+    if args[0] in ('G90', 'G91'):
+        return encodeframe(OP_ABSOLUTE if args[0] == 'G90' else OP_RELATIVE)
+    
+    if args[0] not in ('G0', 'G1', 'G00', 'G01'):
+        return None
+    
+    coords = {}
+    for a in args[1:]:
+        if a[0] in 'XY':
+            coords[a[0]] = toframeunits(a[1:])
+        elif a[0] != 'F':
+            return None
+    
+    # Una coordenada ausente vale 0 en el firmware; se deja en ASCII para no depender de ese detalle.
+    if coords.get('X') is None or coords.get('Y') is None:
+        return None
+    
+    return encodeframe(OP_MOVE, coords['X'], coords['Y'])
+
+# Bytes a enviar por cada línea G-code: la trama si existe, o la línea ASCII como respaldo.
+def encodeline(line):
+    line = line.strip()
+    frame = encodecommand(line)
+    return frame if frame is not None else (line + '\n').encode('utf-8')
+
+# Texto legible de lo que se envía (para los mensajes del envío).
+def describe(data):
+    if data[:1] == bytes((FRAME_SYNC,)):
+        command = decodeframe(data)
+        if command is None:
+            return 'trama inválida'
+        op, x, y = command
+        if op == OP_MOVE:
+            return 'G1 X%.2f Y%.2f [trama]' % (x, y)
+        if op == OP_SERVO:
+            return 'servos %u/%u us [trama]' % (x, y)
+        return ('G90' if op == OP_ABSOLUTE else 'G91') + ' [trama]'
+    return data.decode('utf-8', 'replace').strip()
+
+# Tiempos de procesamiento en el microcontrolador, en segundos. Son estimaciones para un AVR de 16 MHz:
+# una línea ASCII pasa por strdup/realloc por argumento, sscanf y strtod; una trama sólo se copia y se valida.
+EMULATOR_LINE_TIME = 0.0004
+EMULATOR_BYTE_TIME = 0.00002
+EMULATOR_FRAME_TIME = 0.00005
+
+# Largo máximo de una línea (LINE_MAX) y segundos que el firmware espera el resto de un comando (COMMAND_TIMEOUT).
+LINE_MAX = 96
+COMMAND_TIMEOUT = 1.0
+
+# Emulador del firmware del lado del host para medir el protocolo sin hardware.
+# Tiene la interfaz de Arduino (connect/send/recv/available), así que GcodeSender lo usa sin cambios.
+# Modela el enlace serial a "bps" baudios (10 bits por byte, en cada sentido), el búfer de recepción de la UART
+# ("rx_buffer" bytes; los que llegan con el búfer lleno se pierden y se cuentan en stats['overflow']; None para
+# no limitarlo) y el tiempo de decodificación de cada comando. Cada comando decodificado pasa por execute(), que
+# lo guarda en "commands" como (op, x, y) y devuelve los segundos adicionales que tarda el firmware en ejecutarlo;
+# emulator.Firmware lo redefine para agregar el movimiento de los servos. "clock" reemplaza a time.monotonic().
+class ProtocolEmulator(Arduino):
+    def __init__(self, bps=115200, line_time=EMULATOR_LINE_TIME, byte_time=EMULATOR_BYTE_TIME, frame_time=EMULATOR_FRAME_TIME, corrupt=0.0, seed=0, rx_buffer=None, clock=time.monotonic):
+        super().__init__('emulador', bps, device='emulador')
+        self.line_time = line_time
+        self.byte_time = byte_time
+        self.frame_time = frame_time
+        self.corrupt = corrupt
+        self.random = random.Random(seed)
+        self.rx_buffer = rx_buffer
+        self.clock = clock
+        self.commands = []
+        self.stats = {
+            'commands': 0,
+            'checksum_errors': 0,
+            'sync_errors': 0,
+            'parse_time': 0.0,
+            'overflow': 0,
+        }
+        self.reset()
+    
+    def reset(self):
+        self.rx = bytearray()
+        self.discard = False
+        self.last_byte = 0.0
+        self.link_free = 0.0
+        self.mcu_free = 0.0
+        # (instante en que el firmware toma el comando, bytes) de los comandos completos que esperan en el búfer.
+        self.queued = deque()
+        self.replies = []
+        self.connected = False
+    
+    def is_available(self):
+        return True
+    
+    def connect(self):
+        if not self.connected:
+            self.reset()
+            self.connected = True
+        return True
+    
+    def disconnect(self):
+        self.connected = False
+    
+    def byte_delay(self, size):
+        return size * 10.0 / self.bps
+    
+    def send(self, data):
+        if not self.connected: return 0
+        
+        # Un bit alterado en el enlace, para probar la validación de las tramas.
+        if self.corrupt and self.random.random() < self.corrupt:
+            data = bytearray(data)
+            data[self.random.randrange(len(data))] ^= 1 << self.random.randrange(8)
+            data = bytes(data)
+        
+        arrival = max(self.link_free, self.clock())
+        for b in data:
+            arrival += self.byte_delay(1)
+            if self.rx_buffer is not None and self.waiting(arrival) >= self.rx_buffer:
+                self.stats['overflow'] += 1
+                continue
+            self.receive(b, arrival)
+        
+        self.link_free = arrival
+        return len(data)
+    
+    # Bytes que siguen en el búfer de recepción en el instante "t": los de los comandos completos que el firmware
+    # todavía no tomó y, mientras está ocupado, los del comando incompleto.
+    def waiting(self, t):
+        while self.queued and self.queued[0][0] <= t:
+            self.queued.popleft()
+        return sum(size for start, size in self.queued) + (len(self.rx) if self.mcu_free > t else 0)
+    
+    # Agrega un byte llegado en "arrival" al comando en recepción y lo procesa al completarse, igual que
+    # commandReceive() en el firmware. "rx" guarda el comando incompleto.
+    def receive(self, b, arrival):
+        self.expire(arrival)
+        self.last_byte = arrival
+        
+        if self.rx[:1] == bytes((FRAME_SYNC,)):
+            self.rx.append(b)
+            if len(self.rx) == FRAME_SIZE:
+                self.framereceive(arrival)
+            return
+        
+        if b == FRAME_SYNC:
+            # Una trama que empieza en medio de una línea: la línea quedó incompleta.
+            if self.rx:
+                self.error(arrival, b'error: line\r\n')
+            self.rx = bytearray((b,))
+            self.discard = False
+            return
+        
+        if b == 0x0A:
+            if not self.discard and self.rx:
+                size = len(self.rx) + 1
+                command = parsecommand(bytes(self.rx).decode('utf-8', 'replace'))
+                self.reply(arrival, size, self.line_time + self.byte_time * size, b'ok\r\n', command)
+            self.rx.clear()
+            self.discard = False
+            return
+        
+        if self.discard or b == 0x0D:
+            return
+        
+        if not 0x20 <= b <= 0x7E or len(self.rx) >= LINE_MAX:
+            self.error(arrival, b'error: line\r\n' if self.rx else b'error: sync\r\n')
+            self.rx.clear()
+            self.discard = True
+            return
+        
+        self.rx.append(b)
+    
+    # frameReceive(): si el CRC no coincide, vuelve a buscar FRAME_SYNC en los bytes de la misma trama.
+    def framereceive(self, arrival):
+        frame = bytes(self.rx)
+        self.rx.clear()
+        
+        command = decodeframe(frame)
+        if command is not None:
+            self.reply(arrival, FRAME_SIZE, self.frame_time, b'ok\r\n', command)
+            return
+        
+        self.stats['checksum_errors'] += 1
+        self.reply(arrival, FRAME_SIZE, self.frame_time, b'error: checksum\r\n')
+        
+        self.discard = True
+        for b in frame[1:]:
+            self.receive(b, arrival)
+    
+    # Descarta el comando incompleto si pasó COMMAND_TIMEOUT desde su último byte, como loop() en el firmware.
+    def expire(self, t):
+        if self.rx and t - self.last_byte > COMMAND_TIMEOUT:
+            self.rx.clear()
+            self.error(self.last_byte + COMMAND_TIMEOUT, b'error: timeout\r\n')
+    
+    # Errores de sincronización: no consumen tiempo de decodificación ni ejecutan nada.
+    def error(self, t, response):
+        self.stats['sync_errors'] += 1
+        self.replies.append((max(self.mcu_free, t) + self.byte_delay(len(response)), response))
+    
+    # Ejecuta el comando (si el firmware lo reconoce) cuando el firmware queda libre y programa su respuesta.
+    def reply(self, arrival, size, cost, response, command=None):
+        start = max(self.mcu_free, arrival)
+        if start > arrival:
+            self.queued.append((start, size))
+        
+        self.stats['commands'] += 1
+        self.stats['parse_time'] += cost
+        if command is not None:
+            cost += self.execute(command)
+        
+        self.mcu_free = start + cost
+        self.replies.append((self.mcu_free + self.byte_delay(len(response)), response))
+    
+    def execute(self, command):
+        self.commands.append(command)
+        return 0.0
+    
+    # Instante de la próxima respuesta pendiente, o None si no hay ninguna.
+    def nextreply(self):
+        times = [t for t, r in self.replies[:1]]
+        if self.rx:
+            times.append(max(self.mcu_free, self.last_byte + COMMAND_TIMEOUT))
+        return min(times) if times else None
+    
+    def ready(self):
+        now = self.clock()
+        self.expire(now)
+        n = 0
+        while n < len(self.replies) and self.replies[n][0] <= now:
+            n += 1
+        return n
+    
+    def available(self):
+        if not self.connected: return 0
+        return sum(len(r) for t, r in self.replies[:self.ready()])
+    
+    def reset_input(self):
+        self.replies = self.replies[self.ready():]
+    
+    def recv(self, size=1):
+        if not self.connected: return None
+        
+        n = self.ready()
+        data = b''.join(r for t, r in self.replies[:n])
+        self.replies = self.replies[n:]
+        
+        # Lo que no se pidió vuelve al frente de la cola de respuestas.
+        if len(data) > size:
+            self.replies.insert(0, (0.0, data[size:]))
+            data = data[:size]
+        return data
+    
+    def recv_until(self, expected=b'\n', size=None):
+        if not self.connected: return None
+        
+        data = b''
+        while not data.endswith(expected) and (size is None or len(data) < size):
+            chunk = self.recv(1)
+            if not chunk:
+                time.sleep(0.001)
+                continue
+            data += chunk
+        return data
+
+# Comando (op, x, y) de una línea G-code según la interpretación del firmware, o None si el firmware la ignora.
+def parsecommand(line):
+    args = tokenize(line)
+    if not args or len(args[0]) < 2 or args[0][0] != 'G':
+        return None
+    
+    try:
+        cmd_id = int(args[0][1:])
+    except ValueError:
+        return None
+    
+    if cmd_id == 90:
+        return OP_ABSOLUTE, 0.0, 0.0
+    if cmd_id == 91:
+        return OP_RELATIVE, 0.0, 0.0
+    if cmd_id not in (0, 1) or len(args) < 2:
+        return None
+    
+    coords = {'X': 0.0, 'Y': 0.0}
+    for a in args[1:]:
+        if a[0] in 'XY':
+            try:
+                coords[a[0]] = float(a[1:])
+            except ValueError:
+                coords[a[0]] = 0.0
+    
+    return OP_MOVE, coords['X'], coords['Y']
+
+# El comando con las coordenadas redondeadas a la resolución de las tramas, para comparar ambos formatos.
+def quantizecommand(command):
+    op, x, y = command
+    if op != OP_MOVE:
+        return command
+    return op, round(x * UNITS_PER_MM) / UNITS_PER_MM, round(y * UNITS_PER_MM) / UNITS_PER_MM
+
+# G-code de prueba con la misma forma que makegcode(): trazos de varios puntos con el lápiz subiendo entre ellos.
+def samplegcode(moves, seed=0):
+    rng = random.Random(seed)
+    lines = ['G90;', 'M5;', 'G21;']
+    
+    while len(lines) < moves:
+        lines.append('M5;')
+        for i in range(rng.randint(2, 20)):
+            speed = 'F1000 ' if i == 0 else ('F300 ' if i == 1 else '')
+            lines.append('G1 %sX%.1f00000 Y%.1f00000;' % (speed, 80.0 + rng.uniform(0, 30), 80.0 + rng.uniform(0, 30)))
+            if i == 0:
+                lines.append('M3 S255;')
+    
+    lines.append('M5;')
+    return lines
+
+# Envía el mismo G-code en ASCII y en binario a través del emulador y compara la tasa de envío.
+def runbenchmark(lines, bps=115200, corrupt=0.0, verbose=True):
+    from sender import GcodeSender
+    
+    results = {}
+    for binary in (False, True):
+        emulator = ProtocolEmulator(bps, corrupt=corrupt)
+        emulator.connect()
+        sender = GcodeSender(emulator, binary=binary)
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            success = sender.send(lines)
+        
+        name = 'binario' if binary else 'ascii'
+        results[name] = dict(sender.stats, success=success, commands=len(emulator.commands), checksum_errors=emulator.stats['checksum_errors'])
+        results[name + '_commands'] = [quantizecommand(c) for c in emulator.commands]
+        
+        if verbose:
+            s = sender.stats
+            print('%-8s %6u líneas %8u bytes %7.2f s %8.1f líneas/s %9.1f bytes/s  errores CRC: %u' % (name, s['acked'], s['bytes'], s['elapsed'], s['lines_per_sec'], s['bytes_per_sec'], emulator.stats['checksum_errors']))
+            if not success:
+                print('%-8s el envío falló (%s).' % (name, sender.error))
+    
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara el envío de G-code en ASCII y con tramas binarias usando el emulador del firmware.')
+    parser.add_argument('gcode', nargs='?', help='archivo G-code a enviar (por omisión, uno sintético)')
+    parser.add_argument('-n', '--moves', type=int, default=2000, help='líneas del G-code sintético')
+    parser.add_argument('--bps', type=int, default=115200, help='velocidad del enlace serial emulado')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='probabilidad de alterar un bit en cada envío')
+    args = parser.parse_args()
+    
+    if args.gcode:
+        with open(args.gcode, 'r') as fd:
+            lines = fd.read().splitlines()
+    else:
+        lines = samplegcode(args.moves)
+    
+    results = runbenchmark(lines, args.bps, args.corrupt)
+    
+    if not args.corrupt and results['ascii_commands'] != results['binario_commands']:
+        print('¡Los comandos decodificados difieren entre ASCII y binario!')
+        return 1
+    
+    ascii, binary = results['ascii'], results['binario']
+    if ascii['success'] and binary['success'] and ascii['elapsed'] > 0 and binary['elapsed'] > 0:
+        print('Binario: %.2fx líneas/s, %.1f%% de los bytes.' % (binary['lines_per_sec'] / max(ascii['lines_per_sec'], 1e-9), 100.0 * binary['bytes'] / max(ascii['bytes'], 1)))
+    
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        pass
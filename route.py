@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import math
+import time
+
+from geometry import endpoints, reorder
+
+def dist(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+# Longitud con lápiz abajo (dentro de las líneas), recorrido con lápiz arriba (entre líneas) y tiempo estimado.
+# "scale" convierte las coordenadas a mm; las velocidades están en mm/min, como en el G-code.
+def route_metrics(lines, scale, movement_speed, cutting_speed):
+    sx, sy = scale
+    pen_down = pen_up = 0.0
+    prev = None
+    
+    for l in lines:
+        if prev is not None:
+            pen_up += math.hypot((l[0][0] - prev[0]) * sx, (l[0][1] - prev[1]) * sy)
+        for i in range(1, len(l)):
+            pen_down += math.hypot((l[i][0] - l[i - 1][0]) * sx, (l[i][1] - l[i - 1][1]) * sy)
+        prev = l[-1]
+    
+    return {
+        'lines': len(lines),
+        'pen_down_mm': pen_down,
+        'pen_up_mm': pen_up,
+        'time_s': (pen_down / cutting_speed + pen_up / movement_speed) * 60.0,
+    }
+
+# Vecinos más cercanos de cada punto usando una rejilla uniforme.
+def knn(points, k):
+    n = len(points)
+    if n < 2:
+        return [[] for p in points]
+    
+    min_x = min(p[0] for p in points)
+    min_y = min(p[1] for p in points)
+    area = max(max(p[0] for p in points) - min_x, 1e-9) * max(max(p[1] for p in points) - min_y, 1e-9)
+    size = max((area * 2.0 / n) ** 0.5, 1e-9)
+    
+    cells = {}
+    for i, p in enumerate(points):
+        cells.setdefault((int((p[0] - min_x) // size), int((p[1] - min_y) // size)), []).append(i)
+    
+    max_ring = max(max(c[0] for c in cells), max(c[1] for c in cells)) + 1
+    k = min(k, n - 1)
+    neighbours = []
+    
+    for i, p in enumerate(points):
+        cx, cy = int((p[0] - min_x) // size), int((p[1] - min_y) // size)
+        found = []
+        ring = 0
+        
+        while ring <= max_ring:
+            for dx in range(-ring, ring + 1):
+                for dy in ((-ring, ring) if abs(dx) != ring else range(-ring, ring + 1)):
+                    for j in cells.get((cx + dx, cy + dy), ()):
+                        if j != i:
+                            found.append((dist(p, points[j]), j))
+            
+            # Los puntos fuera de los anillos revisados están a más de ring * size.
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= ring * size:
+                    break
+            ring += 1
+        
+        found.sort()
+        neighbours.append([j for d, j in found[:k]])
+    
+    return neighbours
+
+# Mejora el orden y el sentido de las líneas (un recorrido abierto) para reducir el recorrido con lápiz arriba,
+# aplicando movimientos 2-opt y Or-opt sobre listas de vecinos cercanos hasta agotar "time_budget" segundos.
+# No modifica las líneas: devuelve un nuevo contenedor (del mismo tipo) con las líneas invertidas donde corresponde.
+def optimize_route(lines, time_budget=1.0, scale=(1.0, 1.0), neighbours=8):
+    n = len(lines)
+    if n < 3 or time_budget <= 0:
+        return reorder(lines, range(n))
+    
+    deadline = time.monotonic() + time_budget
+    sx, sy = scale
+    
+    # Extremos de cada línea: 2 * l es el inicio y 2 * l + 1 el final en su sentido original.
+    P = []
+    for s, e in endpoints(lines):
+        P.append((s[0] * sx, s[1] * sy))
+        P.append((e[0] * sx, e[1] * sy))
+    
+    near = knn(P, neighbours)
+    
+    order = list(range(n))
+    pos = list(range(n))
+    flip = [False] * n
+    
+    def head(l):
+        return 2 * l + 1 if flip[l] else 2 * l
+    
+    def tail(l):
+        return 2 * l if flip[l] else 2 * l + 1
+    
+    def d(a, b):
+        return dist(P[a], P[b])
+    
+    def reverse(i, j):
+        order[i:j + 1] = order[i:j + 1][::-1]
+        for k in range(i, j + 1):
+            flip[order[k]] = not flip[order[k]]
+            pos[order[k]] = k
+    
+    # Costo de invertir las posiciones i..j (negativo si mejora).
+    def two_opt_delta(i, j):
+        delta = 0.0
+        if i > 0:
+            a = tail(order[i - 1])
+            delta += d(a, tail(order[j])) - d(a, head(order[i]))
+        if j < n - 1:
+            b = head(order[j + 1])
+            delta += d(head(order[i]), b) - d(tail(order[j]), b)
+        return delta
+    
+    def two_opt_pass():
+        improved = False
+        
+        for i in range(n):
+            if time.monotonic() > deadline:
+                return improved
+            
+            # Nueva arista desde el final de la línea anterior hacia el final de una línea posterior.
+            if i > 0:
+                for c in near[tail(order[i - 1])]:
+                    m = c // 2
+                    j = pos[m]
+                    if c == tail(m) and j >= i and two_opt_delta(i, j) < -1e-9:
+                        reverse(i, j)
+                        improved = True
+                        break
+            
+            # Nueva arista desde el inicio de una línea anterior hacia el inicio de la línea siguiente.
+            if i < n - 1:
+                for c in near[head(order[i + 1])]:
+                    m = c // 2
+                    k = pos[m]
+                    if c == head(m) and k <= i and two_opt_delta(k, i) < -1e-9:
+                        reverse(k, i)
+                        improved = True
+                        break
+        
+        return improved
+    
+    def or_opt_pass():
+        improved = False
+        
+        for m in range(n):
+            if time.monotonic() > deadline:
+                return improved
+            
+            k = pos[m]
+            prev = order[k - 1] if k > 0 else None
+            next = order[k + 1] if k < n - 1 else None
+            
+            # Ahorro al quitar la línea de su posición actual.
+            gain = 0.0
+            if prev is not None:
+                gain += d(tail(prev), head(m))
+            if next is not None:
+                gain += d(tail(m), head(next))
+            if prev is not None and next is not None:
+                gain -= d(tail(prev), head(next))
+            
+            best = None
+            for c in near[2 * m] + near[2 * m + 1]:
+                u = c // 2
+                if u == m or c != tail(u):
+                    continue
+                p = pos[u]
+                v = order[p + 1] if p < n - 1 else None
+                if v == m:
+                    continue
+                
+                # Insertar después de u, en el sentido actual o invertida.
+                base = d(c, head(v)) if v is not None else 0.0
+                for flipped in (False, True):
+                    h, t = (tail(m), head(m)) if flipped else (head(m), tail(m))
+                    cost = d(c, h) + (d(t, head(v)) if v is not None else 0.0) - base
+                    if cost < gain - 1e-9 and (best is None or cost < best[0]):
+                        best = (cost, u, flipped)
+            
+            if best:
+                cost, u, flipped = best
+                del order[k]
+                p = order.index(u, max(pos[u] - 1, 0))
+                order.insert(p + 1, m)
+                if flipped:
+                    flip[m] = not flip[m]
+                for i in range(min(k, p + 1), n):
+                    pos[order[i]] = i
+                improved = True
+        
+        return improved
+    
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = two_opt_pass()
+        improved = or_opt_pass() or improved
+    
+    return reorder(lines, order, [flip[l] for l in order])
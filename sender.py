@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+import time
+import traceback
+from collections import deque
+
+from events import emit, stage
+from protocol import encodeline, describe
+from kinematics import encodeservo
+
+# Tamaño del búfer de recepción serial del Arduino (SERIAL_RX_BUFFER_SIZE en placas AVR).
+ARDUINO_RX_BUFFER = 64
+
+# Intervalo mínimo entre eventos send_progress, en segundos.
+PROGRESS_INTERVAL = 0.25
+
+# Tiempo sin recibir nada tras el cual el firmware se considera inactivo: el movimiento más largo del brazo
+# (180° a 1.7 ms/°, g_servoMsPerDeg en gcode_interpreter.ino) más el segundo que el firmware espera el resto
+# de una línea o de una trama incompleta. Pasado este tiempo ya respondió a todo lo que tenía en su búfer.
+FIRMWARE_IDLE = 1.5
+
+# Tiempo sin recibir nada tras el cual el firmware terminó lo que quedaba de un trabajo anterior: el movimiento
+# más largo del brazo más un margen. Entre dos respuestas del firmware nunca pasa más que esto.
+FIRMWARE_SETTLE = 0.35
+
+class GcodeSender:
+    # rx_buffer: bytes que pueden estar en vuelo sin confirmar (conteo de caracteres).
+    # Con rx_buffer=0 se envía una línea y se espera su "ok" antes de la siguiente.
+    # Con binary=True los movimientos viajan como tramas binarias (ver protocol.py) y el resto como líneas ASCII.
+    # Con servo=True los movimientos viajan como tramas con los anchos de pulso calculados en el host
+    # (kinematics.encodeservo()); los que están fuera de alcance se omiten y se cuentan en stats['clipped'].
+    # idle: segundos sin respuestas tras los cuales el firmware se considera inactivo (ver FIRMWARE_IDLE).
+    # settle: segundos sin respuestas que se esperan antes de cada envío (ver FIRMWARE_SETTLE y resync()).
+    # "clock" y "sleep" reemplazan a time.monotonic() y time.sleep() (emulator.simulate() usa un reloj simulado).
+    def __init__(self, arduino, rx_buffer=ARDUINO_RX_BUFFER, timeout=5.0, retries=3, poll=0.001, progress_interval=PROGRESS_INTERVAL, binary=False, servo=False, idle=FIRMWARE_IDLE, settle=FIRMWARE_SETTLE, clock=time.monotonic, sleep=time.sleep):
+        self.arduino = arduino
+        self.clock = clock
+        self.sleep = sleep
+        self.binary = binary
+        self.servo = servo
+        self.rx_buffer = rx_buffer
+        self.timeout = timeout
+        self.retries = retries
+        self.poll = poll
+        self.idle = idle
+        self.settle = settle
+        self.progress_interval = progress_interval
+        self.error = None
+        self.reset_stats()
+    
+    def reset_stats(self):
+        self.stats = {
+            'lines': 0,
+            'bytes': 0,
+            'acked': 0,
+            'timeouts': 0,
+            'retries': 0,
+            'errors': 0,
+            'elapsed': 0.0,
+            'lines_per_sec': 0.0,
+            'bytes_per_sec': 0.0,
+        }
+    
+    def encode(self, lines):
+        if self.servo:
+            yield from encodeservo(lines, self.stats)
+            return
+        
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield encodeline(line) if self.binary else (line + '\n').encode('utf-8')
+    
+    # Envía las líneas G-code con control de flujo. "progress" recibe (líneas confirmadas, estadísticas).
+    # "events" (un events.EventBus) recibe la etapa "send" y eventos send_progress con la tasa de envío.
+    def send(self, lines, progress=None, events=None):
+        total = len(lines) if hasattr(lines, '__len__') else None
+        
+        with stage(events, 'send', total=total) as info:
+            success = self.transfer(lines, progress, events, total)
+            # Tras un fallo el firmware puede tener comandos en su búfer (o una línea incompleta que descartará con
+            # "error: timeout"): esperar a que termine mientras el puerto sigue reservado para este trabajo.
+            if not success and self.error not in ('send', 'recv'):
+                error = self.error
+                self.resync(self.idle)
+                self.error = error
+            if events is not None:
+                self.emit_progress(events, total)
+            info.update(self.stats, success=success, error=self.error)
+        
+        return success
+    
+    def emit_progress(self, events, total):
+        elapsed = self.clock() - self.start
+        emit(events, 'send_progress', acked=self.stats['acked'], total=total, bytes=self.stats['bytes'], elapsed=elapsed,
+            lines_per_sec=self.stats['acked'] / elapsed if elapsed > 0 else 0.0,
+            bytes_per_sec=self.stats['bytes'] / elapsed if elapsed > 0 else 0.0)
+    
+    # Lee las respuestas hasta que el Arduino pasa "quiet" segundos sin enviar nada y se las entrega a "receive".
+    # Devuelve False si la lectura falla o si "receive" rechaza alguna respuesta.
+    def drain(self, receive, quiet):
+        last = self.clock()
+        while self.clock() - last < quiet:
+            waiting = self.arduino.available()
+            if not waiting:
+                self.sleep(self.poll)
+                continue
+            
+            chunk = self.arduino.recv(waiting)
+            if chunk is None:
+                self.error = 'recv'
+                return False
+            if not receive(chunk):
+                return False
+            last = self.clock()
+        
+        return True
+    
+    # Descarta lo que el Arduino ya envió y lo que siga enviando hasta pasar "quiet" segundos sin enviar nada:
+    # con el puerto abierto entre trabajos, las respuestas atrasadas de un trabajo anterior confirmarían líneas
+    # del siguiente. Devuelve False si la lectura falla.
+    def resync(self, quiet):
+        self.arduino.reset_input()
+        return self.drain(lambda chunk: True, quiet)
+    
+    def transfer(self, lines, progress, events, total):
+        self.reset_stats()
+        self.error = None
+        
+        if not self.resync(self.settle):
+            return False
+        
+        pending = deque()
+        source = self.encode(lines)
+        inflight = deque()
+        inflight_bytes = 0
+        rx = b''
+        attempts = 0
+        # Respuestas recibidas desde la última vez que no había líneas en vuelo.
+        answered = 0
+        start = last_ack = last_progress = self.start = self.clock()
+        
+        # Procesa las respuestas completas. Cada "ok" confirma la línea en vuelo más antigua; un "ok" sin líneas
+        # en vuelo significa que el conteo del búfer del Arduino ya no es confiable, y el envío falla.
+        def receive(chunk):
+            nonlocal rx, inflight_bytes, last_ack, last_progress, attempts, answered
+            
+            rx += chunk
+            while b'\n' in rx:
+                response, rx = rx.split(b'\n', 1)
+                response = response.strip()
+                
+                if response == b'ok':
+                    if not inflight:
+                        self.error = 'sync'
+                        return False
+                    
+                    inflight_bytes -= len(inflight.popleft())
+                    answered = answered + 1 if inflight else 0
+                    self.stats['acked'] += 1
+                    last_ack = self.clock()
+                    attempts = 0
+                    if progress:
+                        progress(self.stats['acked'], self.stats)
+                    if events is not None and last_ack - last_progress >= self.progress_interval:
+                        last_progress = last_ack
+                        self.emit_progress(events, total)
+                elif response:
+                    if inflight:
+                        answered += 1
+                    print('Recibiendo: %s' % (response.decode('utf-8', 'replace')))
+                    # El Arduino descartó un comando (trama dañada, bytes fuera de lugar o una línea incompleta) y
+                    # no lo confirma: sin números de línea no se sabe cuál, así que el envío falla.
+                    if response.startswith(b'error'):
+                        self.stats['errors'] += 1
+                        self.error = response.decode('utf-8', 'replace')
+                        return False
+            
+            return True
+        
+        try:
+            while True:
+                if not pending:
+                    data = next(source, None)
+                    if data is not None:
+                        pending.append(data)
+                
+                if not pending and not inflight:
+                    break
+                
+                # Enviar mientras las líneas quepan en el búfer del Arduino.
+                if pending and (not inflight or inflight_bytes + len(pending[0]) <= self.rx_buffer):
+                    data = pending.popleft()
+                    
+                    print('Enviando: "%s"' % (describe(data)))
+                    
+                    if not self.arduino.send(data):
+                        self.error = 'send'
+                        return False
+                    
+                    inflight.append(data)
+                    inflight_bytes += len(data)
+                    self.stats['lines'] += 1
+                    self.stats['bytes'] += len(data)
+                    continue
+                
+                # Procesar respuestas.
+                waiting = self.arduino.available()
+                if waiting:
+                    chunk = self.arduino.recv(waiting)
+                    if chunk is None:
+                        self.error = 'recv'
+                        return False
+                    if not receive(chunk):
+                        return False
+                    continue
+                
+                if inflight and (self.clock() - last_ack) > self.timeout:
+                    self.stats['timeouts'] += 1
+                    attempts += 1
+                    if attempts > self.retries:
+                        self.error = 'timeout'
+                        return False
+                    
+                    # Las confirmaciones pueden estar sólo demoradas: el firmware sigue teniendo las líneas en su búfer
+                    # y respondería a las copias reenviadas. Esperar a que termine y acreditar lo que llegue antes
+                    # de decidir qué reenviar.
+                    if not self.drain(receive, self.idle):
+                        return False
+                    
+                    if not inflight:
+                        continue
+                    
+                    if answered:
+                        # El firmware respondió a parte de las líneas enviadas desde la última vez que estaba al día:
+                        # sin números de línea no se sabe cuáles se perdieron.
+                        self.error = 'sync'
+                        return False
+                    
+                    # El firmware, ya inactivo, no respondió a ninguna de las líneas en vuelo: se reenvían en orden.
+                    self.stats['retries'] += len(inflight)
+                    pending.extendleft(reversed(inflight))
+                    inflight.clear()
+                    inflight_bytes = 0
+                    rx = b''
+                    last_ack = self.clock()
+                    continue
+                
+                self.sleep(self.poll)
+        except:
+            traceback.print_exc()
+            self.error = 'exception'
+            return False
+        finally:
+            elapsed = self.clock() - start
+            self.stats['elapsed'] = elapsed
+            if elapsed > 0:
+                self.stats['lines_per_sec'] = self.stats['acked'] / elapsed
+                self.stats['bytes_per_sec'] = self.stats['bytes'] / elapsed
+        
+        return True
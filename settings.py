@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import os
+
+# Área de dibujo del brazo robótico.
+MAX_WIDTH_MM = 30.0
+MAX_HEIGHT_MM = 30.0
+
+OFFSET_X_MM = 80.0
+OFFSEY_Y_MM = 80.0
+
+# Base de datos MySQL.
+DB_HOST = "localhost"
+DB_USER = "root"
+DB_PASS = ""
+DB_NAME = "png2gcode"
+
+# Backend del registro de conversiones: "mysql" o "sqlite" (para pruebas sin servidor MySQL).
+DB_BACKEND = "mysql"
+DB_SQLITE_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "png2gcode.sqlite3")
+
+# Caché de conversiones.
+CACHE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "cache")
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Registro de eventos de instrumentación (una línea JSON por evento). None para no registrar.
+EVENT_LOG_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "events.jsonl")
+
+# Conversión en flujo: el brazo empieza a dibujar las primeras franjas de la imagen mientras se convierte el resto.
+# El resultado difiere levemente de la conversión completa (los contornos se cortan entre franjas).
+STREAM_PLOTTING = False
+
+# Protocolo binario con el Arduino: los movimientos viajan como tramas de 7 bytes con CRC en lugar de líneas G-code.
+# Requiere el firmware con soporte de tramas (gcode_interpreter.ino); el resto de los comandos sigue en ASCII.
+SERIAL_BINARY_PROTOCOL = False
+
+# Cinemática inversa en el host: los movimientos viajan con los anchos de pulso de los servos ya calculados
+# y el firmware sólo los escribe. Requiere el firmware con soporte de tramas, igual que SERIAL_BINARY_PROTOCOL.
+SERIAL_SERVO_ANGLES = False
+
+# Inicio rápido del kiosco: la ventana aparece antes de cargar NumPy, OpenCV, PIL, pyserial y el conector MySQL,
+# que se cargan en segundo plano junto con la conexión a la base de datos. "0" en KIOSK_FAST_STARTUP lo desactiva.
+FAST_STARTUP = os.environ.get("KIOSK_FAST_STARTUP", "1") != "0"
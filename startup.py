@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+import subprocess
+
+# Módulos cuyo tiempo de importación se mide por separado, cada uno en un intérprete nuevo.
+# "init" es lo que init.py importa antes de mostrar la ventana; el resto se carga en segundo plano o al usarse.
+STARTUP_MODULES = (
+    'init',
+    'PIL.Image',
+    'numpy',
+    'cv2',
+    'svg_to_gcode.compiler',
+    'serial.tools.list_ports',
+    'mysql.connector.pooling',
+    'conversion',
+)
+
+# Marcas que init.py escribe con KIOSK_STARTUP_BENCHMARK definido, en el orden en que ocurren.
+STARTUP_MARKERS = ('first_frame', 'ready', 'warm')
+
+# Tiempo máximo de cada arranque medido, en segundos.
+STARTUP_TIMEOUT = 60.0
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Segundos que tarda un intérprete nuevo en importar "module", o None si no está instalado.
+def importtime(module):
+    code = 'import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)' % (module)
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+# Arranca init.py y mide los segundos hasta cada marca, desde el lanzamiento del proceso (incluye el arranque
+# del intérprete, como lo ve el kiosco). Devuelve (marcas, error): "error" es la última línea de stderr si el
+# programa terminó sin dibujar la ventana (por ejemplo, sin pantalla), o "error de base de datos".
+def startuptime(fast, timeout=STARTUP_TIMEOUT):
+    env = dict(os.environ, KIOSK_STARTUP_BENCHMARK='1', KIOSK_FAST_STARTUP='1' if fast else '0')
+    
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'init.py')], cwd=ROOT, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+    timer = threading.Timer(timeout, proc.kill)
+    timer.start()
+    
+    marks = {}
+    error = None
+    try:
+        for line in proc.stdout:
+            if not line.startswith('startup: '):
+                continue
+            marker = line[len('startup: '):].strip()
+            if marker == 'error':
+                error = 'error de base de datos'
+            else:
+                marks[marker] = time.perf_counter() - start
+        stderr = proc.stderr.read()
+        proc.wait()
+    finally:
+        timer.cancel()
+    
+    if 'first_frame' not in marks and error is None:
+        lines = stderr.strip().splitlines()
+        error = lines[-1] if lines else 'terminó sin dibujar la ventana (código %s)' % (proc.returncode)
+    
+    return marks, error
+
+def runbenchmark(repeat=5, modules=STARTUP_MODULES, timeout=STARTUP_TIMEOUT, verbose=True):
+    report = {
+        'python': sys.version.split()[0],
+        'imports': {},
+        'startup': {},
+    }
+    
+    for module in modules:
+        times = [importtime(module) for k in range(repeat)]
+        if None in times:
+            report['imports'][module] = None
+            if verbose:
+                print('import %-26s no instalado' % (module))
+            continue
+        report['imports'][module] = statistics.median(times)
+        if verbose:
+            print('import %-26s %8.1f ms' % (module, report['imports'][module] * 1000.0))
+    
+    for mode, fast in (('fast', True), ('classic', False)):
+        runs = []
+        error = None
+        for k in range(repeat):
+            marks, error = startuptime(fast, timeout)
+            if error is not None:
+                break
+            runs.append(marks)
+        
+        result = {'error': error}
+        for marker in STARTUP_MARKERS:
+            times = [marks[marker] for marks in runs if marker in marks]
+            result[marker] = statistics.median(times) if times else None
+        report['startup'][mode] = result
+        
+        if not verbose:
+            continue
+        if error is not None:
+            print('inicio %-8s no se pudo medir: %s' % (mode, error))
+            continue
+        print('inicio %-8s %s' % (mode, ', '.join(
+            '%s %.0f ms' % (marker, result[marker] * 1000.0) for marker in STARTUP_MARKERS if result[marker] is not None
+        )))
+    
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mide el tiempo de inicio de la interfaz: hasta la primera ventana dibujada, hasta que la interfaz puede usarse y hasta que terminan de cargarse los módulos de conversión, con y sin FAST_STARTUP.')
+    parser.add_argument('-o', '--output', help='guardar los resultados en este archivo JSON')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='repeticiones de cada medición; se informa la mediana (por defecto, %(default)s)')
+    parser.add_argument('--modules', nargs='+', default=list(STARTUP_MODULES), help='módulos cuyo tiempo de importación se mide')
+    parser.add_argument('--timeout', type=float, default=STARTUP_TIMEOUT, help='tiempo máximo de cada arranque en segundos (por defecto, %(default)s)')
+    args = parser.parse_args(argv)
+    
+    report = runbenchmark(max(args.repeat, 1), args.modules, args.timeout)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Resultados guardados en "%s".' % (args.output))
+    
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        pass
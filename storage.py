@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import abc
+import sys
+import time
+import sqlite3
+import threading
+
+from settings import *
+
+CONVERSION_COLUMNS = ('id', 'name', 'last_name', 'png_path', 'svg_path', 'timestamp')
+
+# Registro de conversiones con inserciones por lotes seguras entre hilos.
+# add() sólo encola el registro; flush() lo escribe junto con el resto de pendientes en una sola transacción.
+# Cada backend implementa connect() (y release() si la conexión no se cierra al terminar).
+class ConversionStore(abc.ABC):
+    placeholder = '%s'
+    
+    def __init__(self, batch_size=64):
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+    
+    # Conexión para una operación; se devuelve con release().
+    @abc.abstractmethod
+    def connect(self):
+        pass
+    
+    def release(self, connection):
+        connection.close()
+    
+    def add(self, name, last_name, png_path, svg_path):
+        with self.lock:
+            self.pending.append((name, last_name, png_path, svg_path))
+            full = len(self.pending) >= self.batch_size
+        
+        if full:
+            self.flush()
+    
+    # Escribe los registros pendientes. Si falla, vuelven a la cola y se propaga la excepción.
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                rows = self.pending
+                self.pending = []
+            
+            if not rows:
+                return 0
+            
+            sql = 'INSERT INTO conversions (name, last_name, png_path, svg_path) VALUES (%s)' % (', '.join([self.placeholder] * 4))
+            
+            try:
+                connection = self.connect()
+                try:
+                    cursor = connection.cursor()
+                    cursor.executemany(sql, rows)
+                    connection.commit()
+                    cursor.close()
+                finally:
+                    self.release(connection)
+            except:
+                with self.lock:
+                    self.pending[:0] = rows
+                raise
+            
+            return len(rows)
+    
+    # Historial paginado, del más reciente al más antiguo. "since" y "until" filtran por fecha.
+    def history(self, name=None, last_name=None, since=None, until=None, page=0, page_size=20):
+        where = []
+        args = []
+        
+        if last_name is not None:
+            where.append('last_name = ' + self.placeholder)
+            args.append(last_name)
+        if name is not None:
+            where.append('name = ' + self.placeholder)
+            args.append(name)
+        if since is not None:
+            where.append('timestamp >= ' + self.placeholder)
+            args.append(since)
+        if until is not None:
+            where.append('timestamp < ' + self.placeholder)
+            args.append(until)
+        
+        sql = 'SELECT %s FROM conversions' % (', '.join(CONVERSION_COLUMNS))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY timestamp DESC, id DESC LIMIT %s OFFSET %s' % (self.placeholder, self.placeholder)
+        args += [page_size, page * page_size]
+        
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(sql, args)
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            self.release(connection)
+        
+        return [dict(zip(CONVERSION_COLUMNS, row)) for row in rows]
+    
+    def close(self):
+        self.flush()
+
+class MySQLConversionStore(ConversionStore):
+    def __init__(self, host=DB_HOST, user=DB_USER, password=DB_PASS, database=DB_NAME, pool_size=4, batch_size=64):
+        import mysql.connector.pooling
+        
+        super().__init__(batch_size)
+        
+        # El pool abre sus conexiones al crearse, por lo que un servidor inaccesible falla aquí.
+        self.pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name='png2gcode', pool_size=pool_size, host=host, user=user, password=password, database=database
+        )
+    
+    def connect(self):
+        return self.pool.get_connection()
+    
+    def release(self, connection):
+        # Devuelve la conexión al pool.
+        connection.close()
+
+class SQLiteConversionStore(ConversionStore):
+    placeholder = '?'
+    
+    SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS conversions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            png_path TEXT NOT NULL,
+            svg_path TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'CREATE INDEX IF NOT EXISTS last_name_name ON conversions (last_name, name)',
+        'CREATE INDEX IF NOT EXISTS timestamp ON conversions (timestamp)',
+    )
+    
+    def __init__(self, path=DB_SQLITE_PATH, batch_size=64):
+        super().__init__(batch_size)
+        
+        # Una sola conexión compartida, serializada con un candado.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection_lock = threading.Lock()
+        
+        for sql in self.SCHEMA:
+            self.connection.execute(sql)
+        self.connection.commit()
+    
+    def connect(self):
+        self.connection_lock.acquire()
+        return self.connection
+    
+    def release(self, connection):
+        self.connection_lock.release()
+    
+    def close(self):
+        super().close()
+        self.connection.close()
+
+def openConversionStore(backend=DB_BACKEND, **kwargs):
+    if backend == 'sqlite':
+        return SQLiteConversionStore(**kwargs)
+    if backend == 'mysql':
+        return MySQLConversionStore(**kwargs)
+    raise ValueError('Backend de base de datos desconocido: %s' % (backend))
+
+# Prueba de rendimiento: inserciones fila por fila vs. por lotes y consultas del historial.
+# Uso: storage.py [sqlite|mysql] [cantidad]
+def benchmark(backend='sqlite', count=10000):
+    kwargs = {'path': ':memory:'} if backend == 'sqlite' else {}
+    store = openConversionStore(backend, **kwargs)
+    
+    start = time.monotonic()
+    for i in range(count // 10):
+        store.add('Nombre %u' % (i % 100), 'Apellido %u' % (i % 37), '/tmp/%u.png' % (i), '/tmp/%u.svg' % (i))
+        store.flush()
+    single = time.monotonic() - start
+    
+    store.batch_size = count
+    start = time.monotonic()
+    for i in range(count):
+        store.add('Nombre %u' % (i % 100), 'Apellido %u' % (i % 37), '/tmp/%u.png' % (i), '/tmp/%u.svg' % (i))
+    store.flush()
+    batched = time.monotonic() - start
+    
+    start = time.monotonic()
+    for i in range(100):
+        store.history(name='Nombre %u' % (i), last_name='Apellido %u' % (i % 37), page=0)
+    query = time.monotonic() - start
+    
+    print('Inserción fila por fila: %.1f filas/s.' % ((count // 10) / single))
+    print('Inserción por lotes: %.1f filas/s.' % (count / batched))
+    print('Consulta de historial: %.2f ms.' % (query * 10.0))
+    
+    store.close()
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else 'sqlite', int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emulator import PtyFirmware
+
+# Factor de aceleración de los firmware emulados en un pty, para que las pruebas tarden poco.
+PTY_SPEED = 5.0
+
+# Firmware emulados detrás de un pty; se detienen al terminar la prueba.
+@pytest.fixture
+def ptyfirmware():
+    if os.name != 'posix':
+        pytest.skip('los pty sólo existen en sistemas POSIX')
+    
+    started = []
+    
+    def start(**options):
+        options.setdefault('speed', PTY_SPEED)
+        emulator = PtyFirmware(**options)
+        emulator.start()
+        started.append(emulator)
+        return emulator
+    
+    yield start
+    
+    for emulator in started:
+        emulator.stop()
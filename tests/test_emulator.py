@@ -0,0 +1,38 @@
+import pytest
+
+from emulator import Firmware, simulate, SERVO_HOME
+
+# Con brazos de 80 mm y los rangos de kinematics.py (hombro 110-180°, codo 130-180°):
+#   (0, 80)   -> hombro 121.67°, codo 146.67°
+#   (0, 160)  -> hombro 145°,    codo 180°
+#   (80, 80)  -> hombro 145°,    codo 155°
+# Cada movimiento espera ceil(mayor desplazamiento angular * 1.7) ms desde la posición anterior.
+GCODE = [
+    'G1 X0 Y80',     # Relativo (modo inicial) desde (0, 0) -> (0, 80): desde 180/180, 58.33° -> 100 ms.
+    'G1 X0 Y80',     # Relativo -> (0, 160): 33.33° -> 57 ms.
+    'G90',
+    'G1 X80 Y80',    # Absoluto -> (80, 80): 25° -> 43 ms.
+    'G1 X500 Y500',  # Fuera de alcance: se descarta y la posición no cambia.
+    'G91',
+    'G1 X-80 Y80',   # Relativo desde (80, 80) -> (0, 160): 25° -> 43 ms.
+]
+
+def test_servo_timing_model():
+    result = simulate(GCODE)
+    
+    assert result['success']
+    assert result['moves'] == 5
+    assert result['dropped'] == 1
+    assert result['servo_time'] == pytest.approx(0.243)
+    assert result['plot_time'] >= result['servo_time']
+
+def test_firmware_starts_at_home_in_relative_mode():
+    firmware = Firmware()
+    firmware.connect()
+    
+    assert (firmware.shoulder, firmware.elbow) == (SERVO_HOME, SERVO_HOME)
+    assert not firmware.absolute
+    
+    # Un movimiento nulo en modo relativo se queda en (0, 0), fuera de alcance.
+    assert firmware.move(0.0, 0.0) == 0.0
+    assert firmware.stats['dropped'] == 1
@@ -0,0 +1,86 @@
+import io
+import threading
+import contextlib
+
+import pytest
+
+from protocol import samplegcode
+from sender import FIRMWARE_IDLE, FIRMWARE_SETTLE
+from plotter_pool import PlotterPool
+from conftest import PTY_SPEED
+
+UNPLUGGED = '/dev/nonexistent-arduino'
+
+SENDER_OPTIONS = dict(idle=FIRMWARE_IDLE / PTY_SPEED, settle=FIRMWARE_SETTLE / PTY_SPEED)
+
+@pytest.fixture
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+# wait() en un hilo aparte, para que una cola que nunca se vacía haga fallar la prueba en lugar de colgarla.
+def waits(pool, timeout=10.0):
+    thread = threading.Thread(target=pool.wait, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+def test_jobs_spread_over_plotters(ptyfirmware, quiet):
+    emulators = [ptyfirmware(), ptyfirmware()]
+    pool = PlotterPool(devices=[e.device for e in emulators] + [UNPLUGGED], sender_options=SENDER_OPTIONS)
+    jobs = [pool.submit(samplegcode(30, seed=k), name=k) for k in range(6)]
+    
+    assert waits(pool)
+    pool.stop()
+    
+    # Un trabajo tomado por el brazo desconectado se reintenta en otro.
+    assert all(job.success for job in jobs)
+    assert {job.device for job in jobs} <= {e.device for e in emulators}
+    assert sum(e.stats['commands'] for e in emulators) == sum(len(job.lines) for job in jobs)
+    
+    stats = {p['device']: p for p in pool.stats()['plotters']}
+    assert not stats[UNPLUGGED]['online']
+    assert stats[UNPLUGGED]['jobs'] == 0
+
+# Un trabajo que falla con líneas ya confirmadas no se redibuja en otro brazo.
+def test_partial_job_is_not_retried(ptyfirmware, quiet):
+    emulators = [ptyfirmware(), ptyfirmware()]
+    pool = PlotterPool(devices=[e.device for e in emulators], sender_options=SENDER_OPTIONS)
+    lines = samplegcode(40)
+    job = pool.submit(lines[:20] + ['G1 X90 Y\x0190'] + lines[20:])
+    
+    assert waits(pool)
+    pool.stop()
+    
+    assert job.success is False
+    assert job.attempts == 1
+    assert job.stats['acked'] > 0
+    assert sum(e.stats['commands'] for e in emulators) < len(lines)
+
+# Sin brazos en línea los trabajos fallan, también los que llegan después, en lugar de quedar en la cola.
+def test_jobs_fail_when_no_plotter_is_left(quiet):
+    pool = PlotterPool(devices=[UNPLUGGED], sender_options=SENDER_OPTIONS)
+    jobs = [pool.submit(samplegcode(10)) for k in range(3)]
+    
+    assert waits(pool)
+    assert all(job.wait(1.0) and job.success is False for job in jobs)
+    
+    late = pool.submit(samplegcode(10))
+    assert late.wait(1.0) and late.success is False
+    assert pool.stats()['queue_depth'] == 0
+    
+    pool.stop()
+    assert waits(pool)
+
+# stop() con un brazo que ya quedó fuera de línea: wait() no debe quedar esperando marcas de fin sin tomar.
+def test_wait_after_stop(ptyfirmware, quiet):
+    emulator = ptyfirmware()
+    pool = PlotterPool(devices=[emulator.device, UNPLUGGED], sender_options=SENDER_OPTIONS)
+    jobs = [pool.submit(samplegcode(20, seed=k)) for k in range(3)]
+    
+    assert waits(pool)
+    pool.stop()
+    
+    assert waits(pool)
+    assert all(job.success for job in jobs)
+    assert pool.stats()['queue_depth'] == 0
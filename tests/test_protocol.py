@@ -0,0 +1,116 @@
+import io
+import contextlib
+
+import pytest
+
+from protocol import (ProtocolEmulator, crc8, encodeframe, encodeline, decodeframe, describe, parsecommand, samplegcode,
+    FRAME_SYNC, FRAME_SIZE, OP_MOVE, OP_ABSOLUTE, OP_RELATIVE, COMMAND_TIMEOUT)
+from sender import GcodeSender
+
+# Reloj que avanza sólo cuando la prueba lo indica.
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+def emulator():
+    clock = Clock()
+    emulator = ProtocolEmulator(clock=clock)
+    emulator.connect()
+    return emulator, clock
+
+# Todas las respuestas que el emulador tiene listas después de "seconds".
+def replies(emulator, clock, seconds=1.0):
+    clock.now += seconds
+    return emulator.recv(emulator.available())
+
+def test_crc8_check_value():
+    # Valor de verificación de CRC-8 con polinomio 0x07 y valor inicial 0.
+    assert crc8(b'123456789') == 0xF4
+
+@pytest.mark.parametrize('line', ['G1 X12.34 Y-5.67', 'G0 X0 Y0', 'G1 F300 X-327.68 Y327.67', 'G90', 'G91'])
+def test_frame_round_trip(line):
+    data = encodeline(line)
+    assert len(data) == FRAME_SIZE and data[0] == FRAME_SYNC
+    
+    em, clock = emulator()
+    em.send(data)
+    
+    assert replies(em, clock) == b'ok\r\n'
+    assert em.commands == [parsecommand(line)]
+
+def test_inexact_coordinates_stay_ascii():
+    assert encodeline('G1 X1.005 Y2') == b'G1 X1.005 Y2\n'
+    assert encodeline('G1 X400 Y2') == b'G1 X400 Y2\n'
+
+def test_describe():
+    assert describe(encodeline('G1 X1.5 Y-2')) == 'G1 X1.50 Y-2.00 [trama]'
+    assert describe(encodeframe(OP_ABSOLUTE)) == 'G90 [trama]'
+    assert describe(encodeframe(OP_RELATIVE)) == 'G91 [trama]'
+    assert describe(b'G1 X1 Y2\n') == 'G1 X1 Y2'
+
+def test_corrupted_crc_is_rejected():
+    frame = encodeframe(OP_MOVE, 100, 200)
+    bad = frame[:-1] + bytes((frame[-1] ^ 0x80,))
+    assert decodeframe(bad) is None
+    
+    em, clock = emulator()
+    em.send(bad)
+    
+    assert replies(em, clock) == b'error: checksum\r\n'
+    assert em.commands == []
+    assert em.stats['checksum_errors'] == 1
+
+def test_corrupted_frames_fail_the_job():
+    em = ProtocolEmulator(corrupt=1.0)
+    em.connect()
+    sender = GcodeSender(em, binary=True)
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not sender.send(samplegcode(50))
+    
+    assert sender.error.startswith('error:')
+    assert sender.stats['errors'] == 1
+
+# Bytes sueltos antes de una trama: se informa el error y la trama siguiente se decodifica igual.
+def test_stray_bytes_resync_on_frame_sync():
+    em, clock = emulator()
+    em.send(b'\x13\x37' + encodeframe(OP_MOVE, 100, 200))
+    
+    assert replies(em, clock) == b'error: sync\r\nok\r\n'
+    assert em.commands == [(OP_MOVE, 1.0, 2.0)]
+
+# Una trama a la que le falta un byte se completa con el FRAME_SYNC de la siguiente: el CRC falla y el firmware
+# vuelve a buscar FRAME_SYNC dentro de esos bytes, así que sólo se pierde la trama dañada.
+def test_lost_byte_costs_one_frame():
+    first = encodeframe(OP_MOVE, 100, 200)
+    second = encodeframe(OP_MOVE, 300, 400)
+    
+    em, clock = emulator()
+    em.send(first[:3] + first[4:] + second)
+    
+    assert replies(em, clock) == b'error: checksum\r\nok\r\n'
+    assert em.commands == [(OP_MOVE, 3.0, 4.0)]
+
+# Un FRAME_SYNC dañado deja el resto de la trama como bytes sueltos: se descartan hasta el siguiente salto de línea.
+def test_damaged_sync_discards_until_newline():
+    frame = encodeframe(OP_MOVE, 100, 200)
+    
+    em, clock = emulator()
+    em.send(b'%' + frame[1:] + b'G1 X1 Y2\nG1 X3 Y4\n')
+    
+    assert replies(em, clock) == b'error: line\r\nok\r\n'
+    assert em.commands == [(OP_MOVE, 3.0, 4.0)]
+
+def test_incomplete_command_times_out():
+    em, clock = emulator()
+    em.send(b'G1 X1')
+    
+    assert replies(em, clock, COMMAND_TIMEOUT / 2) == b''
+    assert replies(em, clock, COMMAND_TIMEOUT) == b'error: timeout\r\n'
+    
+    em.send(b'G1 X1 Y2\n')
+    assert replies(em, clock) == b'ok\r\n'
+    assert em.commands == [(OP_MOVE, 1.0, 2.0)]
@@ -0,0 +1,115 @@
+import io
+import contextlib
+
+from arduino import Arduino
+from protocol import samplegcode, FRAME_SYNC
+from sender import GcodeSender, FIRMWARE_IDLE, FIRMWARE_SETTLE
+from emulator import Firmware, simulate, emulatedsend
+from conftest import PTY_SPEED
+
+LINES = samplegcode(120, seed=3)
+
+# Firmware que pierde los envíos indicados (por número, desde 0), como si no hubieran llegado.
+class LossyFirmware(Firmware):
+    def __init__(self, drop, **options):
+        super().__init__(**options)
+        self.drop = set(drop)
+        self.sends = 0
+    
+    def send(self, data):
+        n = self.sends
+        self.sends += 1
+        if n in self.drop:
+            return len(data)
+        return super().send(data)
+
+# Firmware que altera un bit del CRC de la trama número "frame" (desde 0).
+class CorruptFirmware(Firmware):
+    def __init__(self, frame, **options):
+        super().__init__(**options)
+        self.frame = frame
+        self.frames = 0
+    
+    def send(self, data):
+        if data[:1] == bytes((FRAME_SYNC,)):
+            if self.frames == self.frame:
+                data = data[:-1] + bytes((data[-1] ^ 0x01,))
+            self.frames += 1
+        return super().send(data)
+
+def test_simulate_clean_send():
+    result = simulate(LINES)
+    
+    assert result['success']
+    assert result['error'] is None
+    assert result['overflow'] == 0
+    assert result['lines'] == len(LINES)
+    assert result['commands'] == len(LINES)
+
+def test_emulatedsend_clean_send(ptyfirmware):
+    success, stats, firmware = emulatedsend(LINES, speed=PTY_SPEED)
+    
+    assert success
+    assert stats['acked'] == len(LINES)
+    assert stats['retries'] == 0
+    assert firmware['overflow'] == 0
+    assert firmware['commands'] == len(LINES)
+
+# Enviando de a una línea, la línea perdida no tiene respuesta: tras el tiempo de espera se reenvía.
+def test_timeout_without_answers_resends():
+    firmware = LossyFirmware([5])
+    result = simulate(LINES, rx_buffer=0, firmware=firmware)
+    
+    assert result['success']
+    assert result['lines'] == len(LINES) + 1
+    assert result['commands'] == len(LINES)
+
+# Con varias líneas en vuelo, el "ok" de la siguiente confirma a la perdida y el firmware queda sin responder a la
+# última: no se sabe qué línea reenviar, así que el envío falla.
+def test_timeout_with_some_answers_fails_with_sync():
+    firmware = LossyFirmware([8])
+    result = simulate(LINES, firmware=firmware)
+    
+    assert not result['success']
+    assert result['error'] == 'sync'
+    assert result['commands'] < len(LINES)
+
+def test_error_response_fails_the_job():
+    firmware = CorruptFirmware(4)
+    result = simulate(LINES, binary=True, firmware=firmware)
+    
+    assert not result['success']
+    assert result['error'] == 'error: checksum'
+    assert result['checksum_errors'] == 1
+
+# Respuestas atrasadas de un trabajo anterior: el firmware todavía está ejecutando comandos cuando empieza el
+# siguiente envío, y sus "ok" no deben confirmar las líneas nuevas.
+def test_stale_replies_are_discarded():
+    firmware = Firmware(clock=lambda: 0.0)
+    firmware.connect()
+    firmware.send(b'G90\nG1 X0 Y100\nG1 X80 Y80\nG1 X0 Y160\n')
+    result = simulate(LINES, firmware=firmware)
+    
+    assert result['success']
+    assert result['commands'] == len(LINES) + 4
+
+# Lo mismo con el puerto abierto entre dos trabajos: el primero falla por tiempo de espera con líneas en vuelo (sin
+# esperar a que el firmware termine) y el segundo empieza enseguida.
+def test_stale_replies_on_open_port(ptyfirmware):
+    emulator = ptyfirmware()
+    arduino = Arduino(device=emulator.device)
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert arduino.connect()
+        try:
+            first = GcodeSender(arduino, timeout=0.005, retries=0, idle=0.0, settle=FIRMWARE_SETTLE / PTY_SPEED)
+            assert not first.send(LINES)
+            assert first.error == 'timeout'
+            
+            second = GcodeSender(arduino, idle=FIRMWARE_IDLE / PTY_SPEED, settle=FIRMWARE_SETTLE / PTY_SPEED)
+            success = second.send(LINES)
+        finally:
+            arduino.disconnect()
+    
+    assert success, second.error
+    assert second.stats['acked'] == len(LINES)